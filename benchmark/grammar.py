@@ -0,0 +1,77 @@
+from pathlib import Path
+from colorama import Fore
+import timeit
+import pandas as pd
+
+from blendsql.grammars._peg_grammar import grammar
+from blendsql.grammars._scanner import scan_ingredients
+
+NUM_ITER_PER_QUERY = 5
+# Number of times we repeat each query, to get long inputs
+QUERY_REPEATS = [1, 10, 50]
+
+
+def nested_query(depth: int) -> str:
+    """An ingredient whose context arg is a subquery containing `depth` nested ingredient subqueries."""
+    query = "SELECT * FROM documents WHERE documents MATCH 'sydney OR 120'"
+    for i in range(depth):
+        query = f"""SELECT title FROM documents WHERE title IN (
+            {query}
+        ) AND {{{{LLMMap('Is this about {i}?', 'documents::title', options=(SELECT DISTINCT title FROM documents))}}}}"""
+    return f"""SELECT * FROM w WHERE city = {{{{
+        LLMQA(
+            'Which city is located 120 miles west of Sydney?',
+            ({query}),
+            options='w::city'
+        )
+    }}}}"""
+
+
+if __name__ == "__main__":
+    print(f"Averaging based on {NUM_ITER_PER_QUERY} iterations per query...")
+    queries = {
+        query_file.parent.parent.name + "/" + query_file.stem: open(query_file).read()
+        for query_file in sorted(Path(__file__).parent.glob("*/queries/*.sql"))
+    }
+    inputs = {}
+    for repeats in QUERY_REPEATS:
+        inputs[f"all benchmark queries x{repeats}"] = "\nUNION ALL\n".join(
+            list(queries.values()) * repeats
+        )
+    for depth in [5, 20]:
+        inputs[f"nested subquery args (depth {depth})"] = nested_query(depth)
+    names, lengths, num_ingredients = [], [], []
+    pyparsing_times, scanner_times = [], []
+    for name, query in inputs.items():
+        print(f"Running {name}...")
+        # Make sure both find exactly the same ingredients
+        expected = [(r.as_dict(), s, e) for r, s, e in grammar.scanString(query)]
+        assert list(scan_ingredients(query)) == expected
+        names.append(name)
+        lengths.append(len(query))
+        num_ingredients.append(len(expected))
+        pyparsing_times.append(
+            timeit.timeit(
+                lambda query=query: list(grammar.scanString(query)),
+                number=NUM_ITER_PER_QUERY,
+            )
+            / NUM_ITER_PER_QUERY
+        )
+        scanner_times.append(
+            timeit.timeit(
+                lambda query=query: list(scan_ingredients(query)),
+                number=NUM_ITER_PER_QUERY,
+            )
+            / NUM_ITER_PER_QUERY
+        )
+    df = pd.DataFrame(
+        {
+            "Query": names,
+            "# Chars": lengths,
+            "# Ingredients": num_ingredients,
+            "pyparsing (s)": pyparsing_times,
+            "scan_ingredients (s)": scanner_times,
+            "Speedup": [p / s for p, s in zip(pyparsing_times, scanner_times)],
+        }
+    )
+    print(Fore.GREEN + df.to_markdown(index=False) + Fore.RESET)
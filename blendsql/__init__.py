@@ -1,2 +1,2 @@
 from .ingredients.builtin import LLMMap, LLMQA, LLMJoin, LLMValidate, ImageCaption
-from .blend import blend
+from .blend import blend, ablend, blend_iter
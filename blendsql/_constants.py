@@ -11,7 +11,23 @@ class StrInMeta(EnumMeta):
 
 DEFAULT_ANS_SEP = ";"
 DEFAULT_NAN_ANS = "-"
+# Used for `LLMMap` batches when the Model has no `map_batch_token_budget`
 MAP_BATCH_SIZE = 15
+# Default number of value + answer tokens in a single `LLMMap` batch
+MAP_BATCH_TOKEN_BUDGET = 1024
+MAP_MAX_BATCH_SIZE = 100
+# Our guess for the length of an `LLMMap` answer, when there are no `options`
+MAP_DEFAULT_ANSWER_TOKENS = 15
+# Default number of tokens of context passed to `LLMQA`
+QA_CONTEXT_TOKEN_BUDGET = 4096
+# Number of right values we consider as candidates for each left value in `LLMJoin`
+JOIN_NUM_CANDIDATES = 10
+# Max number of left values sent in a single `LLMJoin` prompt
+JOIN_BLOCK_SIZE = 20
+# Min cosine similarity for `JoinIngredient` to align two values without calling the Model
+JOIN_FUZZY_MATCH_THRESHOLD = 0.6
+# Default number of rows in each chunk yielded by `blend_iter()`
+DEFAULT_STREAM_CHUNKSIZE = 10_000
 
 
 class IngredientType(str, Enum, metaclass=StrInMeta):
@@ -0,0 +1,187 @@
+from typing import Dict, Iterable, List, Optional, Set, Tuple, TYPE_CHECKING
+import numpy as np
+from scipy import sparse
+
+if TYPE_CHECKING:
+    from .db import Database
+
+# Lengths of the character n-grams we index
+NGRAM_RANGE = (2, 4)
+
+
+def get_ngrams(value: str, ngram_range: Tuple[int, int] = NGRAM_RANGE) -> List[str]:
+    """Character n-grams of each whitespace-padded word in `value`.
+    Equivalent to scikit-learn's `TfidfVectorizer(analyzer="char_wb")`.
+
+    Examples:
+        ```python
+        get_ngrams("Bob Brown", ngram_range=(2, 2))
+        ```
+        ```text
+        [' b', 'bo', 'ob', 'b ', ' b', 'br', 'ro', 'ow', 'wn', 'n ']
+        ```
+    """
+    ngrams = []
+    for word in value.lower().split():
+        word = f" {word} "
+        for n in range(ngram_range[0], ngram_range[1] + 1):
+            ngrams.extend(word[start : start + n] for start in range(len(word) - n + 1))
+            # A word no longer than `n` is only counted once
+            if len(word) <= n:
+                if len(word) < n:
+                    ngrams.append(word)
+                break
+    return ngrams
+
+
+def get_data_version(values: List[str]) -> Tuple[int, int]:
+    """Cheap fingerprint of the values of a column: their count, and total length."""
+    return (len(values), sum(len(str(value)) for value in values))
+
+
+class FuzzyIndex:
+    """Sparse TF-IDF matrix over the character n-grams of a set of values,
+    for finding the closest values to a batch of queries by cosine similarity.
+
+    Building the index is the expensive part, so `get_fuzzy_index()` keeps
+    the index of each table column around on the catalog of its database.
+
+    Args:
+        values: The values to index. Duplicates are dropped, and values are stored sorted.
+    """
+
+    def __init__(self, values: Iterable[str]):
+        self.values: List[str] = sorted(set(map(str, values)))
+        self.vocabulary: Dict[str, int] = {}
+        rows, cols = [], []
+        for row, value in enumerate(self.values):
+            for ngram in get_ngrams(value):
+                rows.append(row)
+                cols.append(self.vocabulary.setdefault(ngram, len(self.vocabulary)))
+        counts = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(self.values), len(self.vocabulary)),
+        )
+        # Smoothed inverse document frequency, as in scikit-learn
+        document_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        self.idf = np.log((1 + len(self.values)) / (1 + document_frequency)) + 1
+        # Store transposed, so queries are a single (queries x ngrams) @ (ngrams x values) product
+        self.matrix = self._normalize(counts.multiply(self.idf).tocsr()).T.tocsr()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @staticmethod
+    def _normalize(matrix: sparse.csr_matrix) -> sparse.csr_matrix:
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        return sparse.diags(1 / norms) @ matrix
+
+    def transform(self, queries: List[str]) -> sparse.csr_matrix:
+        """Vectorizes `queries` with the vocabulary of the index.
+        N-grams which never appear in the indexed values are ignored.
+        """
+        rows, cols = [], []
+        for row, query in enumerate(queries):
+            for ngram in get_ngrams(str(query)):
+                col = self.vocabulary.get(ngram)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+        counts = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(queries), len(self.vocabulary)),
+        )
+        return self._normalize(counts.multiply(self.idf).tocsr())
+
+    def top_k(
+        self,
+        queries: List[str],
+        k: int,
+        exclude: Optional[Set[str]] = None,
+        chunk_size: int = 1024,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Finds the `k` indexed values most similar to each query, best match first.
+
+        Args:
+            queries: The strings to match against the index
+            k: Number of matches to return for each query
+            exclude: Optional indexed values which shouldn't be returned as matches
+            chunk_size: Number of queries scored at once, so we never hold the
+                full (queries x values) similarity matrix in memory
+
+        Returns:
+            Tuple of (indices into `self.values`, cosine similarities), each with shape (len(queries), k)
+        """
+        k = min(k, len(self.values))
+        excluded = None
+        if exclude:
+            excluded = np.array([value in exclude for value in self.values])
+        indices, similarities = [], []
+        for start in range(0, len(queries), chunk_size):
+            chunk_similarities = (
+                self.transform(queries[start : start + chunk_size]) @ self.matrix
+            ).toarray()
+            if excluded is not None:
+                chunk_similarities[:, excluded] = -1
+            chunk_indices = np.argpartition(-chunk_similarities, k - 1, axis=1)[:, :k]
+            chunk_similarities = np.take_along_axis(
+                chunk_similarities, chunk_indices, axis=1
+            )
+            order = np.argsort(-chunk_similarities, axis=1, kind="stable")
+            indices.append(np.take_along_axis(chunk_indices, order, axis=1))
+            similarities.append(np.take_along_axis(chunk_similarities, order, axis=1))
+        if len(indices) == 0:
+            return (np.empty((0, k), dtype=int), np.empty((0, k)))
+        return (np.vstack(indices), np.vstack(similarities))
+
+    def best_matches(
+        self,
+        queries: List[str],
+        threshold: float,
+        exclude: Optional[Set[str]] = None,
+    ) -> Dict[str, str]:
+        """Maps each query to its most similar indexed value,
+        if their cosine similarity is at least `threshold`.
+
+        Examples:
+            ```python
+            index = FuzzyIndex(["bob brown (ice hockey)", "ron ryan", "colby mules"])
+            index.best_matches(["bob brown", "joshua fields"], threshold=0.5)
+            ```
+            ```text
+            {'bob brown': 'bob brown (ice hockey)'}
+            ```
+        """
+        if len(queries) == 0 or len(self.values) == 0:
+            return {}
+        indices, similarities = self.top_k(queries, k=1, exclude=exclude)
+        return {
+            query: self.values[idx]
+            for query, idx, similarity in zip(
+                queries, indices[:, 0], similarities[:, 0]
+            )
+            if similarity >= threshold
+        }
+
+
+def get_fuzzy_index(
+    db: "Database", tablename: str, columnname: str, values: List[str]
+) -> FuzzyIndex:
+    """Returns a `FuzzyIndex` over `values`, the distinct values of 'tablename.columnname'.
+
+    The index is cached on `db.catalog`, so it's dropped when a statement modifies
+    'tablename'. Since the table may also change without us seeing the statement
+    (e.g. from another connection), it's rebuilt if `get_data_version(values)` changed.
+    """
+    data_version = get_data_version(values)
+    # Maps the data version to its index. We only ever hold the latest one
+    indexes: Dict[Tuple[int, int], FuzzyIndex] = db.catalog.get_or_compute(
+        f"fuzzy_index||{tablename}||{columnname}", dict, tablename=tablename
+    )
+    index = indexes.get(data_version)
+    if index is None:
+        index = FuzzyIndex(values)
+        indexes.clear()
+        indexes[data_version] = index
+    return index
@@ -0,0 +1,113 @@
+import re
+import copy
+import hashlib
+from typing import Dict, Iterable, Optional, Set
+from attr import attrs, attrib
+from sqlglot import exp
+
+from ._constants import IngredientKwarg
+from .models._cache import MemoryCache
+from .models._model import Model
+from .ingredients.ingredient import Ingredient
+from .parse import _parse_one
+
+# Max number of distinct queries we hold plans for
+PLAN_CACHE_SIZE = 1024
+# Max number of parsed subqueries we hold per plan
+MAX_SUBQUERIES_PER_PLAN = 64
+
+
+@attrs
+class QueryPlan:
+    """Everything derived from the text of a BlendSQL query before we touch any data.
+    Stored in `plan_cache`, so repeated queries can skip straight to execution.
+
+    Attributes:
+        query: The query after `preprocess_blendsql()` and `autowrap_query()`
+        ingredient_alias_to_parsed_dict: Output of `preprocess_blendsql()`, without any `Model` attached
+        tables_in_ingredients: Output of `preprocess_blendsql()`
+        node: The parsed (and, optionally, qualified) query
+    """
+
+    query: str = attrib()
+    ingredient_alias_to_parsed_dict: Dict[str, dict] = attrib()
+    tables_in_ingredients: Set[str] = attrib()
+    node: exp.Expression = attrib()
+    subquery_nodes: Dict[str, exp.Expression] = attrib(factory=dict)
+
+    @classmethod
+    def create(
+        cls,
+        query: str,
+        ingredient_alias_to_parsed_dict: Dict[str, dict],
+        tables_in_ingredients: Set[str],
+        node: exp.Expression,
+    ) -> "QueryPlan":
+        return cls(
+            query=query,
+            ingredient_alias_to_parsed_dict=copy.deepcopy(
+                {
+                    alias: parsed_results_dict
+                    | {
+                        "kwargs_dict": {
+                            k: v
+                            for k, v in parsed_results_dict["kwargs_dict"].items()
+                            if k != IngredientKwarg.MODEL
+                        }
+                    }
+                    for alias, parsed_results_dict in ingredient_alias_to_parsed_dict.items()
+                }
+            ),
+            tables_in_ingredients=set(tables_in_ingredients),
+            node=node.copy(),
+        )
+
+    def get_node(self) -> exp.Expression:
+        return self.node.copy()
+
+    def get_ingredient_alias_to_parsed_dict(
+        self, default_model: Optional[Model]
+    ) -> Dict[str, dict]:
+        """Returns a fresh copy of the parsed ingredients, with `default_model` attached
+        in the same way as `preprocess_blendsql()`.
+        """
+        ingredient_alias_to_parsed_dict = copy.deepcopy(
+            self.ingredient_alias_to_parsed_dict
+        )
+        for parsed_results_dict in ingredient_alias_to_parsed_dict.values():
+            parsed_results_dict["kwargs_dict"][IngredientKwarg.MODEL] = default_model
+        return ingredient_alias_to_parsed_dict
+
+    def parse_subquery(self, subquery_str: str) -> exp.Expression:
+        """Equivalent to `_parse_one(subquery_str)`, but only parses each distinct subquery once."""
+        node = self.subquery_nodes.get(subquery_str, None)
+        if node is None:
+            node = _parse_one(subquery_str)
+            if len(self.subquery_nodes) < MAX_SUBQUERIES_PER_PLAN:
+                self.subquery_nodes[subquery_str] = node
+        return node.copy()
+
+
+def get_plan_key(
+    query: str, schema_fingerprint: Optional[str], ingredients: Iterable[Ingredient]
+) -> str:
+    """Generates the key for a query's plan in `plan_cache`.
+
+    Queries which differ only in whitespace share a plan. Since the plan depends on
+    the names and types of the available ingredients, as well as the database schema
+    used to qualify columns (via `Database.schema_fingerprint`), these are included in the key.
+    """
+    hasher = hashlib.md5()
+    combined = "{}||{}||{}".format(
+        re.sub(r"(\s+)", " ", query).strip(),
+        schema_fingerprint,
+        sorted(
+            (ingredient.name, str(ingredient.ingredient_type))
+            for ingredient in ingredients
+        ),
+    ).encode()
+    hasher.update(combined)
+    return hasher.hexdigest()
+
+
+plan_cache = MemoryCache(max_size=PLAN_CACHE_SIZE)
@@ -0,0 +1,73 @@
+from typing import Callable, Dict, List, Set, TypeVar
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+
+from ._trace import bind_current_context
+
+T = TypeVar("T")
+
+
+def run_in_dependency_order(
+    tasks: List[Callable[[], T]],
+    dependencies: List[Set[int]],
+    on_complete: Callable[[int, T], None],
+    max_workers: int = 1,
+) -> None:
+    """Executes a DAG of tasks, running independent tasks in parallel.
+
+    A task is only submitted once all the tasks it depends on have completed.
+    `on_complete` is always called from the calling thread, in the order of `tasks`.
+    A task counts as completed once `on_complete` has been called on its output,
+    so any side effects of `on_complete` are visible to its dependents.
+
+    Args:
+        tasks: Zero-argument callables to execute
+        dependencies: For each task, the indices of earlier tasks it needs to wait on
+        on_complete: Called with (task index, task output) for each task
+        max_workers: Max number of tasks to run at once.
+            With `max_workers=1`, tasks are simply executed one-by-one, in order.
+
+    Examples:
+        ```python
+        run_in_dependency_order(
+            tasks=[lambda: "a", lambda: "b", lambda: "c"],
+            # 'c' needs to wait for 'a', 'b' can run whenever
+            dependencies=[set(), set(), {0}],
+            on_complete=lambda idx, out: print(idx, out),
+            max_workers=2,
+        )
+        ```
+    """
+    assert len(tasks) == len(dependencies)
+    if max_workers <= 1 or len(tasks) <= 1:
+        for idx, task in enumerate(tasks):
+            on_complete(idx, task())
+        return
+    completed: Set[int] = set()
+    submitted: Dict[Future, int] = {}
+    # Outputs which finished ahead of an earlier task, and are waiting on `on_complete`
+    outputs: Dict[int, T] = {}
+    next_to_complete = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            while next_to_complete < len(tasks):
+                for idx, task in enumerate(tasks):
+                    if (
+                        idx in completed
+                        or idx in outputs
+                        or idx in submitted.values()
+                        or not dependencies[idx].issubset(completed)
+                    ):
+                        continue
+                    submitted[executor.submit(bind_current_context(task))] = idx
+                done, _ = wait(submitted, return_when=FIRST_COMPLETED)
+                for future in done:
+                    # Raise any exception from the worker thread here
+                    outputs[submitted.pop(future)] = future.result()
+                while next_to_complete in outputs:
+                    on_complete(next_to_complete, outputs.pop(next_to_complete))
+                    completed.add(next_to_complete)
+                    next_to_complete += 1
+        except BaseException:
+            for future in submitted:
+                future.cancel()
+            raise
@@ -1,10 +1,11 @@
 from dataclasses import dataclass, field
-from typing import List, Iterable, Type
+from typing import List, Iterable, Iterator, Optional, Type
 import pandas as pd
 
 from .ingredients import Ingredient
 from .utils import tabulate
 from .db.utils import truncate_df_content
+from ._trace import Trace
 
 
 class PrettyDataFrame(pd.DataFrame):
@@ -26,14 +27,20 @@ class SmoothieMeta:
     db_url: str
     contains_ingredient: bool = True
     process_time_seconds: float = field(init=False)
+    # Timing of each step of execution, if `blend()` was called with `trace=True`
+    trace: Optional[Trace] = field(default=None, init=False)
 
 
 @dataclass
 class Smoothie:
-    df: pd.DataFrame
+    df: Optional[pd.DataFrame]
     meta: SmoothieMeta
+    # Set instead of `df`, if `blend()` was called with `to_arrow=True`
+    arrow: Optional["pyarrow.Table"] = None
 
     def __post_init__(self):
+        if self.df is None and self.arrow is not None:
+            return
         self.df = PrettyDataFrame(self.df)
 
     def summary(self):
@@ -51,3 +58,32 @@ class Smoothie:
             )
         )
         return s
+
+
+@dataclass
+class SmoothieStream:
+    """Returned by `blend_iter()`. Iterating yields the result of the query as `pd.DataFrame` chunks.
+
+    `meta` is set once the first chunk is yielded. Call `close()` (or exit the `with` block)
+    to stop early and close its session of the `Database`.
+    """
+
+    chunks: Optional[Iterator[pd.DataFrame]] = None
+    meta: Optional[SmoothieMeta] = None
+
+    def __iter__(self) -> Iterator[pd.DataFrame]:
+        return self.chunks
+
+    def close(self):
+        self.chunks.close()
+
+    def __enter__(self) -> "SmoothieStream":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def to_smoothie(self) -> Smoothie:
+        """Collects all remaining chunks into a regular `Smoothie`."""
+        df = pd.concat(list(self.chunks) or [pd.DataFrame()], ignore_index=True)
+        return Smoothie(df=df, meta=self.meta)
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import inspect
+import threading
+from contextlib import nullcontext
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from pathlib import Path
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Union
+
+# The span new spans get attached to. Stays `None` unless we're inside a `Trace`,
+#   so that tracing costs a single lookup when it's disabled.
+_current_span: ContextVar[Optional["Span"]] = ContextVar(
+    "blendsql_current_span", default=None
+)
+_NULL_CONTEXT = nullcontext()
+
+
+class Span:
+    """A single timed step of execution, with any nested steps as `children`."""
+
+    __slots__ = (
+        "name",
+        "attributes",
+        "children",
+        "start",
+        "end",
+        "thread_id",
+        "_token",
+    )
+
+    def __init__(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.attributes = attributes if attributes is not None else {}
+        self.children: List[Span] = []
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.thread_id = threading.get_ident()
+
+    @property
+    def duration_seconds(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def to_dict(self, _origin: Optional[float] = None) -> dict:
+        origin = self.start if _origin is None else _origin
+        return {
+            "name": self.name,
+            "start_seconds": self.start - origin,
+            "duration_seconds": self.duration_seconds,
+            "attributes": self.attributes,
+            "children": [child.to_dict(_origin=origin) for child in self.children],
+        }
+
+    def __enter__(self) -> "Span":
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        _current_span.reset(self._token)
+
+
+class Trace:
+    """Records a hierarchical timing trace of everything executed within its context.
+
+    Examples:
+        ```python
+        from blendsql import blend, LLMMap
+
+        smoothie = blend(query=query, db=db, ingredients={LLMMap}, trace=True)
+        # Total seconds spent in each type of step
+        print(smoothie.meta.trace.seconds_by_name())
+        # View in chrome://tracing or https://ui.perfetto.dev
+        smoothie.meta.trace.to_chrome_trace("trace.json")
+        ```
+    """
+
+    def __init__(self, name: str = "blend"):
+        self.root = Span(name)
+
+    def __enter__(self) -> "Trace":
+        self.root.start = time.perf_counter()
+        self.root.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.root.__exit__(exc_type, exc_value, traceback)
+
+    def iter_spans(self):
+        stack = [self.root]
+        while stack:
+            span = stack.pop()
+            yield span
+            stack.extend(reversed(span.children))
+
+    def seconds_by_name(self) -> Dict[str, float]:
+        """Sums the duration of all spans sharing the same name.
+        Nested spans are included in the duration of their parent, too.
+        """
+        totals: Dict[str, float] = {}
+        for span in self.iter_spans():
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_seconds
+        return totals
+
+    def to_dict(self) -> dict:
+        return self.root.to_dict()
+
+    def to_json(self, path: Optional[Union[str, Path]] = None, **kwargs) -> str:
+        """Serializes the trace as nested JSON, optionally writing it to `path`."""
+        s = json.dumps(self.to_dict(), default=str, **kwargs)
+        if path is not None:
+            Path(path).write_text(s)
+        return s
+
+    def to_chrome_trace(self, path: Optional[Union[str, Path]] = None) -> dict:
+        """Converts the trace to the Chrome Trace Event format, optionally writing it to `path`.
+        These can be opened in chrome://tracing or https://ui.perfetto.dev.
+        """
+        pid = os.getpid()
+        thread_ids: Dict[int, int] = {}
+        events = []
+        for span in self.iter_spans():
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": "blendsql",
+                    "ph": "X",
+                    "ts": (span.start - self.root.start) * 1e6,
+                    "dur": span.duration_seconds * 1e6,
+                    "pid": pid,
+                    "tid": thread_ids.setdefault(span.thread_id, len(thread_ids)),
+                    "args": span.attributes,
+                }
+            )
+        chrome_trace = {"traceEvents": events, "displayTimeUnit": "ms"}
+        if path is not None:
+            Path(path).write_text(json.dumps(chrome_trace, default=str))
+        return chrome_trace
+
+
+def span(name: str, **attributes) -> ContextManager[Optional[Span]]:
+    """Times the enclosed block as a child of the current span.
+    If we're not recording a `Trace`, this does nothing.
+
+    Examples:
+        ```python
+        with span("parse", query=query):
+            ...
+        ```
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return _NULL_CONTEXT
+    child = Span(name, attributes)
+    parent.children.append(child)
+    return child
+
+
+def set_span_attributes(**attributes) -> None:
+    """Adds attributes to the current span, if we're recording a `Trace`."""
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def traced(name: str, *arg_names: str) -> Callable:
+    """Decorator which wraps each call to the function in a span.
+
+    Args:
+        name: Name of the span
+        *arg_names: Names of arguments to the function to record as span attributes
+    """
+
+    def decorator(fn: Callable) -> Callable:
+        signature = inspect.signature(fn)
+
+        def get_attributes(args, kwargs) -> Dict[str, Any]:
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            return {k: bound[k] for k in arg_names if k in bound}
+
+        if inspect.iscoroutinefunction(fn):
+
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _current_span.get() is None:
+                    return await fn(*args, **kwargs)
+                with span(name, **get_attributes(args, kwargs)):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _current_span.get() is None:
+                return fn(*args, **kwargs)
+            with span(name, **get_attributes(args, kwargs)):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def bind_current_context(fn: Callable) -> Callable:
+    """Returns a version of `fn` which runs in a copy of the current context,
+    even when called from another thread (e.g. by a `ThreadPoolExecutor`).
+    This way, its spans are attached to the current span, and its Model calls
+    are still sent to the event loop of the current `ablend()` call.
+    """
+    context = copy_context()
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        # A context can't be entered by many threads at once, so each call gets its own copy
+        return context.copy().run(fn, *args, **kwargs)
+
+    return wrapper
@@ -1,10 +1,12 @@
 import copy
+import asyncio
 import logging
 import time
 import uuid
 import pandas as pd
 import re
 from typing import (
+    Any,
     Dict,
     List,
     Set,
@@ -13,17 +15,19 @@ from typing import (
     Optional,
     Callable,
     Type,
+    Union,
 )
 from collections.abc import Collection, Iterable
 from attr import attrs, attrib
 from functools import partial
+from contextlib import contextmanager, nullcontext
 from sqlglot import exp
+from sqlglot.errors import ParseError
 from colorama import Fore
 import string
 
 from ._logger import logger
 from .utils import (
-    sub_tablename,
     get_temp_session_table,
     get_temp_subquery_table,
     recover_blendsql,
@@ -44,11 +48,14 @@ from .parse import (
     get_first_child,
 )
 from .parse._constants import MODIFIERS
-from .grammars._peg_grammar import grammar
+from .grammars._scanner import scan_ingredients
 from .ingredients.ingredient import Ingredient, IngredientException
-from ._smoothie import Smoothie, SmoothieMeta
-from ._constants import IngredientType, IngredientKwarg
-from .models._model import Model
+from ._smoothie import Smoothie, SmoothieMeta, SmoothieStream, PrettyDataFrame
+from ._constants import IngredientType, IngredientKwarg, DEFAULT_STREAM_CHUNKSIZE
+from .models._model import Model, LocalModel, _event_loop
+from ._scheduler import run_in_dependency_order
+from ._plan_cache import QueryPlan, get_plan_key, plan_cache
+from ._trace import Trace, Span, span, set_span_attributes, traced
 
 
 @attrs
@@ -142,7 +149,7 @@ def autowrap_query(
 
 
 def preprocess_blendsql(query: str, default_model: Model) -> Tuple[str, dict, set]:
-    """Parses BlendSQL string with our pyparsing grammar and returns objects
+    """Parses BlendSQL string with our ingredient scanner and returns objects
     required for interpretation and execution.
 
     Args:
@@ -185,8 +192,8 @@ def preprocess_blendsql(query: str, default_model: Model) -> Tuple[str, dict, se
     ingredient_str_to_alias: Dict[str, str] = {}
     tables_in_ingredients: Set[str] = set()
     query = re.sub(r"(\s+)", " ", query)
-    reversed_scan_res = [scan_res for scan_res in grammar.scanString(query)][::-1]
-    for idx, (parse_results, start, end) in enumerate(reversed_scan_res):
+    reversed_scan_res = [scan_res for scan_res in scan_ingredients(query)][::-1]
+    for idx, (parsed_dict, start, end) in enumerate(reversed_scan_res):
         original_ingredient_string = query[start:end]
         # If we're in between parentheses, add a `SELECT`
         # This way it gets picked up as a subquery to parse later
@@ -203,7 +210,7 @@ def preprocess_blendsql(query: str, default_model: Model) -> Tuple[str, dict, se
                 original_ingredient_string
             ]
         else:
-            parsed_results_dict = parse_results.as_dict()
+            parsed_results_dict = parsed_dict
             ingredient_aliasname = string.ascii_uppercase[idx]
             parsed_results_dict["ingredient_aliasname"] = ingredient_aliasname
             substituted_ingredient_alias = "{{" + f"{ingredient_aliasname}()" + "}}"
@@ -274,6 +281,25 @@ def preprocess_blendsql(query: str, default_model: Model) -> Tuple[str, dict, se
     return (query.strip(), ingredient_alias_to_parsed_dict, tables_in_ingredients)
 
 
+def _output_to_expression(output: Any) -> exp.Expression:
+    """Parses the SQL snippet output by a QA or String ingredient.
+    Anything we can't parse is rendered as-is.
+    """
+    try:
+        return _parse_one(str(output))
+    except ParseError:
+        return exp.Var(this=str(output))
+
+
+def _strip_duckdb_join_suffix(colname: str, column_names: Set[str]) -> str:
+    """In case of a join, duckdb formats columns with 'column_1'.
+    But some columns (e.g. 'parent_category') just have underscores in them already.
+    """
+    if colname in column_names:
+        return colname
+    return re.sub(r"_\d$", "", colname)
+
+
 def materialize_cte(
     subquery: exp.Expression,
     query_context: QueryContextManager,
@@ -308,6 +334,66 @@ def materialize_cte(
     return materialized_cte_df
 
 
+def expand_star_without_duplicates(query: str, db: Database) -> Optional[str]:
+    """Rewrites a `SELECT *` over one or many joined tables into an explicit list of columns,
+    keeping only the first occurrence of each column name.
+    This lets us materialize the results of a `JOIN` directly in the database,
+    instead of de-duplicating columns in pandas.
+
+    Args:
+        query: The `SELECT *` query to rewrite
+        db: Database used to look up the columns of each table
+
+    Returns:
+        The rewritten query, or `None` if we can't safely rewrite it.
+
+    Examples:
+        ```python
+        expand_star_without_duplicates(
+            "SELECT * FROM images JOIN w ON w.title = images.title WHERE w.year > 2000",
+            db=db
+        )
+        ```
+        ```text
+        SELECT "images"."title" AS "title", "images"."url" AS "url", "w"."year" AS "year" FROM images JOIN w ON w.title = images.title WHERE w.year > 2000
+        ```
+    """
+    try:
+        node = _parse_one(query)
+    except Exception:
+        return None
+    if (
+        not isinstance(node, exp.Select)
+        or len(node.expressions) != 1
+        or not isinstance(node.expressions[0], exp.Star)
+        or node.args.get("from") is None
+    ):
+        return None
+    tables = [node.args["from"].this] + [j.this for j in node.args.get("joins") or []]
+    if not all(isinstance(table, exp.Table) for table in tables):
+        return None
+    seen_columns: Set[str] = set()
+    expressions = []
+    for table in tables:
+        columns = list(db.iter_columns(table.name))
+        if len(columns) == 0:
+            # E.g. a CTE, which hasn't been materialized yet
+            return None
+        for column in columns:
+            if column.lower() in seen_columns:
+                continue
+            seen_columns.add(column.lower())
+            expressions.append(
+                exp.alias_(
+                    exp.column(column, table=table.alias_or_name, quoted=True),
+                    column,
+                    quoted=True,
+                )
+            )
+    node.set("expressions", expressions)
+    return recover_blendsql(node.sql(dialect=FTS5SQLite))
+
+
 def get_sorted_grammar_matches(
     q: str,
     ingredient_alias_to_parsed_dict: dict,
@@ -340,7 +426,7 @@ def get_sorted_grammar_matches(
         IngredientType.QA,
         IngredientType.JOIN,
     ]
-    parse_results = [i for i in grammar.scanString(q)]
+    parse_results = [i for i in scan_ingredients(q)]
     while len(parse_results) > 0:
         curr_ingredient_target = ooo.pop(0)
         remaining_parse_results = []
@@ -379,6 +465,183 @@ def disambiguate_and_submit_blend(
     return _blend(query=query, **kwargs)
 
 
+def _get_lazy_tablenames(
+    parsed_results_dict: dict,
+    kwargs_dict: dict,
+    lazy_tablenames: Set[str],
+    aliases_to_tablenames: Dict[str, str],
+) -> Optional[Set[str]]:
+    """Returns the names of `LazyTable` objects that an ingredient call
+    may materialize, or register via a recursive `_blend()` call.
+
+    Returns `None` if we can't tell, e.g. the subquery passed as `context` doesn't parse.
+    """
+    tablenames = set()
+    for arg in parsed_results_dict["args"] + list(kwargs_dict.values()):
+        if not isinstance(arg, str):
+            continue
+        if arg.upper().startswith(("SELECT", "WITH")):
+            try:
+                node = _parse_one(arg)
+            except Exception:
+                return None
+            tablenames |= {t.name for t in node.find_all(exp.Table)} & lazy_tablenames
+            # Aliased subqueries and CTEs get registered as `LazyTable` objects
+            #   in the recursive `_blend()` call
+            tablenames |= {
+                i.alias for i in node.find_all(exp.Subquery, exp.CTE) if i.alias
+            }
+        elif "::" in arg:
+            tablename, _ = get_tablename_colname(arg)
+            tablenames |= {
+                tablename,
+                aliases_to_tablenames.get(tablename, tablename),
+            } & lazy_tablenames
+    return tablenames
+
+
+def get_ingredient_dependencies(
+    ingredient_calls: List[Tuple[str, dict, Ingredient, dict]],
+    lazy_tablenames: Set[str],
+    aliases_to_tablenames: Dict[str, str],
+) -> List[Set[int]]:
+    """Builds the dependency graph between the ingredient calls of a single subquery.
+
+    An ingredient call needs to wait on an earlier one if:
+
+        - It is a `JoinIngredient`, since these rewrite the query's `JOIN` clauses
+
+        - Both are `MapIngredient` calls with the same question, since the name of the new column
+            depends on the columns created before it
+
+        - Both may touch the same `LazyTable` (i.e. a CTE or aliased subquery)
+
+    All other ingredient calls only read from the database, so they can be executed in parallel.
+
+    Args:
+        ingredient_calls: List of (alias_function_str, parsed_results_dict, ingredient, kwargs_dict)
+        lazy_tablenames: Names of the `LazyTable` objects on our database
+        aliases_to_tablenames: Mapping from table aliases in the subquery to their tablenames
+
+    Returns:
+        For each ingredient call, the indices of the ingredient calls it depends on
+    """
+    dependencies: List[Set[int]] = []
+    touched_tablenames: List[Optional[Set[str]]] = []
+    map_questions: List[Optional[str]] = []
+    for idx, (_, parsed_results_dict, ingredient, kwargs_dict) in enumerate(
+        ingredient_calls
+    ):
+        curr_tablenames = _get_lazy_tablenames(
+            parsed_results_dict=parsed_results_dict,
+            kwargs_dict=kwargs_dict,
+            lazy_tablenames=lazy_tablenames,
+            aliases_to_tablenames=aliases_to_tablenames,
+        )
+        curr_question = None
+        if ingredient.ingredient_type == IngredientType.MAP:
+            curr_question = (
+                parsed_results_dict["args"][0]
+                if len(parsed_results_dict["args"]) > 0
+                else kwargs_dict.get(IngredientKwarg.QUESTION, None)
+            )
+        curr_dependencies = set()
+        for prev_idx in range(idx):
+            prev_tablenames = touched_tablenames[prev_idx]
+            if (
+                ingredient.ingredient_type == IngredientType.JOIN
+                or curr_tablenames is None
+                or prev_tablenames is None
+                or len(curr_tablenames & prev_tablenames) > 0
+                or (
+                    curr_question is not None
+                    and curr_question == map_questions[prev_idx]
+                )
+            ):
+                curr_dependencies.add(prev_idx)
+        dependencies.append(curr_dependencies)
+        touched_tablenames.append(curr_tablenames)
+        map_questions.append(curr_question)
+    return dependencies
+
+
+@traced("ingredient")
+def execute_ingredient(
+    ingredient: Ingredient,
+    parsed_results_dict: dict,
+    kwargs_dict: dict,
+    ingredient_kwargs: dict,
+    **kwargs,
+) -> Tuple[Any, int]:
+    """Executes a single ingredient call.
+    First, any subqueries passed as `context` or `options` are executed via a recursive `_blend()` call.
+
+    Args:
+        ingredient: The `Ingredient` object to call
+        parsed_results_dict: Parsed representation of the ingredient call
+        kwargs_dict: The kwargs to pass to the ingredient
+        ingredient_kwargs: Session-specific kwargs (e.g. `get_temp_subquery_table`) to pass to the ingredient
+        **kwargs: Passed to any recursive `_blend()` call
+
+    Returns:
+        Tuple containing the ingredient output, and the number of values passed to ingredients in recursive calls
+    """
+    logger.debug(
+        Fore.CYAN
+        + "Executing "
+        + Fore.LIGHTCYAN_EX
+        + f" `{parsed_results_dict['raw']}`..."
+        + Fore.RESET
+    )
+    set_span_attributes(
+        ingredient=ingredient.name,
+        ingredient_type=str(ingredient.ingredient_type),
+        raw=parsed_results_dict["raw"],
+    )
+    num_values_passed = 0
+    # Optionally, recursively call blend() again to get subtable from args
+    # This applies to `context` and `options`
+    for i, unpack_kwarg in enumerate(
+        [IngredientKwarg.CONTEXT, IngredientKwarg.OPTIONS]
+    ):
+        unpack_value = kwargs_dict.get(
+            unpack_kwarg,
+            (
+                parsed_results_dict["args"][i + 1]
+                if len(parsed_results_dict["args"]) > i + 1
+                else (
+                    parsed_results_dict["args"][i]
+                    if len(parsed_results_dict["args"]) > i
+                    else ""
+                )
+            ),
+        )
+        if isinstance(unpack_value, str) and unpack_value.upper().startswith(
+            ("SELECT", "WITH")
+        ):
+            _smoothie = _blend(query=unpack_value, **kwargs)
+            num_values_passed += _smoothie.meta.num_values_passed
+            subtable = _smoothie.df
+            if unpack_kwarg == IngredientKwarg.OPTIONS:
+                if len(subtable.columns) != 1:
+                    raise InvalidBlendSQL(
+                        f"Invalid subquery passed to `options`!\nNeeds to return exactly one column, got {len(subtable.columns)} instead"
+                    )
+                # Here, we need to format as a flat set
+                kwargs_dict[unpack_kwarg] = list(subtable.values.flat)
+            else:
+                kwargs_dict[unpack_kwarg] = subtable
+                # Below, we can remove the optional `context` arg we passed in args
+                parsed_results_dict["args"] = parsed_results_dict["args"][:1]
+    if getattr(ingredient, "model", None) is not None:
+        kwargs_dict["model"] = ingredient.model
+    # Execute our ingredient function
+    function_out = ingredient(
+        *parsed_results_dict["args"], **kwargs_dict | ingredient_kwargs
+    )
+    return (function_out, num_values_passed)
+
+
 def _blend(
     query: str,
     db: Database,
@@ -388,10 +651,14 @@ def _blend(
     infer_gen_constraints: bool = True,
     table_to_title: Optional[Dict[str, str]] = None,
     schema_qualify: bool = True,
+    max_concurrency: int = 1,
     _prev_passed_values: int = 0,
-) -> Smoothie:
+    _stream: bool = False,
+) -> Union[Smoothie, Tuple[str, SmoothieMeta]]:
     """Invoked from blend(), this contains the recursive logic to execute
     a BlendSQL query and return a `Smoothie` object.
+    If `_stream=True`, the final query is returned along with its `SmoothieMeta` instead of being executed,
+    so that `blend_iter()` can stream its results.
     """
     # The QueryContextManager class is used to track all manipulations done to
     # the original query, prior to the final execution on the underlying DBMS.
@@ -405,24 +672,72 @@ def _blend(
     # Create our Kitchen
     kitchen = Kitchen(db=db, session_uuid=session_uuid)
     kitchen.extend(ingredients)
-    # Replace ingredient calls with short aliases (e.g. '{{A()}}'),
-    # and use _peg_grammar to extract ingredient types
-    (
-        query,
-        ingredient_alias_to_parsed_dict,
-        tables_in_ingredients,
-    ) = preprocess_blendsql(query=query, default_model=default_model)
-    query = autowrap_query(
-        query=query,
-        kitchen=kitchen,
-        ingredient_alias_to_parsed_dict=ingredient_alias_to_parsed_dict,
-    )
-    # Parse to our QueryContextManager object
-    query_context.parse(query)
+    if max_concurrency > 1 and any(
+        isinstance(model, LocalModel)
+        for model in [default_model] + [getattr(i, "model", None) for i in kitchen]
+    ):
+        # Local models run on a single device, and aren't safe to call from many threads
+        logger.debug(
+            Fore.YELLOW
+            + "Found a `LocalModel`, executing ingredients one at a time"
+            + Fore.RESET
+        )
+        max_concurrency = 1
+    schema = None
+    with span("parse"):
+        plan: Optional[QueryPlan] = None
+        # Plain SQL doesn't need a plan, or the schema
+        if len(ingredients) > 0:
+            # Check if we've already parsed this query before
+            plan_key = get_plan_key(
+                query=query,
+                schema_fingerprint=db.schema_fingerprint if schema_qualify else None,
+                ingredients=kitchen,
+            )
+            plan = plan_cache.get(plan_key)
+            set_span_attributes(plan_cache_hit=plan is not None)
+        if plan is None:
+            # Replace ingredient calls with short aliases (e.g. '{{A()}}'),
+            # and use our ingredient scanner to extract ingredient types
+            (
+                query,
+                ingredient_alias_to_parsed_dict,
+                tables_in_ingredients,
+            ) = preprocess_blendsql(query=query, default_model=default_model)
+            query = autowrap_query(
+                query=query,
+                kitchen=kitchen,
+                ingredient_alias_to_parsed_dict=ingredient_alias_to_parsed_dict,
+            )
+            # Parse to our QueryContextManager object
+            query_context.parse(query)
+
+            # Preliminary check - we can't have anything that modifies database state
+            if query_context.node.find(MODIFIERS):
+                raise InvalidBlendSQL("BlendSQL query cannot have `DELETE` clause!")
 
-    # Preliminary check - we can't have anything that modifies database state
-    if query_context.node.find(MODIFIERS):
-        raise InvalidBlendSQL("BlendSQL query cannot have `DELETE` clause!")
+            if len(ingredients) > 0 and len(ingredient_alias_to_parsed_dict) > 0:
+                if schema_qualify:
+                    # Only construct sqlglot schema if we need to
+                    schema = db.sqlglot_schema
+                query_context.parse(query, schema=schema)
+            if len(ingredients) > 0:
+                plan = QueryPlan.create(
+                    query=query,
+                    ingredient_alias_to_parsed_dict=ingredient_alias_to_parsed_dict,
+                    tables_in_ingredients=tables_in_ingredients,
+                    node=query_context.node,
+                )
+                plan_cache[plan_key] = plan
+        else:
+            logger.debug(Fore.LIGHTBLACK_EX + "Using cached query plan" + Fore.RESET)
+            query = plan.query
+            ingredient_alias_to_parsed_dict = plan.get_ingredient_alias_to_parsed_dict(
+                default_model=default_model
+            )
+            tables_in_ingredients = set(plan.tables_in_ingredients)
+            query_context.node = plan.get_node()
+            query_context._query = query
 
     # If we don't have any ingredient calls, execute as normal SQL
     if len(ingredients) == 0 or len(ingredient_alias_to_parsed_dict) == 0:
@@ -431,33 +746,30 @@ def _blend(
         )
         logger.debug(Fore.LIGHTYELLOW_EX + query + Fore.RESET)
         logger.debug(Fore.YELLOW + f"Executing as vanilla SQL..." + Fore.RESET)
-        return Smoothie(
-            df=db.execute_to_df(query_context.to_string()),
-            meta=SmoothieMeta(
-                num_values_passed=0,
-                prompt_tokens=default_model.prompt_tokens
-                if default_model is not None
-                else 0,
-                completion_tokens=(
-                    default_model.completion_tokens if default_model is not None else 0
-                ),
-                prompts=default_model.prompts if default_model is not None else [],
-                ingredients=[],
-                query=original_query,
-                db_url=str(db.db_url),
-                contains_ingredient=False,
+        meta = SmoothieMeta(
+            num_values_passed=0,
+            prompt_tokens=default_model.prompt_tokens
+            if default_model is not None
+            else 0,
+            completion_tokens=(
+                default_model.completion_tokens if default_model is not None else 0
             ),
+            prompts=default_model.prompts if default_model is not None else [],
+            ingredients=[],
+            query=original_query,
+            db_url=str(db.db_url),
+            contains_ingredient=False,
         )
+        if _stream:
+            return (query_context.to_string(), meta)
+        return Smoothie(df=db.execute_to_df(query_context.to_string()), meta=meta)
 
-    schema = None
     if schema_qualify:
-        # Only construct sqlglot schema if we need to
+        # Cached on the catalog, so this is free if we just parsed the query
         schema = db.sqlglot_schema
-    query_context.parse(query, schema=schema)
-
     _get_temp_session_table: Callable = partial(get_temp_session_table, session_uuid)
-    # Mapping from {"QA('does this company...', 'constituents::Name')": 'does this company'...})
-    function_call_to_res: Dict[str, str] = {}
+    # Mapping from ingredient aliasname (e.g. 'A') to the expression(s) its output is substituted with
+    aliasname_to_output: Dict[str, Union[exp.Expression, List[exp.Expression]]] = {}
     session_modified_tables = set()
     # TODO: Currently, as we traverse upwards from deepest subquery,
     #   if any lower subqueries have an ingredient, we deem the current
@@ -498,7 +810,7 @@ def _blend(
 
         in_cte, table_alias_name = check.in_cte(subquery, return_name=True)
         scm = SubqueryContextManager(
-            node=_parse_one(
+            node=plan.parse_subquery(
                 subquery_str
             ),  # Need to do this so we don't track parents into construct_abstracted_selects
             prev_subquery_has_ingredient=prev_subquery_has_ingredient,
@@ -538,52 +850,75 @@ def _blend(
                             infer_gen_constraints=infer_gen_constraints,
                             table_to_title=table_to_title,
                             verbose=verbose,
+                            max_concurrency=max_concurrency,
                             _prev_passed_values=_prev_passed_values,
                         ),
                     )
                 )
             if abstracted_query_str is not None:
-                if tablename in db.lazy_tables:
-                    db.lazy_tables.pop(tablename).collect()
-                logger.debug(
-                    Fore.CYAN
-                    + "Executing "
-                    + Fore.LIGHTCYAN_EX
-                    + f"`{abstracted_query_str}` "
-                    + Fore.CYAN
-                    + f"and setting to `{_get_temp_subquery_table(tablename)}`..."
-                    + Fore.RESET
-                )
-                try:
-                    abstracted_df = db.execute_to_df(abstracted_query_str)
-                    if postprocess_columns:
-                        if isinstance(db, DuckDB):
-                            set_of_column_names = set(
-                                i.strip('"') for i in schema[f'"{tablename}"']
-                            )
-                            # In case of a join, duckdb formats columns with 'column_1'
-                            # But some columns (e.g. 'parent_category') just have underscores in them already
-                            abstracted_df = abstracted_df.rename(
-                                columns=lambda x: re.sub(r"_\d$", "", x)
-                                if x not in set_of_column_names  # noqa: B023
-                                else x
-                            )
-                        # In case of a join, we could have duplicate column names in our pandas dataframe
-                        # This will throw an error when we try to write to the database
-                        abstracted_df = abstracted_df.loc[
-                            :, ~abstracted_df.columns.duplicated()
-                        ]
-                    db.to_temp_table(
-                        df=abstracted_df,
-                        tablename=_get_temp_subquery_table(tablename),
-                    )
-                except Exception as e:
-                    # Fallback to naive execution
-                    logger.debug(Fore.RED + str(e) + Fore.RESET)
+                with span("materialize", tablename=tablename, subquery=subquery_idx):
+                    if tablename in db.lazy_tables:
+                        db.lazy_tables.pop(tablename).collect()
                     logger.debug(
-                        Fore.RED + "Falling back to naive execution..." + Fore.RESET
+                        Fore.CYAN
+                        + "Executing "
+                        + Fore.LIGHTCYAN_EX
+                        + f"`{abstracted_query_str}` "
+                        + Fore.CYAN
+                        + f"and setting to `{_get_temp_subquery_table(tablename)}`..."
+                        + Fore.RESET
                     )
-                    naive_execution = True
+                    try:
+                        # Materialize directly in the database, so the results never need to leave it
+                        materialized_query_str = (
+                            expand_star_without_duplicates(abstracted_query_str, db=db)
+                            if postprocess_columns
+                            else abstracted_query_str
+                        )
+                        materialized = False
+                        if materialized_query_str is not None:
+                            try:
+                                db.query_to_temp_table(
+                                    query=materialized_query_str,
+                                    tablename=_get_temp_subquery_table(tablename),
+                                )
+                                materialized = True
+                            except Exception as e:
+                                logger.debug(Fore.YELLOW + str(e) + Fore.RESET)
+                                logger.debug(
+                                    Fore.YELLOW
+                                    + "Falling back to materializing with pandas..."
+                                    + Fore.RESET
+                                )
+                        if not materialized:
+                            abstracted_df = db.execute_to_df(abstracted_query_str)
+                            if postprocess_columns:
+                                if isinstance(db, DuckDB):
+                                    set_of_column_names = set(
+                                        i.strip('"') for i in schema[f'"{tablename}"']
+                                    )
+                                    abstracted_df = abstracted_df.rename(
+                                        columns=partial(
+                                            _strip_duckdb_join_suffix,
+                                            column_names=set_of_column_names,
+                                        )
+                                    )
+                                # In case of a join, we could have duplicate column names in our pandas dataframe
+                                # This will throw an error when we try to write to the database
+                                abstracted_df = abstracted_df.loc[
+                                    :, ~abstracted_df.columns.duplicated()
+                                ]
+                            db.to_temp_table(
+                                df=abstracted_df,
+                                tablename=_get_temp_subquery_table(tablename),
+                            )
+                    except Exception as e:
+                        # Fallback to naive execution
+                        logger.debug(Fore.RED + str(e) + Fore.RESET)
+                        logger.debug(
+                            Fore.RED + "Falling back to naive execution..." + Fore.RESET
+                        )
+                        naive_execution = True
         # Be sure to handle those remaining aliases, which didn't have abstracted queries
         for aliasname, aliased_subquery in scm.alias_to_subquery.items():
             db.lazy_tables.add(
@@ -602,6 +937,7 @@ def _blend(
                         infer_gen_constraints=infer_gen_constraints,
                         table_to_title=table_to_title,
                         verbose=verbose,
+                        max_concurrency=max_concurrency,
                         _prev_passed_values=_prev_passed_values,
                     ),
                 )
@@ -615,7 +951,8 @@ def _blend(
         # Now, 1) Find all ingredients to execute (e.g. '{{f(a, b, c)}}')
         # 2) Track when we've created a new table from a MapIngredient call
         #   only at the end of parsing a subquery, we can merge to the original session_uuid table
-        tablename_to_map_out: Dict[str, List[pd.DataFrame]] = {}
+        tablename_to_map_out: Dict[str, List[Tuple[str, pd.DataFrame]]] = {}
+        ingredient_calls: List[Tuple[str, dict, Ingredient, dict]] = []
         for (
             start,
             end,
@@ -633,13 +970,6 @@ def _blend(
                 continue
             executed_subquery_ingredients.add(alias_function_str)
             kwargs_dict = parsed_results_dict["kwargs_dict"]
-            logger.debug(
-                Fore.CYAN
-                + "Executing "
-                + Fore.LIGHTCYAN_EX
-                + f" `{parsed_results_dict['raw']}`..."
-                + Fore.RESET
-            )
             if infer_gen_constraints:
                 # Latter is the winner.
                 # So if we already define something in kwargs_dict,
@@ -659,85 +989,55 @@ def _blend(
                 )
             if table_to_title is not None:
                 kwargs_dict["table_to_title"] = table_to_title
-
-            # Optionally, recursively call blend() again to get subtable from args
-            # This applies to `context` and `options`
-            for i, unpack_kwarg in enumerate(
-                [IngredientKwarg.CONTEXT, IngredientKwarg.OPTIONS]
-            ):
-                unpack_value = kwargs_dict.get(
-                    unpack_kwarg,
-                    (
-                        parsed_results_dict["args"][i + 1]
-                        if len(parsed_results_dict["args"]) > i + 1
-                        else (
-                            parsed_results_dict["args"][i]
-                            if len(parsed_results_dict["args"]) > i
-                            else ""
-                        )
-                    ),
-                )
-                if isinstance(unpack_value, str) and unpack_value.upper().startswith(
-                    ("SELECT", "WITH")
-                ):
-                    _smoothie = _blend(
-                        query=unpack_value,
-                        db=db,
-                        default_model=default_model,
-                        ingredients=ingredients,
-                        infer_gen_constraints=infer_gen_constraints,
-                        table_to_title=table_to_title,
-                        verbose=verbose,
-                        _prev_passed_values=_prev_passed_values,
-                    )
-                    _prev_passed_values = _smoothie.meta.num_values_passed
-                    subtable = _smoothie.df
-                    if unpack_kwarg == IngredientKwarg.OPTIONS:
-                        if len(subtable.columns) != 1:
-                            raise InvalidBlendSQL(
-                                f"Invalid subquery passed to `options`!\nNeeds to return exactly one column, got {len(subtable.columns)} instead"
-                            )
-                        # Here, we need to format as a flat set
-                        kwargs_dict[unpack_kwarg] = list(subtable.values.flat)
-                    else:
-                        kwargs_dict[unpack_kwarg] = subtable
-                        # Below, we can remove the optional `context` arg we passed in args
-                        parsed_results_dict["args"] = parsed_results_dict["args"][:1]
-            if getattr(ingredient, "model", None) is not None:
-                kwargs_dict["model"] = ingredient.model
-            # Execute our ingredient function
-            function_out = ingredient(
-                *parsed_results_dict["args"],
-                **kwargs_dict
-                | {
-                    "get_temp_subquery_table": _get_temp_subquery_table,
-                    "get_temp_session_table": _get_temp_session_table,
-                    "aliases_to_tablenames": scm.alias_to_tablename,
-                    "prev_subquery_map_columns": prev_subquery_map_columns,
-                },
+            ingredient_calls.append(
+                (alias_function_str, parsed_results_dict, ingredient, kwargs_dict)
             )
+            if naive_execution:
+                break
+
+        def handle_ingredient_output(
+            call_idx: int,
+            output: Tuple[Any, int],
+            ingredient_calls: List[Tuple[str, dict, Ingredient, dict]],
+            prev_subquery_map_columns: Set[str],
+            tablename_to_map_out: Dict[str, List[Tuple[str, pd.DataFrame]]],
+        ) -> None:
+            """Applies the output of an ingredient call to the current query.
+            The state of the current subquery is passed explicitly, rather than closed over,
+            since this is defined inside our loop over subqueries.
+            """
+            nonlocal _prev_passed_values
+            (
+                alias_function_str,
+                parsed_results_dict,
+                ingredient,
+                _,
+            ) = ingredient_calls[call_idx]
+            function_out, num_values_passed = output
+            _prev_passed_values += num_values_passed
             # Check how to handle output, depending on ingredient type
             if ingredient.ingredient_type == IngredientType.MAP:
                 # Parse so we replace this function in blendsql with 1st arg
                 #   (new_col, which is the question we asked)
                 #  But also update our underlying table, so we can execute correctly at the end
-                (new_col, tablename, colname, new_table) = function_out
+                (new_col, tablename, colname, mapped_table) = function_out
                 prev_subquery_map_columns.add(new_col)
-                new_table[new_table[new_col].notnull()]
                 if tablename in tablename_to_map_out:
-                    tablename_to_map_out[tablename].append(new_table)
+                    tablename_to_map_out[tablename].append((colname, mapped_table))
                 else:
-                    tablename_to_map_out[tablename] = [new_table]
+                    tablename_to_map_out[tablename] = [(colname, mapped_table)]
                 session_modified_tables.add(tablename)
-                function_call_to_res[
-                    alias_function_str
-                ] = f'"{double_quote_escape(tablename)}"."{double_quote_escape(new_col)}"'
+                aliasname_to_output[
+                    parsed_results_dict["ingredient_aliasname"]
+                ] = exp.column(new_col, table=tablename, quoted=True)
             elif ingredient.ingredient_type in (
                 IngredientType.STRING,
                 IngredientType.QA,
             ):
                 # Here, we can simply insert the function's output
-                function_call_to_res[alias_function_str] = function_out
+                aliasname_to_output[
+                    parsed_results_dict["ingredient_aliasname"]
+                ] = _output_to_expression(function_out)
             elif ingredient.ingredient_type == IngredientType.JOIN:
                 # 1) Get the `JOIN` clause containing function
                 # 2) Replace with just the function alias
@@ -757,15 +1057,12 @@ def _blend(
                     # `SELECT * FROM w0 JOIN w0 ON {{B()}} > 1 AND {{A()}} WHERE TRUE`
                     # Since we haven't executed and saved `{{B()}}` to temp table yet,
                     #   we need to keep. So we get:
-                    temp_uuid = str(uuid.uuid4())
-                    _node = query_context.node.transform(
-                        transform.replace_join_with_ingredient_multiple_ingredient,
-                        ingredient_name=parsed_results_dict["ingredient_aliasname"],
-                        ingredient_alias=alias_function_str,
-                        temp_uuid=temp_uuid,
-                    ).transform(transform.prune_true_where)
-                    query_context.parse(
-                        str(_node).replace(f'SELECT "{temp_uuid}", ', ""), schema=schema
+                    query_context.node = (
+                        transform.replace_join_with_ingredient_multiple_ingredient(
+                            query_context.node.transform(transform.prune_true_where),
+                            ingredient_name=parsed_results_dict["ingredient_aliasname"],
+                            ingredient_alias=alias_function_str,
+                        )
                     )
                 else:
                     # Case where we have
@@ -781,122 +1078,155 @@ def _blend(
                         ingredient_name=parsed_results_dict["ingredient_aliasname"],
                         ingredient_alias=alias_function_str,
                     )
-                function_call_to_res[alias_function_str] = join_clause
+                aliasname_to_output[
+                    parsed_results_dict["ingredient_aliasname"]
+                ] = _parse_one("SELECT * FROM _ " + join_clause).args["joins"]
             else:
                 raise ValueError(
                     f"Not sure what to do with ingredient_type '{ingredient.ingredient_type}' yet\n(Also, we should have never hit this error....)"
                 )
-            if naive_execution:
-                break
+
+        # Ingredient calls which don't share any state are executed in parallel
+        run_in_dependency_order(
+            tasks=[
+                partial(
+                    execute_ingredient,
+                    ingredient=ingredient,
+                    parsed_results_dict=parsed_results_dict,
+                    kwargs_dict=kwargs_dict,
+                    ingredient_kwargs={
+                        "get_temp_subquery_table": _get_temp_subquery_table,
+                        "get_temp_session_table": _get_temp_session_table,
+                        "aliases_to_tablenames": scm.alias_to_tablename,
+                        "prev_subquery_map_columns": prev_subquery_map_columns,
+                    },
+                    db=db,
+                    default_model=default_model,
+                    ingredients=ingredients,
+                    infer_gen_constraints=infer_gen_constraints,
+                    table_to_title=table_to_title,
+                    verbose=verbose,
+                    max_concurrency=max_concurrency,
+                )
+                for (
+                    _,
+                    parsed_results_dict,
+                    ingredient,
+                    kwargs_dict,
+                ) in ingredient_calls
+            ],
+            dependencies=get_ingredient_dependencies(
+                ingredient_calls=ingredient_calls,
+                lazy_tablenames=set(db.lazy_tables.keys()),
+                aliases_to_tablenames=scm.alias_to_tablename,
+            ),
+            on_complete=partial(
+                handle_ingredient_output,
+                ingredient_calls=ingredient_calls,
+                prev_subquery_map_columns=prev_subquery_map_columns,
+                tablename_to_map_out=tablename_to_map_out,
+            ),
+            max_workers=max_concurrency,
+        )
         # Combine all the retrieved ingredient outputs
         for tablename, ingredient_outputs in tablename_to_map_out.items():
             if len(ingredient_outputs) > 0:
-                logger.debug(
-                    Fore.CYAN
-                    + f"Combining {len(ingredient_outputs)} outputs for table `{tablename}`"
-                    + Fore.RESET
-                )
-                # Once we finish parsing this subquery, write to our session_uuid table
-                # Below, we differ from Binder, which seems to replace the old table
-                # On their left join merge command: https://github.com/HKUNLP/Binder/blob/9eede69186ef3f621d2a50572e1696bc418c0e77/nsql/database.py#L196
-                # We create a new temp table to avoid a potentially self-destructive operation
-                base_tablename = tablename
-                _base_table: pd.DataFrame = db.execute_to_df(
-                    select_all_from_table_query(base_tablename)
-                )
-                base_table = _base_table
-                if db.has_temp_table(_get_temp_session_table(tablename)):
-                    base_tablename = _get_temp_session_table(tablename)
-                    base_table: pd.DataFrame = db.execute_to_df(
-                        select_all_from_table_query(base_tablename)
+                with span("merge", tablename=tablename, subquery=subquery_idx):
+                    logger.debug(
+                        Fore.CYAN
+                        + f"Combining {len(ingredient_outputs)} outputs for table `{tablename}`"
+                        + Fore.RESET
                     )
-                previously_added_columns = base_table.columns.difference(
-                    _base_table.columns
-                )
-                assert len(set([len(x) for x in ingredient_outputs])) == 1
-                llm_out_df = pd.concat(ingredient_outputs, axis=1)
-                llm_out_df = llm_out_df.loc[:, ~llm_out_df.columns.duplicated()]
-                # Handle duplicate columns, e.g. in test_nested_duplicate_ingredient_calls()
-                for column in previously_added_columns:
-                    if all(
-                        column in x for x in [llm_out_df.columns, base_table.columns]
-                    ):
-                        # Fill nan in llm_out_df with those values in base_table
-                        try:
-                            pd.testing.assert_index_equal(
-                                base_table.index, llm_out_df.index
-                            )
-                        except AssertionError:
-                            logger.debug(
-                                Fore.RED + "pd.testing.assert_index_equal error"
-                            )
-                        llm_out_df[column] = llm_out_df[column].fillna(
-                            base_table[column]
+                    # Once we finish parsing this subquery, write to our session_uuid table
+                    # Below, we differ from Binder, which seems to replace the old table
+                    # On their left join merge command: https://github.com/HKUNLP/Binder/blob/9eede69186ef3f621d2a50572e1696bc418c0e77/nsql/database.py#L196
+                    # Instead, we copy the base table once per session inside the database,
+                    #   and then only send the (value -> mapped value) pairs to be joined onto it
+                    session_tablename = _get_temp_session_table(tablename)
+                    if not db.has_temp_table(session_tablename):
+                        db.query_to_temp_table(
+                            query=select_all_from_table_query(tablename),
+                            tablename=session_tablename,
                         )
-                        base_table = base_table.drop(columns=column)
-                llm_out_df = llm_out_df[
-                    llm_out_df.columns.difference(base_table.columns)
-                ]
-                try:
-                    pd.testing.assert_index_equal(base_table.index, llm_out_df.index)
-                except AssertionError:
-                    logger.debug(Fore.RED + "pd.testing.assert_index_equal error")
-                merged = base_table.merge(
-                    llm_out_df, how="left", right_index=True, left_index=True
-                )
-                db.to_temp_table(
-                    df=merged, tablename=_get_temp_session_table(tablename)
-                )
-                session_modified_tables.add(tablename)
+                    colname_to_mapped_tables: Dict[str, List[pd.DataFrame]] = {}
+                    for colname, mapped_table in ingredient_outputs:
+                        colname_to_mapped_tables.setdefault(colname, []).append(
+                            mapped_table
+                        )
+                    for colname, mapped_tables in colname_to_mapped_tables.items():
+                        merged = mapped_tables[0]
+                        for mapped_table in mapped_tables[1:]:
+                            merged = merged.merge(mapped_table, how="outer", on=colname)
+                        db.merge_into_temp_table(
+                            df=merged, tablename=session_tablename, on=colname
+                        )
+                    session_modified_tables.add(tablename)
 
-    # Now insert the function outputs to the original query
-    query = query_context.to_string()
-    for function_str, res in function_call_to_res.items():
-        query = query.replace(function_str, str(res))
-    for t in session_modified_tables:
-        query = sub_tablename(
-            t, f'"{double_quote_escape(_get_temp_session_table(t))}"', query
-        )
-    if scm is not None:
-        for a, t in scm.alias_to_tablename.items():
-            if t in session_modified_tables:
-                query = sub_tablename(
-                    a, f'"{double_quote_escape(_get_temp_session_table(t))}"', query
-                )
-    # Finally, iter through tables in query and see if we need to collect LazyTable
+    # Iter through tables in query and see if we need to collect LazyTable
     for table in get_scope_nodes(
         nodetype=exp.Table, node=query_context.node, restrict_scope=False
     ):
         if table.name in db.lazy_tables:
             db.lazy_tables.pop(table.name).collect()
+    # Now insert the function outputs to the original query,
+    #   and point modified tables to their session tables
+    tablename_to_session_tablename = {
+        t: _get_temp_session_table(t) for t in session_modified_tables
+    }
+    if scm is not None:
+        for a, t in scm.alias_to_tablename.items():
+            if t in session_modified_tables:
+                tablename_to_session_tablename[a] = _get_temp_session_table(t)
+    query_context.node = transform.substitute_ingredient_outputs(
+        query_context.node, aliasname_to_output
+    )
+    query_context.node = transform.repoint_tables(
+        query_context.node, tablename_to_session_tablename
+    )
+    query = query_context.node.sql(dialect=FTS5SQLite)
 
     logger.debug(Fore.LIGHTGREEN_EX + f"Final Query:\n{query}" + Fore.RESET)
 
-    df = db.execute_to_df(query)
-
-    return Smoothie(
-        df=df,
-        meta=SmoothieMeta(
-            num_values_passed=sum(
-                [
-                    i.num_values_passed
-                    for i in kitchen
-                    if hasattr(i, "num_values_passed")
-                ]
-            )
-            + _prev_passed_values,
-            prompt_tokens=default_model.prompt_tokens
-            if default_model is not None
-            else 0,
-            completion_tokens=default_model.completion_tokens
-            if default_model is not None
-            else 0,
-            prompts=default_model.prompts if default_model is not None else [],
-            ingredients=ingredients,
-            query=original_query,
-            db_url=str(db.db_url),
-        ),
+    meta = SmoothieMeta(
+        num_values_passed=sum(
+            [i.num_values_passed for i in kitchen if hasattr(i, "num_values_passed")]
+        )
+        + _prev_passed_values,
+        prompt_tokens=default_model.prompt_tokens if default_model is not None else 0,
+        completion_tokens=default_model.completion_tokens
+        if default_model is not None
+        else 0,
+        prompts=default_model.prompts if default_model is not None else [],
+        ingredients=ingredients,
+        query=original_query,
+        db_url=str(db.db_url),
     )
+    if _stream:
+        return (query, meta)
+    with span("final_query"):
+        df = db.execute_to_df(query)
+    return Smoothie(df=df, meta=meta)
+
+
+@contextmanager
+def checkout_database(db: Database) -> Generator[Database, None, None]:
+    """Yields the `Database` a single `blend()` call should execute against.
+
+    A pooled `Database` gives each call its own session, so many calls can run at once.
+    Otherwise, our `Database` holds a single connection, so calls against it take turns.
+    """
+    if db.pooled:
+        with db.session() as session_db:
+            yield session_db
+        return
+    with db._lock or nullcontext():
+        try:
+            yield db
+        finally:
+            # In the case of a recursive `_blend()` call,
+            #   this logic allows temp tables to persist until
+            #   the final base case is fulfilled.
+            db._reset_connection()
 
 
 def blend(
@@ -908,6 +1238,9 @@ def blend(
     infer_gen_constraints: bool = True,
     table_to_title: Optional[Dict[str, str]] = None,
     schema_qualify: bool = True,
+    max_concurrency: int = 1,
+    trace: bool = False,
+    to_arrow: bool = False,
 ) -> Smoothie:
     '''The `blend()` function is used to execute a BlendSQL query against a database and
     return the final result, in addition to the intermediate reasoning steps taken.
@@ -930,6 +1263,15 @@ def blend(
             This enables us to write BlendSQL scripts over multi-table databases without manually qualifying columns ourselves
             However, we need to call `db.sqlglot_schema` if schema_qualify=True, which may add some latency.
             With single-table queries, we can set this to False.
+        max_concurrency: Max number of ingredient calls to execute at once.
+            Ingredient calls within a subquery which don't depend on each other
+            (e.g. two `LLMMap` calls over different columns, or two `LLMQA` calls with their own context subqueries)
+            are executed in parallel. Has no effect when using a `LocalModel`.
+        trace: Optionally record how long each step of execution took (parsing, materializing temp tables,
+            each ingredient and Model call, the final query, etc.) to `smoothie.meta.trace`.
+            This can be exported via `smoothie.meta.trace.to_json()` or `smoothie.meta.trace.to_chrome_trace()`.
+        to_arrow: Optionally return the result of the final query as a `pyarrow.Table` in `smoothie.arrow`,
+            instead of a pd.DataFrame in `smoothie.df`. With `DuckDB`, this never goes through pandas.
 
     Returns:
         smoothie: `Smoothie` dataclass containing pd.DataFrame output and execution metadata
@@ -1011,9 +1353,8 @@ def blend(
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.ERROR)
-    start = time.time()
-    try:
-        smoothie = _blend(
+    with checkout_database(db) as db:
+        return _blend_to_smoothie(
             query=query,
             db=db,
             default_model=default_model,
@@ -1021,13 +1362,191 @@ def blend(
             infer_gen_constraints=infer_gen_constraints,
             table_to_title=table_to_title,
             schema_qualify=schema_qualify,
+            max_concurrency=max_concurrency,
+            trace=trace,
+            to_arrow=to_arrow,
         )
-    except Exception as error:
-        raise error
-    finally:
-        # In the case of a recursive `_blend()` call,
-        #   this logic allows temp tables to persist until
-        #   the final base case is fulfilled.
-        db._reset_connection()
+
+
+def _blend_to_smoothie(
+    query: str,
+    db: Database,
+    trace: bool = False,
+    to_arrow: bool = False,
+    **kwargs,
+) -> Smoothie:
+    """Executes a query against a checked out `Database`,
+    recording the process time (and optional trace) of the returned `Smoothie`.
+    """
+    start = time.time()
+    with Trace() if trace else nullcontext() as _trace:
+        smoothie = _blend(query=query, db=db, _stream=to_arrow, **kwargs)
+        if to_arrow:
+            final_query, meta = smoothie
+            with span("final_query"):
+                smoothie = Smoothie(
+                    df=None, meta=meta, arrow=db.execute_to_arrow(final_query)
+                )
     smoothie.meta.process_time_seconds = time.time() - start
+    smoothie.meta.trace = _trace
     return smoothie
+
+
+async def ablend(
+    query: str,
+    db: Database,
+    default_model: Optional[Model] = None,
+    ingredients: Optional[Collection[Type[Ingredient]]] = None,
+    verbose: bool = False,
+    infer_gen_constraints: bool = True,
+    table_to_title: Optional[Dict[str, str]] = None,
+    schema_qualify: bool = True,
+    max_concurrency: int = 1,
+    trace: bool = False,
+    to_arrow: bool = False,
+) -> Smoothie:
+    """Async counterpart to `blend()`, returning the same `Smoothie`.
+
+    Each call gets its own session of `db` (see `Database.session()`),
+    so many `ablend()` calls against the same `Database` can be awaited at once.
+    Database drivers are synchronous, so SQL is executed in a worker thread.
+    Requests to Models with a native async client (`OpenaiLLM`, `AnthropicLLM`, `OllamaLLM`)
+    are sent back to the event loop, and awaited via `agenerate`, rather than blocking a thread each.
+    Within a query, independent ingredient calls are executed concurrently as in `blend()`,
+    up to `max_concurrency` at once.
+
+    Args:
+        See `blend()`.
+
+    Returns:
+        smoothie: `Smoothie` dataclass containing pd.DataFrame output and execution metadata
+
+    Examples:
+        ```python
+        import asyncio
+        from blendsql import ablend, LLMMap
+
+        async def main():
+            return await asyncio.gather(
+                *[
+                    ablend(query=q, db=db, ingredients={LLMMap}, default_model=model)
+                    for q in queries
+                ]
+            )
+
+        smoothies = asyncio.run(main())
+        ```
+    """
+    if verbose:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.ERROR)
+
+    def blend_in_session() -> Smoothie:
+        with db.session() as session_db:
+            return _blend_to_smoothie(
+                query=query,
+                db=session_db,
+                default_model=default_model,
+                ingredients=ingredients,
+                infer_gen_constraints=infer_gen_constraints,
+                table_to_title=table_to_title,
+                schema_qualify=schema_qualify,
+                max_concurrency=max_concurrency,
+                trace=trace,
+                to_arrow=to_arrow,
+            )
+
+    # `asyncio.to_thread` copies our context, so the worker thread knows where to send Model requests
+    token = _event_loop.set(asyncio.get_running_loop())
+    try:
+        return await asyncio.to_thread(blend_in_session)
+    finally:
+        _event_loop.reset(token)
+
+
+def blend_iter(
+    query: str,
+    db: Database,
+    default_model: Optional[Model] = None,
+    ingredients: Optional[Collection[Type[Ingredient]]] = None,
+    verbose: bool = False,
+    infer_gen_constraints: bool = True,
+    table_to_title: Optional[Dict[str, str]] = None,
+    schema_qualify: bool = True,
+    max_concurrency: int = 1,
+    trace: bool = False,
+    chunksize: int = DEFAULT_STREAM_CHUNKSIZE,
+) -> SmoothieStream:
+    """Streaming counterpart to `blend()`, for queries whose final result is too large to hold in memory at once.
+
+    Ingredients are executed as in `blend()`, but the final query is read from the database
+    in chunks of at most `chunksize` rows (via a server-side cursor on `SQLAlchemyDatabase`,
+    and `fetch_df_chunk` on `DuckDB`). Nothing is executed until the returned `SmoothieStream` is iterated.
+    `stream.meta` is available once the first chunk is yielded, and `stream.meta.process_time_seconds`
+    is set once the stream is exhausted (or closed).
+
+    The stream runs on its own session of the `Database` (see `Database.session()`), so no lock on `db`
+    is held while the caller consumes it, and other queries against `db` don't wait for the stream.
+
+    Args:
+        See `blend()`.
+        chunksize: Max number of rows in each yielded `pd.DataFrame`
+
+    Returns:
+        stream: `SmoothieStream` yielding `pd.DataFrame` chunks
+
+    Examples:
+        ```python
+        from blendsql import blend_iter, LLMMap
+
+        stream = blend_iter(query=query, db=db, ingredients={LLMMap}, default_model=model, chunksize=50_000)
+        for df in stream:
+            df.to_csv("out.csv", mode="a", header=False)
+        print(stream.meta.num_values_passed)
+        ```
+    """
+    stream = SmoothieStream()
+
+    def iter_chunks() -> Generator[pd.DataFrame, None, None]:
+        if verbose:
+            logger.setLevel(logging.DEBUG)
+        else:
+            logger.setLevel(logging.ERROR)
+        # Always use a session, since we hand control back to the caller between chunks
+        with db.session() as session_db:
+            start = time.time()
+            try:
+                with Trace() if trace else nullcontext() as _trace:
+                    final_query, stream.meta = _blend(
+                        query=query,
+                        db=session_db,
+                        default_model=default_model,
+                        ingredients=ingredients,
+                        infer_gen_constraints=infer_gen_constraints,
+                        table_to_title=table_to_title,
+                        schema_qualify=schema_qualify,
+                        max_concurrency=max_concurrency,
+                        _stream=True,
+                    )
+                stream.meta.trace = _trace
+                # We can't keep a span open across `yield`, since the caller shares our context
+                final_query_span = None
+                if _trace is not None:
+                    final_query_span = Span("final_query", {"query": final_query})
+                    _trace.root.children.append(final_query_span)
+                num_rows = 0
+                try:
+                    for df in session_db.iter_df(final_query, chunksize=chunksize):
+                        num_rows += len(df)
+                        yield PrettyDataFrame(df)
+                finally:
+                    if final_query_span is not None:
+                        final_query_span.attributes["num_rows"] = num_rows
+                        final_query_span.end = _trace.root.end = time.perf_counter()
+            finally:
+                if stream.meta is not None:
+                    stream.meta.process_time_seconds = time.time() - start
+
+    stream.chunks = iter_chunks()
+    return stream
@@ -0,0 +1,127 @@
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+_DDL_PATTERN = re.compile(r"^\s*(CREATE|DROP|ALTER)\b(.*)", re.IGNORECASE | re.DOTALL)
+_CREATE_IGNORED_PATTERN = re.compile(
+    r"^\s*(?:OR\s+REPLACE\s+)?(?:(?:LOCAL|GLOBAL)\s+)?(?:TEMP|TEMPORARY|UNIQUE\s+INDEX|INDEX)\b",
+    re.IGNORECASE,
+)
+_DML_PATTERN = re.compile(
+    r"^\s*(?:INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE|DELETE\s+FROM|COPY)\s+(.+)",
+    re.IGNORECASE,
+)
+_TABLE_NAME_PATTERN = re.compile(
+    r"\b(?:TABLE|VIEW)\s+(?:IF\s+EXISTS\s+)?(.+)",
+    re.IGNORECASE,
+)
+_NAME_PATTERN = re.compile(r"(?:\w+\.)?(\"(?:[^\"]|\"\")+\"|[^\s(;.]+)")
+
+
+def _unquote(name: str) -> str:
+    """'main."my table"(a, b)' -> 'my table'"""
+    match = _NAME_PATTERN.match(name)
+    if match is None:
+        return name
+    name = match.group(1)
+    if name.startswith('"'):
+        return name[1:-1].replace('""', '"')
+    return name
+
+
+class SchemaCatalog:
+    """Cached tables, columns, column types and row counts of a database.
+
+    Everything is loaded lazily on first access, and kept until `invalidate()` is called.
+    `on_statement()` is called with each SQL statement sent to the database, and invalidates
+    the catalog when a statement may have changed it (e.g. `CREATE TABLE`, or `ALTER TABLE`
+    on a table we know of). Since BlendSQL creates and drops temp tables all the time,
+    these never trigger invalidation.
+
+    Args:
+        load_columns: Returns a mapping from each tablename to its (column name, column type) pairs
+        count_rows: Returns the number of rows in a table
+    """
+
+    def __init__(
+        self,
+        load_columns: Callable[[], Dict[str, List[Tuple[str, str]]]],
+        count_rows: Callable[[str], int],
+    ):
+        self._load_columns = load_columns
+        self._count_rows = count_rows
+        self._columns: Optional[Dict[str, List[Tuple[str, str]]]] = None
+        self._row_counts: Dict[str, int] = {}
+        # Anything else derived from the schema, e.g. `sqlglot_schema`
+        self._derived: Dict[str, Any] = {}
+        # Keys of `_derived` which also depend on the rows of a table
+        self._table_derived_keys: Dict[str, Set[str]] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def columns(self) -> Dict[str, List[Tuple[str, str]]]:
+        with self._lock:
+            if self._columns is None:
+                self._columns = self._load_columns()
+            return self._columns
+
+    def tables(self) -> List[str]:
+        return list(self.columns)
+
+    def __contains__(self, tablename: str) -> bool:
+        return tablename in self.columns
+
+    def column_names(self, tablename: str) -> List[str]:
+        return [name for name, _ in self.columns.get(tablename, [])]
+
+    def row_count(self, tablename: str) -> int:
+        with self._lock:
+            if tablename not in self._row_counts:
+                self._row_counts[tablename] = self._count_rows(tablename)
+            return self._row_counts[tablename]
+
+    def get_or_compute(
+        self, key: str, compute: Callable[[], Any], tablename: Optional[str] = None
+    ) -> Any:
+        """Caches the output of `compute` until the catalog is next invalidated.
+        If `tablename` is given, the output is also dropped when a statement
+        modifies the rows of 'tablename' (e.g. `INSERT INTO`).
+        """
+        with self._lock:
+            if key not in self._derived:
+                # `compute` may itself invalidate the catalog, so look up `_derived` after it
+                value = compute()
+                self._derived[key] = value
+                if tablename is not None:
+                    self._table_derived_keys.setdefault(tablename, set()).add(key)
+            return self._derived[key]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._columns = None
+            self._row_counts = {}
+            self._derived = {}
+            self._table_derived_keys = {}
+
+    def on_statement(self, statement: str) -> None:
+        ddl_match = _DDL_PATTERN.match(statement)
+        if ddl_match is not None:
+            kind, rest = ddl_match.group(1).upper(), ddl_match.group(2)
+            if kind == "CREATE":
+                if _CREATE_IGNORED_PATTERN.match(rest) is None:
+                    self.invalidate()
+                return
+            name_match = _TABLE_NAME_PATTERN.search(rest)
+            with self._lock:
+                if self._columns is None:
+                    return
+                if name_match is None or _unquote(name_match.group(1)) in self._columns:
+                    self.invalidate()
+            return
+        dml_match = _DML_PATTERN.match(statement)
+        if dml_match is not None:
+            tablename = _unquote(dml_match.group(1))
+            with self._lock:
+                self._row_counts.pop(tablename, None)
+                for key in self._table_derived_keys.pop(tablename, ()):
+                    self._derived.pop(key, None)
@@ -1,22 +1,67 @@
-from typing import Generator, Union, List, Callable, Optional
+import hashlib
+import json
+import threading
+from contextlib import contextmanager
+from typing import Dict, Generator, Union, List, Callable, Optional
 from collections.abc import Collection
 import pandas as pd
 from attr import attrib
 from sqlalchemy.engine import URL
 from abc import abstractmethod, ABC
 
-from .utils import LazyTables
+from ._catalog import SchemaCatalog
+from .utils import LazyTables, has_pyarrow, double_quote_escape, truncate_df_content
+from .bridge_content_encoder import get_database_matches
 
 
 class Database(ABC):
     db_url: Union[URL, str] = attrib()
-    lazy_tables: LazyTables = LazyTables()
+    # Set on each instance (and each session), so they're never shared
+    lazy_tables: LazyTables = None
+    # Held for the duration of a `blend()` call, since temp tables
+    #   live on the single underlying connection
+    _lock: threading.RLock = None
+    # Held around each statement, so that ingredients executing in
+    #   parallel within a `blend()` call take turns on the connection
+    _con_lock: threading.RLock = None
+    # If True, each `blend()` call checks out its own session via `session()`,
+    #   so that a single Database can serve many queries at once
+    pooled: bool = False
+    # Cached tables, columns and row counts, shared by all sessions of this Database
+    catalog: SchemaCatalog = None
+    # Temp tables with fewer rows than this aren't worth indexing
+    temp_table_index_min_rows: int = 1_000
 
     @abstractmethod
     def _reset_connection(self) -> None:
         """Reset connection, so that temp tables are cleared."""
         ...
 
+    @contextmanager
+    def session(self) -> Generator["Database", None, None]:
+        """Checks out a copy of this Database bound to its own connection, with its own
+        temp tables and lazy tables. These are cleared when the context exits.
+
+        Examples:
+            ```python
+            with db.session() as session_db:
+                session_db.to_temp_table(df, "my_temp_table")
+            ```
+        """
+        session = self._open_session()
+        try:
+            yield session
+        finally:
+            session._close_session()
+
+    @abstractmethod
+    def _open_session(self) -> "Database":
+        ...
+
+    @abstractmethod
+    def _close_session(self) -> None:
+        ...
+
     @abstractmethod
     def has_temp_table(self, tablename: str) -> bool:
         """Temp tables are stored in different locations, depending on
@@ -27,7 +72,6 @@ class Database(ABC):
         ...
 
     @property
-    @abstractmethod
     def sqlglot_schema(self) -> dict:
         """Returns database schema as a dictionary, in the format that
         sqlglot.optimizer expects.
@@ -38,7 +82,29 @@ class Database(ABC):
             > {"x": {"A": "INT", "B": "INT", "C": "INT", "D": "INT", "Z": "STRING"}}
             ```
         """
-        ...
+
+        def get_schema() -> dict:
+            schema: Dict[str, dict] = {}
+            for tablename, columns in self.catalog.columns.items():
+                schema[f'"{double_quote_escape(tablename)}"'] = {
+                    f'"{double_quote_escape(columnname)}"': columntype
+                    for columnname, columntype in columns
+                }
+            return schema
+
+        return self.catalog.get_or_compute("sqlglot_schema", get_schema)
+
+    @property
+    def schema_fingerprint(self) -> str:
+        """Hash of `sqlglot_schema`, which only changes when the catalog is invalidated.
+        Used to key cached query plans.
+        """
+        return self.catalog.get_or_compute(
+            "schema_fingerprint",
+            lambda: hashlib.md5(
+                json.dumps(self.sqlglot_schema, sort_keys=True, default=str).encode()
+            ).hexdigest(),
+        )
 
     @abstractmethod
     def tables(self) -> List[str]:
@@ -54,11 +120,109 @@ class Database(ABC):
     def schema_string(self, use_tables: Optional[Collection[str]] = None) -> str:
         """Converts the database to a series of 'CREATE TABLE' statements."""
 
+    def to_serialized(
+        self,
+        num_rows: int = 3,
+        truncate_content: int = 300,
+        use_tables: Optional[Collection[str]] = None,
+        include_content: Union[str, Collection[str]] = "all",
+        use_bridge_encoder: bool = False,
+        question: Optional[str] = None,
+    ) -> str:
+        """Returns a string representation of the database, with example rows."""
+        serialized_db = []
+        for tablename in self.tables():
+            if use_tables is not None:
+                if tablename not in use_tables:
+                    continue
+            serialized_db.append(self.schema_string(use_tables=[tablename]))
+            if include_content != "all":
+                if tablename not in include_content:
+                    serialized_db.append("\n")
+                    continue
+            get_rows_query = (
+                f'SELECT * FROM "{double_quote_escape(tablename)}" LIMIT {num_rows}'
+            )
+            total_num_rows = self.catalog.row_count(tablename)
+            serialized_db.append("/*")
+            serialized_db.append(
+                f"{num_rows} example rows:"
+                if num_rows < total_num_rows
+                else "Entire table:"
+            )
+            rows = self.execute_to_df(get_rows_query)
+            if truncate_content is not None:
+                # Truncate long strings
+                rows = truncate_df_content(rows, truncate_content)
+                serialized_db.append(get_rows_query)
+            serialized_db.append(f"{rows.to_string(index=False)}")
+            serialized_db.append("*/\n")
+            if use_bridge_encoder:
+                bridge_hints = []
+                column_str_with_values = "{table}.{column} ( {values} )"
+                value_sep = " , "
+                for columnname in self.iter_columns(tablename):
+                    matches = get_database_matches(
+                        question=question,
+                        table_name=tablename,
+                        column_name=columnname,
+                        db=self,
+                    )
+                    if matches:
+                        bridge_hints.append(
+                            column_str_with_values.format(
+                                table=tablename,
+                                column=columnname,
+                                values=value_sep.join(matches),
+                            )
+                        )
+                if len(bridge_hints) > 0:
+                    serialized_db.append(
+                        "Here are some values that may be useful: "
+                        + " , ".join(bridge_hints)
+                    )
+        return "\n".join(serialized_db).strip()
+
     @abstractmethod
     def to_temp_table(self, df: pd.DataFrame, tablename: str):
         """Write the given pandas dataframe as a temp table 'tablename'."""
         ...
 
+    @abstractmethod
+    def index_temp_table(
+        self, tablename: str, columns: Collection[str], num_rows: Optional[int] = None
+    ) -> None:
+        """Index each of `columns` in the temp table 'tablename', since we're about to
+        join or look up rows on them. Skipped if the table has fewer than
+        `temp_table_index_min_rows` rows.
+
+        Databases which hash their joins anyway (e.g. DuckDB) can make this a no-op.
+
+        Args:
+            tablename: The temp table to index
+            columns: The columns to create an index on, one index per column
+            num_rows: Number of rows in 'tablename', if we already know it
+        """
+        ...
+
+    @abstractmethod
+    def query_to_temp_table(self, query: str, tablename: str):
+        """Write the results of the given query as a temp table 'tablename'.
+        The results stay in the database, and are never loaded into memory.
+        """
+        ...
+
+    @abstractmethod
+    def merge_into_temp_table(self, df: pd.DataFrame, tablename: str, on: str):
+        """Add the columns of the given pandas dataframe to the existing temp table 'tablename',
+        matching rows on the column `on`. Columns not yet in 'tablename' are created,
+        and for those that are, only the values of matched rows are overwritten.
+
+        Only `df` is sent to the database, so this scales with the number of
+        distinct values in `on`, not the size of 'tablename'.
+        """
+        ...
+
     @abstractmethod
     def execute_to_df(self, query: str, params: Optional[dict] = None) -> pd.DataFrame:
         """
@@ -81,6 +245,27 @@ class Database(ABC):
         """
         ...
 
+    def execute_to_arrow(self, query: str) -> "pyarrow.Table":
+        """Execute the given query and return results as a `pyarrow.Table`.
+        By default, this converts the output of `execute_to_df()`.
+        """
+        if not has_pyarrow():
+            raise ImportError(
+                "Please install pyarrow with `pip install pyarrow`!"
+            ) from None
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(self.execute_to_df(query), preserve_index=False)
+
+    @abstractmethod
+    def iter_df(
+        self, query: str, chunksize: int, params: Optional[dict] = None
+    ) -> Generator[pd.DataFrame, None, None]:
+        """Execute the given query and yield the results as dataframes of at most `chunksize` rows,
+        without loading the full result into memory. Always yields at least one (possibly empty) dataframe.
+        """
+        ...
+
     @abstractmethod
     def execute_to_list(self, query: str, to_type: Callable = lambda x: x) -> list:
         """A lower-level execute method that doesn't use the pandas processing logic.
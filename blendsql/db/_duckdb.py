@@ -1,18 +1,23 @@
+import copy
 import importlib.util
-from typing import Dict, Optional, List, Generator, Set, Union, Callable
+import threading
+from typing import Dict, Optional, List, Generator, Set, Tuple, Union, Callable
 from collections.abc import Collection
 import pandas as pd
 from colorama import Fore
 from attr import attrs, attrib
 from pathlib import Path
-from functools import cached_property
 
-from .utils import double_quote_escape
+from .utils import double_quote_escape, keyed_update_queries, has_pyarrow, LazyTables
 from ._database import Database
+from ._catalog import SchemaCatalog
+from .._trace import traced
 from .._logger import logger
 
 _has_duckdb = importlib.util.find_spec("duckdb") is not None
 
+DUCKDB_VECTOR_SIZE = 2048
+
 
 @attrs
 class DuckDB(Database):
@@ -54,13 +59,52 @@ class DuckDB(Database):
     # or, a single pd.DataFrame object
     con: "DuckDBPyConnection" = attrib()
     db_url: str = attrib()
+    pooled: bool = attrib(default=False)
+    # Shared by all sessions of this database
+    catalog: SchemaCatalog = attrib(init=False)
 
     # We use below to track which tables we should drop on '_reset_connection'
     temp_tables: Set[str] = set()
+    # Views over registered `pyarrow.Table` objects, which we unregister on '_reset_connection'
+    temp_views: Set[str] = set()
+
+    def __attrs_post_init__(self):
+        self._lock = threading.RLock()
+        self._con_lock = threading.RLock()
+        self.lazy_tables = LazyTables()
+        self.temp_tables = set()
+        self.temp_views = set()
+        self.catalog = SchemaCatalog(
+            load_columns=self._load_catalog_columns,
+            count_rows=lambda tablename: self.execute_to_list(
+                f'SELECT COUNT(*) FROM "{double_quote_escape(tablename)}"'
+            )[0],
+        )
+
+    def _load_catalog_columns(self) -> Dict[str, List[Tuple[str, str]]]:
+        """Loads the columns of every table in our current database and schema in a single query.
+        Temp tables live in the separate 'temp' database, so they're never included.
+        """
+        with self._con_lock:
+            rows = self.con.execute(
+                """
+                SELECT c.table_name, c.column_name, c.data_type FROM duckdb_columns() AS c
+                JOIN duckdb_tables() AS t ON c.table_oid = t.table_oid
+                WHERE c.database_name = current_database() AND c.schema_name = current_schema()
+                ORDER BY c.table_name, c.column_index
+                """
+            ).fetchall()
+        columns: Dict[str, List[Tuple[str, str]]] = {}
+        for tablename, columnname, columntype in rows:
+            columns.setdefault(tablename, []).append((columnname, columntype))
+        return columns
 
     @classmethod
     def from_pandas(
-        cls, data: Union[Dict[str, pd.DataFrame], pd.DataFrame], tablename: str = "w"
+        cls,
+        data: Union[Dict[str, pd.DataFrame], pd.DataFrame],
+        tablename: str = "w",
+        pooled: bool = False,
     ):
         if not _has_duckdb:
             raise ImportError(
@@ -86,10 +130,10 @@ class DuckDB(Database):
             raise ValueError(
                 "Unknown datatype passed to `Pandas`!\nWe expect either a single dataframe, or a dictionary mapping many tables from {tablename: df}"
             )
-        return cls(con=con, db_url=db_url)
+        return cls(con=con, db_url=db_url, pooled=pooled)
 
     @classmethod
-    def from_sqlite(cls, db_url: str):
+    def from_sqlite(cls, db_url: str, pooled: bool = False):
         """TODO: any point in this if we already have dedicated SQLite databse class
         and it's faster?
         """
@@ -105,72 +149,200 @@ class DuckDB(Database):
         con.sql("LOAD sqlite;")
         con.sql(f"ATTACH '{db_url}' AS sqlite_db (TYPE sqlite);")
         con.sql("USE sqlite_db")
-        return cls(con=con, db_url=db_url)
+        return cls(con=con, db_url=db_url, pooled=pooled)
 
     def _reset_connection(self):
         """Reset connection, so that temp tables are cleared."""
-        for tablename in self.temp_tables:
-            self.con.execute(f'DROP TABLE IF EXISTS "{tablename}"')
-        self.temp_tables = set()
+        with self._con_lock:
+            for tablename in self.temp_tables:
+                self.con.execute(f'DROP TABLE IF EXISTS "{tablename}"')
+            self.temp_tables = set()
+            for tablename in self.temp_views:
+                self.con.unregister(tablename)
+            self.temp_views = set()
 
-    def has_temp_table(self, tablename: str) -> bool:
-        return tablename in self.execute_to_list("SHOW TABLES")
+    def _open_session(self) -> "DuckDB":
+        """Sessions are cursors on our connection. They share the same database,
+        but each has its own temp tables.
+        """
+        session = copy.copy(self)
+        session.lazy_tables = LazyTables()
+        session.temp_tables = set()
+        session.temp_views = set()
+        session._lock = threading.RLock()
+        session._con_lock = threading.RLock()
+        with self._con_lock:
+            database, schema = self.con.execute(
+                "SELECT current_database(), current_schema()"
+            ).fetchone()
+            session.con = self.con.cursor()
+        # Cursors start on the default database, so match any `USE` on our connection
+        session.con.execute(
+            f'USE "{double_quote_escape(database)}"."{double_quote_escape(schema)}"'
+        )
+        return session
 
-    @cached_property
-    def sqlglot_schema(self) -> dict:
-        """Returns database schema as a dictionary, in the format that
-        sqlglot.optimizer expects.
+    def _close_session(self):
+        self._reset_connection()
+        self.con.close()
 
-        Examples:
-            ```python
-            db.sqlglot_schema
-            > {"x": {"A": "INT", "B": "INT", "C": "INT", "D": "INT", "Z": "STRING"}}
-            ```
-        """
-        schema: Dict[str, dict] = {}
-        for tablename in self.tables():
-            schema[f'"{double_quote_escape(tablename)}"'] = {}
-            for column_name, column_type in self.con.execute(
-                f"SELECT column_name, column_type FROM (DESCRIBE {tablename})"
-            ).fetchall():
-                schema[f'"{double_quote_escape(tablename)}"'][
-                    '"' + column_name + '"'
-                ] = column_type
-        return schema
+    def has_temp_table(self, tablename: str) -> bool:
+        return tablename in self.execute_to_list("SHOW TABLES")
 
     def tables(self) -> List[str]:
-        return self.execute_to_list("SHOW TABLES;")
+        return self.catalog.tables()
 
     def iter_columns(self, tablename: str) -> Generator[str, None, None]:
-        for row in self.con.execute(
-            f"SELECT column_name FROM (DESCRIBE {tablename})"
-        ).fetchall():
+        if tablename in self.catalog:
+            yield from self.catalog.column_names(tablename)
+            return
+        # Temp tables aren't in the catalog
+        with self._con_lock:
+            rows = self.con.execute(
+                f'SELECT column_name FROM (DESCRIBE "{double_quote_escape(tablename)}")'
+            ).fetchall()
+        for row in rows:
             yield row[0]
 
     def schema_string(self, use_tables: Optional[Collection[str]] = None) -> str:
         """Converts the database to a series of 'CREATE TABLE' statements."""
-        # TODO
-        return None
+        create_table_stmts = []
+        for tablename, columns in self.catalog.columns.items():
+            if use_tables:
+                if tablename not in use_tables:
+                    continue
+            column_defs = ", \n".join(
+                f'\t"{double_quote_escape(columnname)}" {columntype}'
+                for columnname, columntype in columns
+            )
+            create_table_stmts.append(
+                f'CREATE TABLE "{double_quote_escape(tablename)}" (\n{column_defs}\n)'
+            )
+        return "\n\n".join(create_table_stmts)
 
-    def to_temp_table(self, df: pd.DataFrame, tablename: str):
+    @traced("db.to_temp_table", "tablename")
+    def to_temp_table(self, df: Union[pd.DataFrame, "pyarrow.Table"], tablename: str):
         """Technically, when duckdb is run in-memory (as is the default),
         all created tables are temporary tables (since they expire at the
         end of the session). So, we don't really need to insert 'TEMP' keyword here?
+
+        If `df` is a `pyarrow.Table`, it's registered as a view without copying any data.
         """
-        # DuckDB has this cool 'CREATE OR REPLACE' syntax
-        # https://duckdb.org/docs/sql/statements/create_table.html#create-or-replace
-        self.con.sql(f'CREATE OR REPLACE TEMP TABLE "{tablename}" AS SELECT * FROM df')
-        self.temp_tables.add(tablename)
+        with self._con_lock:
+            if not isinstance(df, pd.DataFrame):
+                if tablename in self.temp_tables:
+                    self.con.execute(f'DROP TABLE "{tablename}"')
+                    self.temp_tables.discard(tablename)
+                # `register` replaces any existing view with this name
+                self.con.register(tablename, df)
+                self.temp_views.add(tablename)
+            else:
+                if tablename in self.temp_views:
+                    self.con.unregister(tablename)
+                    self.temp_views.discard(tablename)
+                # DuckDB has this cool 'CREATE OR REPLACE' syntax
+                # https://duckdb.org/docs/sql/statements/create_table.html#create-or-replace
+                self.con.sql(
+                    f'CREATE OR REPLACE TEMP TABLE "{tablename}" AS SELECT * FROM df'
+                )
+                self.temp_tables.add(tablename)
+        logger.debug(Fore.CYAN + f"Created temp table {tablename}" + Fore.RESET)
+
+    def index_temp_table(
+        self, tablename: str, columns: Collection[str], num_rows: Optional[int] = None
+    ) -> None:
+        """DuckDB hashes its joins, so indexing temp tables wouldn't speed them up."""
+
+    @traced("db.query_to_temp_table", "query", "tablename")
+    def query_to_temp_table(self, query: str, tablename: str):
+        with self._con_lock:
+            if tablename in self.temp_views:
+                self.con.unregister(tablename)
+                self.temp_views.discard(tablename)
+            self.con.sql(f'CREATE OR REPLACE TEMP TABLE "{tablename}" AS {query}')
+            self.temp_tables.add(tablename)
         logger.debug(Fore.CYAN + f"Created temp table {tablename}" + Fore.RESET)
 
+    @traced("db.merge_into_temp_table", "tablename", "on")
+    def merge_into_temp_table(self, df: pd.DataFrame, tablename: str, on: str):
+        source_tablename = f"{tablename}_merge"
+        with self._con_lock:
+            self.to_temp_table(df=df, tablename=source_tablename)
+            existing_columns = {
+                row[0]
+                for row in self.con.execute(
+                    f'SELECT column_name FROM (DESCRIBE "{tablename}")'
+                ).fetchall()
+            }
+            for column_name, column_type in self.con.execute(
+                f'SELECT column_name, column_type FROM (DESCRIBE "{source_tablename}")'
+            ).fetchall():
+                if column_name in existing_columns:
+                    continue
+                self.con.execute(
+                    f'ALTER TABLE "{double_quote_escape(tablename)}" ADD COLUMN "{double_quote_escape(column_name)}" {column_type}'
+                )
+            for query in keyed_update_queries(
+                tablename=tablename,
+                source_tablename=source_tablename,
+                on=on,
+                columns=[c for c in df.columns if c != on],
+                null_keys=bool(df[on].isnull().any()),
+            ):
+                logger.debug(Fore.LIGHTBLACK_EX + query + Fore.RESET)
+                self.con.execute(query)
+            self.con.execute(f'DROP TABLE "{source_tablename}"')
+            self.temp_tables.discard(source_tablename)
+
+    @traced("db.execute_to_df", "query")
     def execute_to_df(self, query: str, params: Optional[dict] = None) -> pd.DataFrame:
         """On params with duckdb: https://github.com/duckdb/duckdb/issues/9853#issuecomment-1832732933"""
-        return self.con.sql(query).df()
+        self.catalog.on_statement(query)
+        with self._con_lock:
+            return self.con.sql(query).df()
+
+    @traced("db.execute_to_arrow", "query")
+    def execute_to_arrow(self, query: str) -> "pyarrow.Table":
+        """Execute the given query and return results as a `pyarrow.Table`, without going through pandas."""
+        if not has_pyarrow():
+            raise ImportError(
+                "Please install pyarrow with `pip install pyarrow`!"
+            ) from None
+        self.catalog.on_statement(query)
+        with self._con_lock:
+            return self.con.sql(query).arrow()
+
+    def iter_df(
+        self, query: str, chunksize: int, params: Optional[dict] = None
+    ) -> Generator[pd.DataFrame, None, None]:
+        """DuckDB fetches in vectors of 2048 rows, so `chunksize` is rounded down to a multiple of that.
+        Chunks are converted the same way as `execute_to_df()`, so they have the same dtypes.
+        The connection is only locked while fetching each chunk, but the result lives on the connection:
+        other queries on it shouldn't be run until the generator is exhausted (e.g. use a `session()`).
+        """
+        vectors_per_chunk = max(chunksize // DUCKDB_VECTOR_SIZE, 1)
+        self.catalog.on_statement(query)
+        with self._con_lock:
+            # Temp tables only live on `self.con`, so we can't use a separate cursor here
+            result = self.con.execute(query)
+            df = result.fetch_df_chunk(vectors_per_chunk)
+        # Always yield the first chunk, so empty results still carry their columns
+        yield df
+        while len(df) > 0:
+            with self._con_lock:
+                df = result.fetch_df_chunk(vectors_per_chunk)
+            if len(df) > 0:
+                yield df
 
+    @traced("db.execute_to_list", "query")
     def execute_to_list(
         self, query: str, to_type: Optional[Callable] = lambda x: x
     ) -> list:
-        res = []
-        for row in self.con.execute(query).fetchall():
-            res.append(to_type(row[0]))
-        return res
+        self.catalog.on_statement(query)
+        with self._con_lock:
+            if has_pyarrow():
+                # Reads the first column straight from Arrow, instead of building a tuple per row
+                values = self.con.execute(query).arrow().column(0).to_pylist()
+            else:
+                values = [row[0] for row in self.con.execute(query).fetchall()]
+        return [to_type(value) for value in values]
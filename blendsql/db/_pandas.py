@@ -5,7 +5,9 @@ from ._duckdb import DuckDB
 
 
 def Pandas(
-    data: Union[Dict[str, pd.DataFrame], pd.DataFrame], tablename: str = "w"
+    data: Union[Dict[str, pd.DataFrame], pd.DataFrame],
+    tablename: str = "w",
+    pooled: bool = False,
 ) -> DuckDB:
     """This is just a wrapper over the `DuckDB.from_pandas` class method.
     Makes it more intuitive to do a `from blendsql.db import Pandas`, for those
@@ -41,4 +43,4 @@ def Pandas(
         )
         ```
     """
-    return DuckDB.from_pandas(data, tablename)
+    return DuckDB.from_pandas(data, tablename, pooled=pooled)
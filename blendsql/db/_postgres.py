@@ -1,10 +1,14 @@
 import importlib.util
+import io
+import pandas as pd
 from sqlalchemy.engine import make_url, URL
 from colorama import Fore
 import logging
-from functools import cached_property
+from typing import Dict, List, Tuple
+from sqlalchemy.sql import text
 
 from ._sqlalchemy import SQLAlchemyDatabase
+from .utils import double_quote_escape, to_insertable_df
 
 _has_psycopg2 = importlib.util.find_spec("psycopg2") is not None
 
@@ -21,7 +25,9 @@ class PostgreSQL(SQLAlchemyDatabase):
         ```
     """
 
-    def __init__(self, db_path: str):
+    _temp_schema = "pg_temp"
+
+    def __init__(self, db_path: str, pooled: bool = False):
         if not _has_psycopg2:
             raise ImportError(
                 "Please install psycopg2 with `pip install psycopg2-binary`!"
@@ -32,14 +38,58 @@ class PostgreSQL(SQLAlchemyDatabase):
                 Fore.RED
                 + "Connecting to postgreSQL database without specifying user!\nIt is strongly encouraged to create a `blendsql` user with read-only permissions and temp table creation privileges."
             )
-        super().__init__(db_url=db_url)
+        super().__init__(db_url=db_url, pooled=pooled)
 
-    def has_temp_table(self, tablename: str) -> bool:
-        return tablename in self.execute_to_list(
-            "SELECT table_name FROM information_schema.tables WHERE table_schema LIKE 'pg_temp_%'"
+    def _temp_tablenames(self) -> List[str]:
+        # Only look in our own session's temp schema, not those of other connections
+        return self.execute_to_list(
+            "SELECT table_name FROM information_schema.tables WHERE table_schema = (SELECT nspname FROM pg_namespace WHERE oid = pg_my_temp_schema())"
         )
 
-    @cached_property
-    def sqlglot_schema(self) -> dict:
-        # TODO
-        return None
+    def query_to_temp_table(self, query: str, tablename: str):
+        """A failed statement aborts the whole transaction in PostgreSQL, taking our other temp tables
+        with it on rollback. So we run in a savepoint, which leaves the connection usable
+        (e.g. for falling back to materializing with pandas) if `query` fails.
+        """
+        with self._con_lock, self.con.begin_nested():
+            super().query_to_temp_table(query=query, tablename=tablename)
+
+    def _insert_df(self, df: pd.DataFrame, tablename: str):
+        """Bulk insert by streaming `df` as CSV with `COPY FROM STDIN`."""
+        if df.shape[1] == 0:
+            return
+        buffer = io.StringIO()
+        to_insertable_df(df).to_csv(buffer, index=False, header=False, na_rep=r"\N")
+        buffer.seek(0)
+        # `copy_expert` is psycopg2-specific, so we drop down to the DBAPI cursor
+        cursor = self.con.connection.cursor()
+        try:
+            cursor.copy_expert(
+                f'COPY "{double_quote_escape(tablename)}" FROM STDIN '
+                + r"WITH (FORMAT csv, NULL '\N')",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+    def _load_catalog_columns(self) -> Dict[str, List[Tuple[str, str]]]:
+        """Loads the columns of every table in our current schema in a single query,
+        instead of one per table.
+        """
+        with self._con_lock:
+            rows = self.con.execute(
+                text(
+                    """
+                SELECT c.table_name, c.column_name, c.data_type
+                FROM information_schema.columns AS c
+                JOIN information_schema.tables AS t
+                ON c.table_schema = t.table_schema AND c.table_name = t.table_name
+                WHERE t.table_schema = current_schema() AND t.table_type = 'BASE TABLE'
+                ORDER BY c.table_name, c.ordinal_position
+                """
+                )
+            ).fetchall()
+        columns: Dict[str, List[Tuple[str, str]]] = {}
+        for tablename, columnname, columntype in rows:
+            columns.setdefault(tablename, []).append((columnname, columntype))
+        return columns
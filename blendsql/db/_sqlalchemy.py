@@ -1,47 +1,129 @@
-from typing import Generator, List, Callable, Optional, Union
+import copy
+import hashlib
+import threading
+from abc import abstractmethod
+from typing import Dict, Generator, List, Callable, Optional, Tuple
 from collections.abc import Collection
 import pandas as pd
 from colorama import Fore
 import re
 from attr import attrib, attrs
 from sqlalchemy.schema import CreateTable
-from sqlalchemy import create_engine, inspect, MetaData
+from sqlalchemy import create_engine, event, inspect, MetaData
 from sqlalchemy.sql import text
 from sqlalchemy.engine import Engine, Connection, URL
 from pandas.io.sql import get_schema
 
 from ._database import Database
+from ._catalog import SchemaCatalog
+from .._trace import traced
 from .._logger import logger
-from .utils import double_quote_escape, truncate_df_content, LazyTables
-from .bridge_content_encoder import get_database_matches
+from .utils import (
+    double_quote_escape,
+    keyed_update_queries,
+    LazyTables,
+)
 
 
 @attrs(auto_detect=True)
 class SQLAlchemyDatabase(Database):
     db_url: URL = attrib()
+    pooled: bool = attrib(default=False)
 
     engine: Engine = attrib(init=False)
     con: Connection = attrib(init=False)
+    # Shared by all sessions of this database
+    catalog: SchemaCatalog = attrib(init=False)
 
     def __attrs_post_init__(self):
         self.lazy_tables = LazyTables()
+        self._lock = threading.RLock()
+        self._con_lock = threading.RLock()
         self.engine = create_engine(self.db_url)
         self.con = self.engine.connect()
-        self.metadata = MetaData()
-        self.metadata.reflect(bind=self.engine)
+        self.catalog = SchemaCatalog(
+            load_columns=self._load_catalog_columns,
+            count_rows=lambda tablename: self.execute_to_list(
+                f'SELECT COUNT(*) FROM "{double_quote_escape(tablename)}"'
+            )[0],
+        )
+        # Invalidate the catalog whenever something (including another connection from this engine) changes the schema
+        event.listen(
+            self.engine,
+            "before_cursor_execute",
+            lambda conn, cursor, statement, *args: self.catalog.on_statement(statement),
+        )
+
+    def _load_catalog_columns(self) -> Dict[str, List[Tuple[str, str]]]:
+        """Loads the (column name, column type) pairs of each table, for our `SchemaCatalog`."""
+        inspector = inspect(self.engine)
+        return {
+            tablename: [
+                (column_data["name"], str(column_data["type"]))
+                for column_data in inspector.get_columns(tablename)
+            ]
+            for tablename in inspector.get_table_names()
+        }
+
+    @property
+    def metadata(self) -> MetaData:
+        def reflect() -> MetaData:
+            metadata = MetaData()
+            metadata.reflect(bind=self.engine)
+            return metadata
+
+        return self.catalog.get_or_compute("metadata", reflect)
 
     def _reset_connection(self):
         """Reset connection, so that temp tables are cleared."""
-        self.con.close()
-        self.con = self.engine.connect()
+        with self._con_lock:
+            self.con.close()
+            self.con = self.engine.connect()
+
+    @property
+    @abstractmethod
+    def _temp_schema(self) -> str:
+        """Schema our temp tables are created in, e.g. 'temp' in SQLite."""
+        ...
+
+    @abstractmethod
+    def _temp_tablenames(self) -> List[str]:
+        """Names of the temp tables on our connection."""
+        ...
+
+    def _rewrite_query(self, query: str) -> str:
+        """Called on each query before we execute it, for dialect-specific rewrites."""
+        return query
+
+    def has_temp_table(self, tablename: str) -> bool:
+        return tablename in self._temp_tablenames()
+
+    def _open_session(self) -> "SQLAlchemyDatabase":
+        session = copy.copy(self)
+        session.lazy_tables = LazyTables()
+        session._lock = threading.RLock()
+        session._con_lock = threading.RLock()
+        # Checked out from the engine's connection pool
+        session.con = self.engine.connect()
+        return session
+
+    def _close_session(self):
+        """Drops our temp tables, so the connection goes back to the pool clean."""
+        with self._con_lock:
+            for tablename in self._temp_tablenames():
+                self.con.execute(
+                    text(
+                        f'DROP TABLE IF EXISTS {self._temp_schema}."{double_quote_escape(tablename)}"'
+                    )
+                )
+            self.con.commit()
+            self.con.close()
 
     def tables(self) -> List[str]:
-        return inspect(self.engine).get_table_names()
+        return self.catalog.tables()
 
     def iter_columns(self, tablename: str) -> Generator[str, None, None]:
-        if tablename in self.tables():
-            for column_data in inspect(self.engine).get_columns(tablename):
-                yield column_data["name"]
+        yield from self.catalog.column_names(tablename)
 
     def schema_string(self, use_tables: Optional[Collection[str]] = None) -> str:
         create_table_stmts = []
@@ -52,83 +134,89 @@ class SQLAlchemyDatabase(Database):
             create_table_stmts.append(str(CreateTable(table)).strip())
         return "\n\n".join(create_table_stmts)
 
-    def to_serialized(
-        self,
-        num_rows: int = 3,
-        truncate_content: int = 300,
-        use_tables: Optional[Collection[str]] = None,
-        include_content: Union[str, Collection[str]] = "all",
-        use_bridge_encoder: bool = False,
-        question: Optional[str] = None,
-    ) -> str:
-        """Returns a string representation of the database, with example rows."""
-        serialized_db = []
-        for tablename in self.tables():
-            if use_tables is not None:
-                if tablename not in use_tables:
-                    continue
-            serialized_db.append(self.schema_string(use_tables=[tablename]))
-            if include_content != "all":
-                if tablename not in include_content:
-                    serialized_db.append("\n")
-                    continue
-            get_rows_query = (
-                f'SELECT * FROM "{double_quote_escape(tablename)}" LIMIT {num_rows}'
-            )
-            total_num_rows = self.execute_to_list(
-                f'SELECT COUNT(*) FROM "{double_quote_escape(tablename)}"'
-            )[0]
-            serialized_db.append("/*")
-            serialized_db.append(
-                f"{num_rows} example rows:"
-                if num_rows < total_num_rows
-                else "Entire table:"
+    @traced("db.to_temp_table", "tablename")
+    def to_temp_table(self, df: pd.DataFrame, tablename: str):
+        with self._con_lock:
+            if self.has_temp_table(tablename):
+                self.con.execute(text(f'DROP TABLE "{tablename}"'))
+            create_table_stmt = get_schema(df, name=tablename, con=self.con).strip()
+            # Insert 'TEMP' keyword
+            create_table_stmt = re.sub(
+                r"^CREATE TABLE", "CREATE TEMP TABLE", create_table_stmt
             )
-            rows = self.execute_to_df(get_rows_query)
-            if truncate_content is not None:
-                # Truncate long strings
-                rows = truncate_df_content(rows, truncate_content)
-                serialized_db.append(get_rows_query)
-            serialized_db.append(f"{rows.to_string(index=False)}")
-            serialized_db.append("*/\n")
-            if use_bridge_encoder:
-                bridge_hints = []
-                column_str_with_values = "{table}.{column} ( {values} )"
-                value_sep = " , "
-                for columnname in self.iter_columns(tablename):
-                    matches = get_database_matches(
-                        question=question,
-                        table_name=tablename,
-                        column_name=columnname,
-                        db=self,
-                    )
-                    if matches:
-                        bridge_hints.append(
-                            column_str_with_values.format(
-                                table=tablename,
-                                column=columnname,
-                                values=value_sep.join(matches),
-                            )
-                        )
-                if len(bridge_hints) > 0:
-                    serialized_db.append(
-                        "Here are some values that may be useful: "
-                        + " , ".join(bridge_hints)
-                    )
-        return "\n".join(serialized_db).strip()
+            logger.debug(Fore.LIGHTBLACK_EX + create_table_stmt + Fore.RESET)
+            self.con.execute(text(create_table_stmt))
+            self._insert_df(df=df, tablename=tablename)
 
-    def to_temp_table(self, df: pd.DataFrame, tablename: str):
-        if self.has_temp_table(tablename):
-            self.con.execute(text(f'DROP TABLE "{tablename}"'))
-        create_table_stmt = get_schema(df, name=tablename, con=self.con).strip()
-        # Insert 'TEMP' keyword
-        create_table_stmt = re.sub(
-            r"^CREATE TABLE", "CREATE TEMP TABLE", create_table_stmt
-        )
-        logger.debug(Fore.LIGHTBLACK_EX + create_table_stmt + Fore.RESET)
-        self.con.execute(text(create_table_stmt))
+    def _insert_df(self, df: pd.DataFrame, tablename: str):
+        """Insert the rows of `df` into the existing table 'tablename'.
+        Subclasses can override this with a faster, dialect-specific bulk load.
+        """
         df.to_sql(name=tablename, con=self.con, if_exists="append", index=False)
 
+    @traced("db.index_temp_table", "tablename")
+    def index_temp_table(
+        self, tablename: str, columns: Collection[str], num_rows: Optional[int] = None
+    ) -> None:
+        with self._con_lock:
+            if num_rows is None:
+                num_rows = self.con.execute(
+                    text(f'SELECT COUNT(*) FROM "{double_quote_escape(tablename)}"')
+                ).scalar()
+            if num_rows < self.temp_table_index_min_rows:
+                return
+            for column in columns:
+                # Hashed, to stay within identifier length limits (e.g. 63 chars in PostgreSQL)
+                index_name = (
+                    "blendsql_idx_"
+                    + hashlib.md5(f"{tablename}||{column}".encode()).hexdigest()[:16]
+                )
+                create_index_stmt = f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{double_quote_escape(tablename)}" ("{double_quote_escape(column)}")'
+                logger.debug(Fore.LIGHTBLACK_EX + create_index_stmt + Fore.RESET)
+                self.con.execute(text(create_index_stmt))
+
+    @traced("db.query_to_temp_table", "query", "tablename")
+    def query_to_temp_table(self, query: str, tablename: str):
+        with self._con_lock:
+            if self.has_temp_table(tablename):
+                self.con.execute(text(f'DROP TABLE "{tablename}"'))
+            create_table_stmt = (
+                f'CREATE TEMP TABLE "{tablename}" AS {self._rewrite_query(query)}'
+            )
+            logger.debug(Fore.LIGHTBLACK_EX + create_table_stmt + Fore.RESET)
+            self.con.execute(text(create_table_stmt))
+
+    @traced("db.merge_into_temp_table", "tablename", "on")
+    def merge_into_temp_table(self, df: pd.DataFrame, tablename: str, on: str):
+        source_tablename = f"{tablename}_merge"
+        with self._con_lock:
+            self.to_temp_table(df=df, tablename=source_tablename)
+            existing_columns = {
+                column_data["name"]
+                for column_data in inspect(self.con).get_columns(tablename)
+            }
+            for column_data in inspect(self.con).get_columns(source_tablename):
+                if column_data["name"] in existing_columns:
+                    continue
+                self.con.execute(
+                    text(
+                        f'ALTER TABLE "{double_quote_escape(tablename)}" ADD COLUMN "{double_quote_escape(column_data["name"])}" {column_data["type"].compile(dialect=self.con.dialect)}'
+                    )
+                )
+            # Each row of 'source_tablename' looks up its matching rows in 'tablename'
+            self.index_temp_table(tablename, [on])
+            for query in keyed_update_queries(
+                tablename=tablename,
+                source_tablename=source_tablename,
+                on=on,
+                columns=[c for c in df.columns if c != on],
+                null_keys=bool(df[on].isnull().any()),
+            ):
+                logger.debug(Fore.LIGHTBLACK_EX + query + Fore.RESET)
+                self.con.execute(text(query))
+            self.con.execute(text(f'DROP TABLE "{source_tablename}"'))
+
+    @traced("db.execute_to_df", "query")
     def execute_to_df(self, query: str, params: Optional[dict] = None) -> pd.DataFrame:
         """
         Execute the given query and return results as dataframe.
@@ -148,13 +236,46 @@ class SQLAlchemyDatabase(Database):
             db.execute_query("SELECT * FROM t WHERE c = :v", {"v": "value"})
             ```
         """
-        return pd.read_sql(text(query), self.con, params=params)
+        with self._con_lock:
+            return pd.read_sql(
+                text(self._rewrite_query(query)), self.con, params=params
+            )
+
+    def iter_df(
+        self, query: str, chunksize: int, params: Optional[dict] = None
+    ) -> Generator[pd.DataFrame, None, None]:
+        """Uses a server-side cursor where the dialect supports one (e.g. PostgreSQL),
+        so only `chunksize` rows are fetched from the database at a time.
+        The connection is only locked while fetching each chunk, not while the caller holds it.
+        """
+        with self._con_lock:
+            result = self.con.execution_options(
+                stream_results=True, max_row_buffer=chunksize
+            ).execute(text(self._rewrite_query(query)), params or {})
+            columns = list(result.keys())
+            partitions = result.partitions(chunksize)
+        num_chunks = 0
+        try:
+            while True:
+                with self._con_lock:
+                    rows = next(partitions, None)
+                if rows is None:
+                    break
+                num_chunks += 1
+                yield pd.DataFrame.from_records(
+                    rows, columns=columns, coerce_float=True
+                )
+        finally:
+            with self._con_lock:
+                result.close()
+        if num_chunks == 0:
+            yield pd.DataFrame(columns=columns)
 
+    @traced("db.execute_to_list", "query")
     def execute_to_list(self, query: str, to_type: Callable = lambda x: x) -> list:
         """A lower-level execute method that doesn't use the pandas processing logic.
         Returns results as a tuple.
         """
-        res = []
-        for row in self.con.execute(text(query)).fetchall():
-            res.append(to_type(row[0]))
-        return res
+        with self._con_lock:
+            rows = self.con.execute(text(self._rewrite_query(query))).fetchall()
+        return [to_type(row[0]) for row in rows]
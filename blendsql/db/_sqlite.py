@@ -1,51 +1,221 @@
+import re
 from pathlib import Path
 from sqlalchemy.engine import make_url, URL
-from functools import cached_property
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+from sqlalchemy.sql import text
+from sqlglot import exp
+from sqlglot.errors import ParseError
+import pandas as pd
+from colorama import Fore
 
-from .utils import double_quote_escape
+from .utils import double_quote_escape, to_insertable_df
 from ._sqlalchemy import SQLAlchemyDatabase
+from .._logger import logger
+from ..parse import _parse_one, FTS5SQLite, transform
+
+# Number of rows passed to each `executemany()` call in `to_temp_table()`
+INSERT_BATCH_SIZE = 50_000
+# Name we attach the database holding our full-text indexes under
+FTS_SCHEMA = "blendsql_fts"
+# Suffix of the full-text index database, stored next to the database file
+FTS_PATH_SUFFIX = ".blendsql-fts"
+_MATCH_PATTERN = re.compile(r"\bMATCH\b", re.IGNORECASE)
 
 
 class SQLite(SQLAlchemyDatabase):
     """A SQLite database connection.
     Can be initialized via a path to the database file.
 
+    `column MATCH '...'` predicates on regular tables are rewritten to use an
+    [FTS5](https://www.sqlite.org/fts5.html) index of that column, which is built
+    the first time it's needed and stored next to the database file.
+
     Examples:
         ```python
         from blendsql.db import SQLite
         db = SQLite("./path/to/database.db")
+        # Or, to serve many `blend()` calls at once from a pool of connections
+        db = SQLite("./path/to/database.db", pooled=True)
         ```
     """
 
-    def __init__(self, db_path: str):
+    _temp_schema = "temp"
+
+    def __init__(self, db_path: str, pooled: bool = False):
         db_url: URL = make_url(f"sqlite:///{Path(db_path).resolve()}")
-        super().__init__(db_url=db_url)
+        super().__init__(db_url=db_url, pooled=pooled)
 
-    def has_temp_table(self, tablename: str) -> bool:
-        return tablename in self.execute_to_list(
+    def _temp_tablenames(self) -> List[str]:
+        return self.execute_to_list(
             "SELECT name FROM sqlite_temp_master WHERE type='table';"
         )
 
-    @cached_property
-    def sqlglot_schema(self) -> dict:
-        """Returns database schema as a dictionary, in the format that
-        sqlglot.optimizer expects.
+    def _insert_df(self, df: pd.DataFrame, tablename: str):
+        """Bulk insert via the sqlite3 driver's `executemany()`,
+        skipping the per-row overhead of `DataFrame.to_sql`.
+        """
+        if df.shape[1] == 0:
+            return
+        insert_stmt = f'INSERT INTO "{double_quote_escape(tablename)}" VALUES ({", ".join(["?"] * df.shape[1])})'
+        for start in range(0, len(df), INSERT_BATCH_SIZE):
+            records = list(
+                to_insertable_df(df.iloc[start : start + INSERT_BATCH_SIZE]).itertuples(
+                    index=False, name=None
+                )
+            )
+            self.con.exec_driver_sql(insert_stmt, records)
+
+    def _load_catalog_columns(self) -> Dict[str, List[Tuple[str, str]]]:
+        """Loads the columns of every table in a single query, instead of one per table."""
+        with self._con_lock:
+            rows = self.con.execute(
+                text(
+                    """
+                SELECT m.name, p.name, p.type FROM sqlite_master AS m
+                JOIN pragma_table_info(m.name) AS p
+                WHERE m.type = 'table' AND m.name NOT LIKE 'sqlite~_%' ESCAPE '~'
+                ORDER BY m.name, p.cid
+                """
+                )
+            ).fetchall()
+        columns: Dict[str, List[Tuple[str, str]]] = {}
+        for tablename, columnname, columntype in rows:
+            columns.setdefault(tablename, []).append((columnname, columntype))
+        return columns
+
+    @property
+    def fts_path(self) -> Path:
+        """The database file holding our full-text indexes of this database."""
+        db_path = Path(self.db_url.database)
+        return db_path.with_name(db_path.name + FTS_PATH_SUFFIX)
+
+    def _attach_fts(self):
+        """Attaches `fts_path` to our connection, if it isn't already."""
+        with self._con_lock:
+            schemas = [row[1] for row in self.con.execute(text("PRAGMA database_list"))]
+            if FTS_SCHEMA not in schemas:
+                self.con.execute(
+                    text(f"ATTACH DATABASE :path AS {FTS_SCHEMA}"),
+                    {"path": str(self.fts_path)},
+                )
+
+    def _sync_fts_index(self, tablename: str, columnname: str) -> Optional[str]:
+        """(Re)builds the full-text index of 'tablename'.'columnname', unless the
+        index we have was built from the same version of the data.
 
-        Examples:
-            >>> db.sqlglot_schema
-            {"x": {"A": "INT", "B": "INT", "C": "INT", "D": "INT", "Z": "STRING"}}
+        Since we can't tell when another process last wrote to the table, the data version
+        is the row count, max rowid and total length of the column, which catches
+        inserts, deletes and nearly all updates with a single scan of the table.
+
+        Returns:
+            Name of the index table in `FTS_SCHEMA`, or None if 'tablename' can't be indexed
+        """
+        fts_tablename = f"{tablename}__{columnname}"
+        quoted_tablename = f'"{double_quote_escape(tablename)}"'
+        quoted_columnname = f'"{double_quote_escape(columnname)}"'
+        quoted_fts_tablename = f'{FTS_SCHEMA}."{double_quote_escape(fts_tablename)}"'
+        with self._con_lock:
+            create_stmt = self.con.execute(
+                text(
+                    "SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = :name"
+                ),
+                {"name": tablename},
+            ).scalar()
+            # FTS tables can already be queried with MATCH, and `WITHOUT ROWID` tables have no rowid to index on
+            if create_stmt is None or re.search(
+                r"^CREATE\s+VIRTUAL\b|\bWITHOUT\s+ROWID\b", create_stmt, re.IGNORECASE
+            ):
+                return None
+            data_version = ":".join(
+                str(v)
+                for v in self.con.execute(
+                    text(
+                        f"SELECT COUNT(*), MAX(rowid), TOTAL(LENGTH({quoted_columnname})) FROM main.{quoted_tablename}"
+                    )
+                ).one()
+            )
+            self.con.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {FTS_SCHEMA}.versions (fts_tablename TEXT PRIMARY KEY, data_version TEXT)"
+                )
+            )
+            indexed_data_version = self.con.execute(
+                text(
+                    f"SELECT data_version FROM {FTS_SCHEMA}.versions WHERE fts_tablename = :name"
+                ),
+                {"name": fts_tablename},
+            ).scalar()
+            if indexed_data_version == data_version:
+                return fts_tablename
+            logger.debug(
+                Fore.YELLOW
+                + f"Building full-text index of {tablename}.{columnname}..."
+                + Fore.RESET
+            )
+            # Contentless, since the text is already stored in 'tablename'
+            for stmt in [
+                f"DROP TABLE IF EXISTS {quoted_fts_tablename}",
+                f"CREATE VIRTUAL TABLE {quoted_fts_tablename} USING fts5({quoted_columnname}, content='')",
+                f"INSERT INTO {quoted_fts_tablename} (rowid, {quoted_columnname}) SELECT rowid, {quoted_columnname} FROM main.{quoted_tablename}",
+            ]:
+                logger.debug(Fore.LIGHTBLACK_EX + stmt + Fore.RESET)
+                self.con.execute(text(stmt))
+            self.con.execute(
+                text(
+                    f"INSERT OR REPLACE INTO {FTS_SCHEMA}.versions VALUES (:name, :data_version)"
+                ),
+                {"name": fts_tablename, "data_version": data_version},
+            )
+            self.con.commit()
+        return fts_tablename
+
+    def _fts_match_predicate(
+        self, table: exp.Table, column: exp.Column, query: exp.Expression
+    ) -> Optional[exp.Expression]:
+        """Turns `column MATCH query` into a lookup of the rowids matching `query`
+        in the full-text index of `column`.
         """
-        schema: Dict[str, dict] = {}
-        for tablename in self.tables():
-            schema[f'"{double_quote_escape(tablename)}"'] = {}
-            for _, row in self.execute_to_df(
-                f"""
-            SELECT name, type FROM pragma_table_info(:t)
-            """,
-                {"t": tablename},
-            ).iterrows():
-                schema[f'"{double_quote_escape(tablename)}"'][
-                    '"' + row["name"] + '"'
-                ] = row["type"]
-        return schema
+        if table.db and table.db.lower() != "main":
+            return None
+        # Identifiers are case-insensitive in SQLite
+        tablename = next(
+            (t for t in self.catalog.tables() if t.lower() == table.name.lower()), None
+        )
+        if tablename is None:
+            return None
+        columnname = next(
+            (
+                c
+                for c in self.catalog.column_names(tablename)
+                if c.lower() == column.name.lower()
+            ),
+            None,
+        )
+        if columnname is None:
+            # e.g. `documents MATCH '...'` on an FTS table
+            return None
+        self._attach_fts()
+        fts_tablename = self.catalog.get_or_compute(
+            f"fts||{tablename}||{columnname}",
+            lambda: self._sync_fts_index(tablename, columnname),
+            tablename=tablename,
+        )
+        if fts_tablename is None:
+            return None
+        fts_tablename = double_quote_escape(fts_tablename)
+        return _parse_one(
+            f'"{double_quote_escape(column.table or table.alias_or_name)}".rowid IN '
+            f'(SELECT rowid FROM {FTS_SCHEMA}."{fts_tablename}" WHERE "{fts_tablename}" MATCH {query.sql(dialect=FTS5SQLite)})'
+        )
+
+    def _rewrite_query(self, query: str) -> str:
+        if _MATCH_PATTERN.search(query) is None:
+            return query
+        try:
+            node = _parse_one(query)
+        except ParseError:
+            return query
+        with self._con_lock:
+            if not transform.rewrite_match_predicates(node, self._fts_match_predicate):
+                return query
+        return node.sql(dialect=FTS5SQLite)
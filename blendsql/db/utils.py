@@ -1,6 +1,8 @@
 import re
+import importlib.util
 import pandas as pd
-from typing import Callable
+from functools import lru_cache
+from typing import Callable, List
 from attr import attrs, attrib
 
 
@@ -35,6 +37,20 @@ class LazyTables(dict):
         self[lazy_table.tablename] = lazy_table
 
 
+@lru_cache(maxsize=None)
+def has_pyarrow() -> bool:
+    """Checks that pyarrow can actually be imported, not just that it's installed,
+    since a pyarrow built against a different numpy fails on import.
+    """
+    if importlib.util.find_spec("pyarrow") is None:
+        return False
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
 def single_quote_escape(s):
     return re.sub(r"(?<=[^'])'(?=[^'])", "''", s)
 
@@ -51,6 +67,54 @@ def select_all_from_table_query(tablename: str) -> str:
     return f'SELECT * FROM "{double_quote_escape(tablename)}";'
 
 
+def keyed_update_queries(
+    tablename: str, source_tablename: str, on: str, columns: List[str], null_keys: bool
+) -> List[str]:
+    """Builds `UPDATE ... FROM` statements, which copy `columns` from 'source_tablename'
+    into the rows of 'tablename' sharing the same value in column `on`.
+    Non-null values in 'source_tablename' take priority over those already in 'tablename'.
+
+    Since `NULL = NULL` is never true, rows with a null key are matched in a separate statement
+    when `null_keys` is True. This keeps the first join an equi-join, which all our DBMS can hash.
+    """
+    t, s, k = (
+        double_quote_escape(tablename),
+        double_quote_escape(source_tablename),
+        double_quote_escape(on),
+    )
+    set_clause = ", ".join(
+        f'"{c}" = COALESCE("{s}"."{c}", "{t}"."{c}")'
+        for c in map(double_quote_escape, columns)
+    )
+    conditions = [f'"{t}"."{k}" = "{s}"."{k}"']
+    if null_keys:
+        conditions.append(f'"{t}"."{k}" IS NULL AND "{s}"."{k}" IS NULL')
+    return [
+        f'UPDATE "{t}" SET {set_clause} FROM "{s}" WHERE {condition}'
+        for condition in conditions
+    ]
+
+
+def to_insertable_df(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts a dataframe to plain Python objects which DBAPI drivers can write directly,
+    following the conventions of `DataFrame.to_sql`. Missing values become `None`.
+    """
+    columns = []
+    for idx in range(df.shape[1]):
+        column = df.iloc[:, idx]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            converted = column.dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+        elif pd.api.types.is_timedelta64_dtype(column):
+            # Written as integer nanoseconds
+            converted = column.map(lambda x: x.value if not pd.isna(x) else None)
+        else:
+            converted = column.astype(object)
+        columns.append(converted.astype(object).where(column.notna(), None))
+    insertable_df = pd.concat(columns, axis=1) if columns else df.copy()
+    insertable_df.columns = df.columns
+    return insertable_df
+
+
 def truncate_df_content(df: pd.DataFrame, truncation_limit: int) -> pd.DataFrame:
     # Truncate long strings
     return df.map(
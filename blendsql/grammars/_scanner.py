@@ -0,0 +1,224 @@
+"""Single-pass recognizer for BlendSQL ingredient calls (`{{Func(args, kw=...)}}`).
+
+Accepts exactly the same language as the pyparsing grammar in `_peg_grammar.py`,
+and returns the same structure as `grammar.scanString()`, with each `ParseResults`
+replaced by its `as_dict()`. But since we only need to look at the text between
+"{{" and "}}", we skip straight to each "{{" and match with a few compiled regexes,
+instead of going through pyparsing's packrat machinery.
+
+One difference: pyparsing expands tabs before scanning, so its indices can drift from
+the original string. Ours always index into the string we're given.
+"""
+
+import re
+from typing import Generator, List, Optional, Tuple, Union
+
+_WHITESPACE = " \n\t\r"
+_FUNCTION_NAME = re.compile(r"[A-Za-z0-9_]+")
+_KWARG_NAME = re.compile(r"[A-Za-z_]+")
+_INT = re.compile(r"[0-9]+")
+_FLOAT = re.compile(r"-?[0-9]+\.[0-9]+")
+# Top-level string args, which are unquoted and unescaped
+_STRING = {
+    '"': re.compile(r'"(?:(?:\\.)|(?:[^"\\]))*"', re.DOTALL),
+    "'": re.compile(r"'(?:(?:\\.)|(?:[^'\\]))*'", re.DOTALL),
+}
+_UNESCAPE = re.compile(r"(\\t|\\n|\\f|\\r)|(\\.)|(\n|.)", re.DOTALL)
+_WHITESPACE_ESCAPES = {"\\t": "\t", "\\n": "\n", "\\f": "\f", "\\r": "\r"}
+# Within parenthesized args, quoted strings and comments are kept verbatim.
+# Like pyparsing, the body of a quoted string is matched greedily (without backtracking),
+#   and then must be followed by the closing quote
+_QUOTED_BODY = {
+    '"': re.compile(r"\"(?:[^\"\n\r\\]|(?:\"\")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"),
+    "'": re.compile(r"'(?:[^'\n\r\\]|(?:'')|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*"),
+}
+_COMMENT = re.compile(r"--(?:\\\n|[^\n])*")
+_CONTENT = re.compile(r"[^()'\"\- \n\t\r]+")
+
+Arg = Union[str, int, float]
+
+
+def _skip_whitespace(s: str, pos: int) -> int:
+    while pos < len(s) and s[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+def _unescape(s: str) -> str:
+    return "".join(
+        _WHITESPACE_ESCAPES[m.group(1)]
+        if m.group(1)
+        else m.group(2)[-1]
+        if m.group(2)
+        else m.group(3)
+        for m in _UNESCAPE.finditer(s)
+    )
+
+
+def _match_ignored(s: str, pos: int) -> Optional[Tuple[str, int]]:
+    """Matches a comment or a quoted string."""
+    comment = _COMMENT.match(s, pos)
+    if comment is not None:
+        return (comment.group(), comment.end())
+    if s[pos] in _QUOTED_BODY:
+        body = _QUOTED_BODY[s[pos]].match(s, pos)
+        if s.startswith(s[pos], body.end()):
+            return (s[pos : body.end() + 1], body.end() + 1)
+    return None
+
+
+def _match_parenthesized(s: str, pos: int) -> Optional[Tuple[str, int]]:
+    """Matches a balanced parenthesized expression starting at `s[pos] == "("`.
+    Tokens are joined with single spaces, e.g. '(SELECT COUNT(*) FROM t)' -> '( SELECT COUNT ( * ) FROM t )'.
+    """
+    tokens: List[str] = ["("]
+    pos += 1
+    while True:
+        pos = _skip_whitespace(s, pos)
+        if pos >= len(s):
+            return None
+        ignored = _match_ignored(s, pos)
+        if ignored is not None:
+            tokens.append(ignored[0])
+            pos = ignored[1]
+        elif s[pos] == "(":
+            nested = _match_parenthesized(s, pos)
+            if nested is None:
+                return None
+            tokens.append(nested[0])
+            pos = nested[1]
+        elif s[pos] == ")":
+            tokens.append(")")
+            return (" ".join(tokens), pos + 1)
+        else:
+            start = pos
+            while pos < len(s):
+                content = _CONTENT.match(s, pos)
+                if content is not None:
+                    pos = content.end()
+                    continue
+                if s[pos] in "()" + _WHITESPACE or _match_ignored(s, pos):
+                    break
+                pos += 1
+            tokens.append(s[start:pos].strip())
+
+
+def _match_arg(s: str, pos: int) -> Optional[Tuple[Arg, int]]:
+    if pos >= len(s):
+        return None
+    c = s[pos]
+    if c in _STRING:
+        m = _STRING[c].match(s, pos)
+        if m is not None:
+            return (_unescape(m.group()[1:-1]), m.end())
+    m = _FLOAT.match(s, pos)
+    if m is not None:
+        return (float(m.group()), m.end())
+    m = _INT.match(s, pos)
+    if m is not None:
+        return (int(m.group()), m.end())
+    if c == "(":
+        return _match_parenthesized(s, pos)
+    return None
+
+
+def _followed_by(s: str, pos: int, char: str) -> bool:
+    pos = _skip_whitespace(s, pos)
+    return pos < len(s) and s[pos] == char
+
+
+def _match_positional_arg(s: str, pos: int) -> Optional[Tuple[Arg, int]]:
+    """`arg` or `, arg`, as long as it isn't followed by '='."""
+    for with_comma in (False, True):
+        start = _skip_whitespace(s, pos)
+        if with_comma:
+            if not _followed_by(s, start, ","):
+                return None
+            start = _skip_whitespace(s, start + 1)
+        res = _match_arg(s, start)
+        if res is not None and not _followed_by(s, res[1], "="):
+            return res
+    return None
+
+
+def _match_kwarg(s: str, pos: int) -> Optional[Tuple[list, int]]:
+    """`name=arg` or `, name=arg`."""
+    for with_comma in (False, True):
+        start = _skip_whitespace(s, pos)
+        if with_comma:
+            if not _followed_by(s, start, ","):
+                return None
+            start = _skip_whitespace(s, start + 1)
+        name = _KWARG_NAME.match(s, start)
+        if name is None or not _followed_by(s, name.end(), "="):
+            continue
+        res = _match_arg(s, _skip_whitespace(s, _skip_whitespace(s, name.end()) + 1))
+        if res is not None:
+            return ([name.group(), "=", res[0]], res[1])
+    return None
+
+
+def _match_ingredient(s: str, pos: int) -> Optional[Tuple[dict, int]]:
+    """Matches a full `{{Func(args, kw=...)}}` starting at `s[pos:pos+2] == "{{"`."""
+    pos = _skip_whitespace(s, pos + 2)
+    function_name = _FUNCTION_NAME.match(s, pos)
+    if function_name is None:
+        return None
+    pos = _skip_whitespace(s, function_name.end())
+    if not s.startswith("(", pos):
+        return None
+    pos += 1
+    args, kwargs = [], []
+    while True:
+        res = _match_positional_arg(s, pos)
+        if res is None:
+            break
+        args.append(res[0])
+        pos = res[1]
+    while True:
+        res = _match_kwarg(s, pos)
+        if res is None:
+            break
+        kwargs.append(res[0])
+        pos = res[1]
+    pos = _skip_whitespace(s, pos)
+    if not s.startswith(")", pos):
+        return None
+    pos = _skip_whitespace(s, pos + 1)
+    if not s.startswith("}}", pos):
+        return None
+    return (
+        {"function": function_name.group(), "args": args, "kwargs": kwargs},
+        pos + 2,
+    )
+
+
+def scan_ingredients(query: str) -> Generator[Tuple[dict, int, int], None, None]:
+    """Yields each ingredient call in `query`, from left to right.
+
+    Examples:
+        ```python
+        list(scan_ingredients("SELECT * FROM w WHERE {{LLMMap('Is a city?', 'w::name', k=2)}}"))
+        ```
+        ```text
+        [
+            (
+                {'function': 'LLMMap', 'args': ['Is a city?', 'w::name'], 'kwargs': [['k', '=', 2]]},
+                22,
+                62
+            )
+        ]
+        ```
+
+    Returns:
+        Generator of (parsed_dict, start, end) tuples, where `query[start:end]` is the ingredient call
+    """
+    pos = query.find("{{")
+    while pos != -1:
+        res = _match_ingredient(query, pos)
+        if res is None:
+            pos = query.find("{{", pos + 1)
+            continue
+        parsed_dict, end = res
+        yield (parsed_dict, pos, end)
+        pos = query.find("{{", end)
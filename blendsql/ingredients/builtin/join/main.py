@@ -1,7 +1,15 @@
-from typing import List, Optional, Tuple
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from colorama import Fore
+from tqdm import tqdm
 import guidance
 
-from blendsql.models import Model, LocalModel
+from blendsql.models import Model, LocalModel, RemoteModel
+from blendsql._logger import logger
+from blendsql._trace import set_span_attributes, bind_current_context
+from blendsql._fuzzy_index import FuzzyIndex
 from blendsql._program import Program
 from blendsql import _constants as CONST
 from blendsql.ingredients.ingredient import JoinIngredient
@@ -9,6 +17,30 @@ from blendsql.utils import newline_dedent
 from blendsql.ingredients.generate import generate
 
 
+@guidance(stateless=True, dedent=False)
+def make_join_predictions(
+    lm,
+    left_values: List[str],
+    right_values: List[str],
+    candidates: Optional[Dict[str, List[str]]] = None,
+):
+    """Writes a JSON-like mapping from each left value to one of its options."""
+    lm += "{"
+    for idx, value in enumerate(left_values):
+        # Only let each left value pick from its own candidates, if we have them
+        options = (
+            candidates[value]
+            if candidates is not None and value in candidates
+            else right_values
+        )
+        lm += (
+            f'\n\t"{value}": '
+            + guidance.capture(guidance.select(options=options), name=value)
+            + ("," if idx + 1 != len(left_values) else "")
+        )
+    return lm
+
+
 class JoinProgram(Program):
     def __call__(
         self,
@@ -17,6 +49,7 @@ class JoinProgram(Program):
         left_values: List[str],
         right_values: List[str],
         sep: str,
+        candidates: Optional[Dict[str, List[str]]] = None,
         **kwargs,
     ) -> Tuple[str, str]:
         if isinstance(model, LocalModel):
@@ -68,21 +101,11 @@ class JoinProgram(Program):
                 )
             prompt = m._current_prompt()
 
-            @guidance(stateless=True, dedent=False)
-            def make_predictions(lm, left_values, right_values):
-                lm += "{"
-                gen_f = guidance.select(options=right_values)
-                for idx, value in enumerate(left_values):
-                    lm += (
-                        f'\n\t"{value}": '
-                        + guidance.capture(gen_f, name=value)
-                        + ("," if idx + 1 != len(right_values) else "")
-                    )
-                return lm
-
             with guidance.assistant():
-                m += make_predictions(
-                    left_values=left_values, right_values=right_values
+                m += make_join_predictions(
+                    left_values=left_values,
+                    right_values=right_values,
+                    candidates=candidates,
                 )
             return (m._variables, prompt)
         else:
@@ -154,6 +177,71 @@ class JoinProgram(Program):
             return (mapping, prompt)
 
 
+def get_join_candidates(
+    left_values: List[str],
+    right_values: List[str],
+    num_candidates: int,
+    index: Optional[FuzzyIndex] = None,
+) -> List[List[str]]:
+    """For each left value, finds the `num_candidates` right values with the most
+    similar character n-grams (by TF-IDF cosine similarity), best match first.
+    If there are no more than `num_candidates` right values, all of them are candidates.
+
+    Args:
+        index: Optional `FuzzyIndex` containing (at least) all of `right_values`,
+            e.g. over their whole column. If None, we index `right_values` here.
+
+    Examples:
+        ```python
+        get_join_candidates(["bob brown", "ron ryan"], ["ron ryan", "colby mules", "bob brown (ice hockey)"], num_candidates=1)
+        ```
+        ```text
+        [['bob brown (ice hockey)'], ['ron ryan']]
+        ```
+    """
+    if len(right_values) <= num_candidates:
+        return [list(right_values) for _ in left_values]
+    exclude = None
+    if index is None:
+        index = FuzzyIndex(right_values)
+    elif len(index) > len(right_values):
+        exclude = set(index.values).difference(map(str, right_values))
+    indices, _ = index.top_k(left_values, k=num_candidates, exclude=exclude)
+    return np.array(index.values, dtype=object)[indices].tolist()
+
+
+def get_join_blocks(
+    left_values: List[str], candidates: List[List[str]], block_size: int
+) -> List[Tuple[List[str], List[str]]]:
+    """Groups left values into blocks of at most `block_size`, each paired with the
+    union of its left values' candidates. Left values sharing a best candidate are
+    placed next to each other, so that blocks overlap as little as possible.
+
+    Examples:
+        ```python
+        get_join_blocks(["a", "b", "c"], [["x", "y"], ["z"], ["x"]], block_size=2)
+        ```
+        ```text
+        [(['a', 'c'], ['x', 'y']), (['b'], ['z'])]
+        ```
+    """
+    order = sorted(
+        range(len(left_values)),
+        key=lambda idx: candidates[idx][0] if len(candidates[idx]) > 0 else "",
+    )
+    blocks: List[Tuple[List[str], List[str]]] = []
+    for start in range(0, len(order), block_size):
+        block = order[start : start + block_size]
+        blocks.append(
+            (
+                [left_values[idx] for idx in block],
+                # `dict.fromkeys` de-duplicates, but keeps the order of candidates
+                list(dict.fromkeys(c for idx in block for c in candidates[idx])),
+            )
+        )
+    return blocks
+
+
 class LLMJoin(JoinIngredient):
     DESCRIPTION = """
     If we need to do a `join` operation where there is imperfect alignment between table values, use the new function:
@@ -166,16 +254,106 @@ class LLMJoin(JoinIngredient):
         left_values: List[str],
         right_values: List[str],
         question: Optional[str] = None,
+        num_candidates: int = CONST.JOIN_NUM_CANDIDATES,
+        block_size: int = CONST.JOIN_BLOCK_SIZE,
+        max_concurrency: int = 1,
+        get_right_index: Optional[Callable[[], FuzzyIndex]] = None,
         **kwargs,
     ) -> dict:
+        """Aligns each left value to a right value, according to `question`.
+
+        Rather than passing every right value to the Model alongside every left value,
+        we first pick the `num_candidates` most similar right values for each left value
+        (see `get_join_candidates`). The left values are then split into blocks of
+        `block_size`, and each block is sent to the Model with only its own candidates.
+
+        Args:
+            question: The criteria to join on. Defaults to 'Join to same topics.'
+            model: The Model (blender) we will make calls to.
+            left_values: The values to align.
+            right_values: The values to align `left_values` to.
+            num_candidates: Number of right values each left value may be aligned to.
+            block_size: Max number of left values in a single call to the Model.
+            max_concurrency: Max number of blocks sent to a `RemoteModel` at once.
+            get_right_index: Returns a (cached) `FuzzyIndex` over the column of `right_values`,
+                to pick candidates from. Passed in by `JoinIngredient`.
+
+        Returns:
+            dict mapping left values to their aligned right values.
+        """
         if question is None:
             question = "Join to same topics."
-        mapping = model.predict(
-            program=JoinProgram,
-            sep=CONST.DEFAULT_ANS_SEP,
-            left_values=left_values,
-            right_values=right_values,
-            join_criteria=question,
-            **kwargs,
+        # Sort any sets, so our prompts (and their cache keys) are deterministic
+        right_values = (
+            sorted(right_values) if isinstance(right_values, set) else right_values
+        )
+        candidates: List[List[str]] = get_join_candidates(
+            left_values,
+            right_values,
+            num_candidates=num_candidates,
+            index=(
+                get_right_index()
+                if get_right_index is not None and len(right_values) > num_candidates
+                else None
+            ),
+        )
+        blocks: List[Tuple[List[str], List[str]]] = get_join_blocks(
+            left_values, candidates, block_size=block_size
         )
+        # Only constrain each left value to its candidates if we actually pruned some right values
+        value_to_candidates: Optional[Dict[str, List[str]]] = (
+            dict(zip(left_values, candidates))
+            if len(right_values) > num_candidates
+            else None
+        )
+
+        def predict_block(block: Tuple[List[str], List[str]]) -> dict:
+            block_left_values, block_right_values = block
+            return model.predict(
+                program=JoinProgram,
+                sep=CONST.DEFAULT_ANS_SEP,
+                left_values=block_left_values,
+                right_values=block_right_values,
+                join_criteria=question,
+                **(
+                    {
+                        "candidates": {
+                            value: value_to_candidates[value]
+                            for value in block_left_values
+                        }
+                    }
+                    if value_to_candidates is not None
+                    else {}
+                ),
+                **kwargs,
+            )
+
+        # Only fan out blocks to remote endpoints
+        # Local models run on a single device, and aren't safe to call from many threads
+        num_workers = (
+            max(min(max_concurrency, len(blocks)), 1)
+            if isinstance(model, RemoteModel)
+            else 1
+        )
+        if num_workers > 1:
+            # Load the model up front, so our threads don't race to initialize it
+            _ = model.model_obj
+        set_span_attributes(num_blocks=len(blocks))
+        mapping: Dict[str, str] = {}
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            block_results: Iterable[dict] = (
+                executor.map(bind_current_context(predict_block), blocks)
+                if num_workers > 1
+                else map(predict_block, blocks)
+            )
+            # Only use tqdm if we're in debug mode
+            if logger.level <= logging.DEBUG:
+                block_results = tqdm(
+                    block_results,
+                    total=len(blocks),
+                    desc=f"Making {len(blocks)} calls to Model with max_concurrency {num_workers}",
+                    bar_format="{l_bar}%s{bar}%s{r_bar}" % (Fore.CYAN, Fore.RESET),
+                )
+            for block_mapping in block_results:
+                mapping |= block_mapping
         return {k: v for k, v in mapping.items() if v != CONST.DEFAULT_NAN_ANS}
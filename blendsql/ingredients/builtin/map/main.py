@@ -3,6 +3,7 @@ from typing import Union, Iterable, Any, Dict, Optional, List, Callable, Tuple
 
 import re
 import json
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from colorama import Fore
 from tqdm import tqdm
@@ -10,6 +11,7 @@ import guidance
 
 from blendsql.utils import newline_dedent
 from blendsql._logger import logger
+from blendsql._trace import set_span_attributes, bind_current_context
 from blendsql.models import Model, LocalModel, RemoteModel, OpenaiLLM
 from ast import literal_eval
 from blendsql import _constants as CONST
@@ -17,6 +19,7 @@ from blendsql.ingredients.ingredient import MapIngredient
 from blendsql._program import Program
 from blendsql._exceptions import IngredientException
 from blendsql.ingredients.generate import generate
+from blendsql.ingredients.utils import count_tokens
 
 
 class MapProgram(Program):
@@ -31,6 +34,7 @@ class MapProgram(Program):
         list_options_in_prompt: bool = True,
         include_tf_disclaimer: bool = False,
         max_tokens: Optional[int] = None,
+        answer_tokens: Optional[int] = None,
         regex: Optional[str] = None,
         output_type: Optional[str] = None,
         example_outputs: Optional[str] = None,
@@ -48,46 +52,71 @@ class MapProgram(Program):
                     regex = f"({'|'.join([re.escape(option) for option in options])}|{CONST.DEFAULT_NAN_ANS})"
                 else:
                     regex = f"({'|'.join([re.escape(option) for option in options])})"
-            m: guidance.models.Model = model.model_obj
-            with guidance.system():
-                m += """Given a set of values from a database, answer the question row-by-row, in order."""
-                if include_tf_disclaimer:
-                    m += " If the question can be answered with 'true' or 'false', select `t` for 'true' or `f` for 'false'."
-                m += newline_dedent(
-                    """
-                ---
-    
-                The following values come from the column 'Penalties (P+P+S+S)', in a table titled 'Biathlon World Championships 2013 \u2013 Men's pursuit'.
-                Q: Total penalty count?
-                Here are some example outputs: '1', '2', '5'
-                A:
-                    - 1 (0+0+0+1) -> 1
-                    - 10 (5+3+2+0) -> 10
-                    - 6 (2+2+2+0) -> 6
-    
-                ---
-    
-                The following values come from the column 'Length of use', in a table titled 'Crest Whitestrips'.
-                Q: Is the time less than a week?
-                A:
-                    - 14 days -> f
-                    - 10 days -> f
-                    - daily -> t
-                    - 2 hours -> t
-    
-                ---
+            system_prompt = """Given a set of values from a database, answer the question row-by-row, in order."""
+            if include_tf_disclaimer:
+                system_prompt += " If the question can be answered with 'true' or 'false', select `t` for 'true' or `f` for 'false'."
+            system_prompt += newline_dedent(
                 """
+            ---
+
+            The following values come from the column 'Penalties (P+P+S+S)', in a table titled 'Biathlon World Championships 2013 \u2013 Men's pursuit'.
+            Q: Total penalty count?
+            Here are some example outputs: '1', '2', '5'
+            A:
+                - 1 (0+0+0+1) -> 1
+                - 10 (5+3+2+0) -> 10
+                - 6 (2+2+2+0) -> 6
+
+            ---
+
+            The following values come from the column 'Length of use', in a table titled 'Crest Whitestrips'.
+            Q: Is the time less than a week?
+            A:
+                - 14 days -> f
+                - 10 days -> f
+                - daily -> t
+                - 2 hours -> t
+
+            ---
+            """
+            )
+            if table_title:
+                system_prompt += newline_dedent(
+                    f"The following values come from the column '{colname}', in a table titled '{table_title}'."
                 )
-                if table_title:
-                    m += newline_dedent(
-                        f"The following values come from the column '{colname}', in a table titled '{table_title}'."
-                    )
+            user_prompt = ""
+            if list_options_in_prompt and options:
+                user_prompt += (
+                    f"Your responses should select from one of the following values:\n"
+                )
+                user_prompt += "\n".join(options + (["-"] if allow_null_option else []))
+                user_prompt += "\n\n"
+            user_prompt += newline_dedent(f"""Q: {question}\nA:\n""")
+            if getattr(model, "batch_map", False):
+                # Answer all values at once, sharing a single encoding of the prompt
+                return (
+                    model.batch_complete(
+                        system_prompt=system_prompt,
+                        user_prompt=user_prompt,
+                        continuations=[f"\n{value} ->" for value in values],
+                        options=(
+                            options
+                            + ([CONST.DEFAULT_NAN_ANS] if allow_null_option else [])
+                        )
+                        if options
+                        else None,
+                        regex=regex,
+                        # Each value is completed separately, so it gets the per-value
+                        #   budget, rather than `max_tokens` for the whole batch
+                        max_tokens=answer_tokens,
+                    ),
+                    f"{system_prompt}\n{user_prompt}",
+                )
+            m: guidance.models.Model = model.model_obj
+            with guidance.system():
+                m += system_prompt
             with guidance.user():
-                if list_options_in_prompt and options:
-                    m += f"Your responses should select from one of the following values:\n"
-                    m += "\n".join(options + (["-"] if allow_null_option else []))
-                    m += "\n\n"
-                m += newline_dedent(f"""Q: {question}\nA:\n""")
+                m += user_prompt
             prompt = m._current_prompt()
             if isinstance(model, LocalModel) and regex is not None:
                 gen_f = lambda: guidance.regex(pattern=regex)
@@ -177,6 +206,41 @@ class MapProgram(Program):
             return (_r, prompt)
 
 
+def get_map_batches(
+    values: List[str],
+    value_tokens: List[int],
+    answer_tokens: int,
+    token_budget: int,
+    max_batch_size: int = CONST.MAP_MAX_BATCH_SIZE,
+) -> List[List[str]]:
+    """Greedily groups consecutive values into batches, so that the tokens of the values
+    and their expected answers in each batch stay within `token_budget`.
+    Short values get packed into large batches, and long values into small ones.
+    Each batch has at least one value.
+
+    Examples:
+        ```python
+        get_map_batches(["a", "b", "c"], value_tokens=[3, 3, 50], answer_tokens=2, token_budget=20)
+        # [['a', 'b'], ['c']]
+        ```
+    """
+    batches: List[List[str]] = []
+    curr_batch: List[str] = []
+    curr_tokens = 0
+    for value, num_tokens in zip(values, value_tokens):
+        cost = num_tokens + answer_tokens
+        if curr_batch and (
+            curr_tokens + cost > token_budget or len(curr_batch) >= max_batch_size
+        ):
+            batches.append(curr_batch)
+            curr_batch, curr_tokens = [], 0
+        curr_batch.append(value)
+        curr_tokens += cost
+    if curr_batch:
+        batches.append(curr_batch)
+    return batches
+
+
 class LLMMap(MapIngredient):
     DESCRIPTION = """
     If question-relevant column(s) contents are not suitable for SQL comparisons or calculations, map it to a new column using the scalar function:
@@ -196,6 +260,8 @@ class LLMMap(MapIngredient):
         output_type: Optional[str] = None,
         regex: Optional[Callable[[int], str]] = None,
         table_to_title: Optional[Dict[str, str]] = None,
+        max_concurrency: int = 1,
+        batch_size: Optional[int] = None,
         **kwargs,
     ) -> Iterable[Any]:
         """For each value in a given column, calls a Model and retrieves the output.
@@ -209,6 +275,10 @@ class LLMMap(MapIngredient):
             output_type: One of 'numeric', 'string', 'bool'
             regex: Optional regex to constrain answer generation.
             table_to_title: Mapping from tablename to a title providing some more context.
+            max_concurrency: Max number of batches sent to a `RemoteModel` at once.
+                Output order always matches the order of `values`.
+            batch_size: Optional fixed number of values in each batch.
+                By default, batches are sized to fit the Model's `map_batch_token_budget`.
 
         Returns:
             Iterable[Any] containing the output of the Model for each value.
@@ -230,30 +300,25 @@ class LLMMap(MapIngredient):
                 logger.debug(f"Tablename {tablename} not in given table_to_title!")
             else:
                 table_title = table_to_title[tablename]
-        split_results: List[Union[str, None]] = []
-        # Only use tqdm if we're in debug mode
-        context_manager: Iterable = (
-            tqdm(
-                range(0, len(values), CONST.MAP_BATCH_SIZE),
-                total=len(values) // CONST.MAP_BATCH_SIZE,
-                desc=f"Making calls to Model with batch_size {CONST.MAP_BATCH_SIZE}",
-                bar_format="{l_bar}%s{bar}%s{r_bar}" % (Fore.CYAN, Fore.RESET),
-            )
-            if logger.level <= logging.DEBUG
-            else range(0, len(values), CONST.MAP_BATCH_SIZE)
-        )
-
-        for i in context_manager:
-            answer_length = len(values[i : i + CONST.MAP_BATCH_SIZE])
-            max_tokens = answer_length * 15
-            include_tf_disclaimer = False
-            curr_batch_values = values[i : i + CONST.MAP_BATCH_SIZE]
+        include_tf_disclaimer = False
+        if output_type == "boolean":
+            include_tf_disclaimer = True
+        elif isinstance(model, OpenaiLLM):
+            include_tf_disclaimer = True
 
-            if output_type == "boolean":
-                include_tf_disclaimer = True
-            elif isinstance(model, OpenaiLLM):
-                include_tf_disclaimer = True
+        # Expected number of tokens in each answer, plus its separator
+        if options:
+            answer_tokens = (
+                max(
+                    count_tokens(model, option)
+                    for option in options + [CONST.DEFAULT_NAN_ANS]
+                )
+                + 1
+            )
+        else:
+            answer_tokens = CONST.MAP_DEFAULT_ANSWER_TOKENS
 
+        def predict_batch(curr_batch_values: List[str]) -> List[Any]:
             result: List[str] = model.predict(
                 program=MapProgram,
                 question=question,
@@ -267,11 +332,27 @@ class LLMMap(MapIngredient):
                 include_tf_disclaimer=include_tf_disclaimer,
                 table_title=table_title,
                 regex=regex,
-                max_tokens=max_tokens,
+                max_tokens=len(curr_batch_values) * answer_tokens,
+                answer_tokens=answer_tokens,
                 **kwargs,
             )
+            expected_len = len(curr_batch_values)
+            if len(result) != expected_len:
+                logger.debug(
+                    Fore.YELLOW
+                    + f"Mismatch between length of values and answers!\nvalues:{expected_len}, answers:{len(result)}"
+                    + Fore.RESET
+                )
+                logger.debug(result)
+                if expected_len > 1:
+                    # Re-split the batch, so the answers can't end up misaligned with their values
+                    mid = expected_len // 2
+                    return predict_batch(curr_batch_values[:mid]) + predict_batch(
+                        curr_batch_values[mid:]
+                    )
+                result = [CONST.DEFAULT_ANS_SEP.join(result)]
             # Try to map to booleans and `None`
-            _r = [
+            return [
                 {
                     "t": True,
                     "f": False,
@@ -285,15 +366,49 @@ class LLMMap(MapIngredient):
                 }.get(i.lower(), i)
                 for i in result
             ]
-            expected_len = len(curr_batch_values)
-            if len(_r) != expected_len:
-                logger.debug(
-                    Fore.YELLOW
-                    + f"Mismatch between length of values and answers!\nvalues:{expected_len}, answers:{len(_r)}"
-                    + Fore.RESET
+
+        if batch_size is None and model.map_batch_token_budget is not None:
+            batches: List[List[str]] = get_map_batches(
+                values,
+                value_tokens=[count_tokens(model, f"`{value}`\n") for value in values],
+                answer_tokens=answer_tokens,
+                token_budget=model.map_batch_token_budget,
+            )
+        else:
+            batch_size = batch_size or CONST.MAP_BATCH_SIZE
+            batches: List[List[str]] = [
+                values[i : i + batch_size] for i in range(0, len(values), batch_size)
+            ]
+        # Only fan out batches to remote endpoints
+        # Local models run on a single device, and aren't safe to call from many threads
+        num_workers = (
+            max(min(max_concurrency, len(batches)), 1)
+            if isinstance(model, RemoteModel)
+            else 1
+        )
+        if num_workers > 1:
+            # Load the model up front, so our threads don't race to initialize it
+            _ = model.model_obj
+        set_span_attributes(num_batches=len(batches))
+        split_results: List[Union[str, None]] = []
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            # `executor.map` yields results in the order of `batches`,
+            #   regardless of which batch finishes first
+            batch_results: Iterable[List[Any]] = (
+                executor.map(bind_current_context(predict_batch), batches)
+                if num_workers > 1
+                else map(predict_batch, batches)
+            )
+            # Only use tqdm if we're in debug mode
+            if logger.level <= logging.DEBUG:
+                batch_results = tqdm(
+                    batch_results,
+                    total=len(batches),
+                    desc=f"Making {len(batches)} calls to Model with max_concurrency {num_workers}",
+                    bar_format="{l_bar}%s{bar}%s{r_bar}" % (Fore.CYAN, Fore.RESET),
                 )
-                logger.debug(_r)
-            split_results.extend(_r)
+            for _r in batch_results:
+                split_results.extend(_r)
         for idx, i in enumerate(split_results):
             if i is None:
                 continue
@@ -1,17 +1,141 @@
 import copy
-from typing import Dict, Union, Optional, Set, Tuple
+import re
+from typing import Dict, List, Union, Optional, Set, Tuple
+import numpy as np
 import pandas as pd
 import guidance
 from colorama import Fore
 
 from blendsql.models import Model, LocalModel
+from blendsql._logger import logger
+from blendsql._trace import set_span_attributes
 from blendsql.ingredients.generate import generate
+from blendsql.ingredients.utils import count_tokens
 from blendsql._program import Program
 from blendsql.ingredients.ingredient import QAIngredient
 from blendsql.db.utils import single_quote_escape
 from blendsql._exceptions import IngredientException
 
 
+# BM25 parameters, with the usual defaults
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def serialize_context(context: pd.DataFrame) -> str:
+    """Serializes a table as a header line of column names, followed by one line per row,
+    with cells separated by ' | '. Unlike `pd.DataFrame.to_string()`, nothing gets padded
+    or truncated, so each row only costs as many tokens as its values.
+
+    Examples:
+        ```python
+        serialize_context(pd.DataFrame({"name": ["Danny", "Emma"], "age": [23, None]}))
+        ```
+        ```text
+        name | age
+        Danny | 23.0
+        Emma |
+        ```
+    """
+    return "\n".join([" | ".join(map(str, context.columns))] + serialize_rows(context))
+
+
+def serialize_rows(context: pd.DataFrame) -> List[str]:
+    """One ' | '-separated line per row of `context`, with newlines in values flattened."""
+    lines: Optional[pd.Series] = None
+    for idx in range(context.shape[1]):
+        column = context.iloc[:, idx]
+        column = (
+            column.astype(str)
+            .where(column.notna(), "")
+            .str.replace(r"\s*\n\s*", " ", regex=True)
+        )
+        lines = column if lines is None else lines + " | " + column
+    if lines is None:
+        return [""] * len(context)
+    return lines.str.rstrip().tolist()
+
+
+def get_bm25_scores(rows: pd.Series, question: str) -> np.ndarray:
+    """Scores each row's text against `question` with BM25.
+    Rows are tokenized in a single vectorized pass, and term frequencies
+    are only counted for the terms in the question.
+
+    Examples:
+        ```python
+        get_bm25_scores(pd.Series(["Sydney | Australia", "Paris | France"]), "Which city is in France?")
+        ```
+        ```text
+        array([0.        , 0.69314718])
+        ```
+    """
+    scores = np.zeros(len(rows))
+    terms = set(re.findall(r"\w+", question.lower()))
+    if len(rows) == 0 or len(terms) == 0:
+        return scores
+    tokens = rows.reset_index(drop=True).str.lower().str.findall(r"\w+")
+    row_lengths = tokens.str.len().to_numpy()
+    avg_row_length = max(row_lengths.mean(), 1)
+    tokens = tokens.explode()
+    tokens = tokens[tokens.isin(terms)]
+    if len(tokens) == 0:
+        return scores
+    # (rows x terms) matrix of term frequencies
+    term_frequencies = (
+        tokens.groupby([tokens.index, tokens.values])
+        .size()
+        .unstack(fill_value=0)
+        .reindex(range(len(rows)), fill_value=0)
+        .to_numpy()
+    )
+    num_matching_rows = np.count_nonzero(term_frequencies, axis=0)
+    idf = np.log(1 + (len(rows) - num_matching_rows + 0.5) / (num_matching_rows + 0.5))
+    return (
+        idf
+        * term_frequencies
+        * (BM25_K1 + 1)
+        / (
+            term_frequencies
+            + BM25_K1 * (1 - BM25_B + BM25_B * row_lengths[:, None] / avg_row_length)
+        )
+    ).sum(axis=1)
+
+
+def select_context_rows(
+    context: pd.DataFrame, question: Optional[str], model: Model, token_budget: int
+) -> pd.DataFrame:
+    """If the serialized `context` doesn't fit in `token_budget`, keeps only the rows most
+    relevant to `question` (by BM25 score) that fit, in their original order.
+    The most relevant row is always kept.
+
+    Args:
+        context: The table passed to `LLMQA`
+        question: The question we're answering over `context`
+        model: The Model whose tokenizer we use to count tokens
+        token_budget: Max number of tokens in the serialized context
+
+    Returns:
+        A subset of the rows of `context`
+    """
+    rows = serialize_rows(context)
+    num_tokens = count_tokens(model, " | ".join(map(str, context.columns)))
+    if num_tokens + count_tokens(model, "\n".join(rows)) <= token_budget:
+        return context
+    scores = get_bm25_scores(pd.Series(rows, dtype=str), question or "")
+    selected = []
+    for idx in np.argsort(-scores, kind="stable"):
+        num_tokens += count_tokens(model, rows[idx] + "\n")
+        if num_tokens > token_budget and len(selected) > 0:
+            break
+        selected.append(idx)
+    logger.debug(
+        Fore.YELLOW
+        + f"Selected {len(selected)} of {len(context)} context rows to fit in {token_budget} tokens"
+        + Fore.RESET
+    )
+    return context.iloc[sorted(selected)]
+
+
 class QAProgram(Program):
     def __call__(
         self,
@@ -28,7 +152,7 @@ class QAProgram(Program):
             m: guidance.models.Model = model.model_obj
         else:
             m: str = ""
-        serialized_db = context.to_string() if context is not None else ""
+        serialized_db = serialize_context(context) if context is not None else ""
         with guidance.system():
             m += "Answer the question for the table. "
             options_alias_to_original = {}
@@ -138,6 +262,18 @@ class LLMQA(QAIngredient):
         if context is not None:
             if value_limit is not None:
                 context = context.iloc[:value_limit]
+            num_context_rows = len(context)
+            if model.qa_context_token_budget is not None:
+                context = select_context_rows(
+                    context,
+                    question=question,
+                    model=model,
+                    token_budget=model.qa_context_token_budget,
+                )
+            set_span_attributes(
+                num_context_rows=num_context_rows,
+                num_selected_context_rows=len(context),
+            )
         result = model.predict(
             program=QAProgram,
             options=options,
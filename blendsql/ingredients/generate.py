@@ -1,11 +1,13 @@
-from functools import singledispatch
+from functools import singledispatch, wraps
+import asyncio
 import logging
 from colorama import Fore
-from typing import Optional, List
+from typing import Callable, Optional, List
 from collections.abc import Collection
 
 from .._logger import logger
 from ..models import Model, OllamaLLM, OpenaiLLM, AnthropicLLM
+from ..models._model import _event_loop
 
 
 @singledispatch
@@ -13,7 +15,46 @@ def generate(model: Model, *args, **kwargs) -> str:
     pass
 
 
+def dispatch_to_event_loop(fn: Callable) -> Callable:
+    """Wraps a `generate` implementation, so that when it's called from a worker thread
+    of `ablend()` (or `Model.apredict()`), the request is made with `agenerate` on their event loop instead.
+    This way, the Model's native async client is used, and many queries can share its connections.
+
+    Examples:
+        ```python
+        @generate.register(MyModel)
+        @dispatch_to_event_loop
+        def generate_my_model(model: MyModel, prompt, **kwargs) -> str:
+            ...
+        ```
+    """
+
+    @wraps(fn)
+    def wrapper(model: Model, *args, **kwargs) -> str:
+        loop = _event_loop.get()
+        if (
+            loop is None
+            or loop.is_closed()
+            # Without a native async implementation, `agenerate` would just call us again
+            or agenerate.dispatch(type(model)) is agenerate.dispatch(object)
+        ):
+            return fn(model, *args, **kwargs)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is loop:
+            # We can't block the event loop on itself
+            return fn(model, *args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(
+            agenerate(model, *args, **kwargs), loop
+        ).result()
+
+    return wrapper
+
+
 @generate.register(OpenaiLLM)
+@dispatch_to_event_loop
 def generate_openai(
     model: OpenaiLLM,
     prompt,
@@ -39,6 +80,7 @@ def generate_openai(
 
 
 @generate.register(AnthropicLLM)
+@dispatch_to_event_loop
 def generate_anthropic(
     model: AnthropicLLM,
     prompt,
@@ -60,7 +102,23 @@ def generate_anthropic(
     )
 
 
+def _ollama_options(**kwargs):
+    from ollama import Options
+
+    # Turn outlines kwargs into Ollama
+    if "stop_at" in kwargs:
+        stop_at = kwargs.pop("stop_at")
+        if isinstance(stop_at, str):
+            stop_at = [stop_at]
+        kwargs["stop"] = stop_at
+    options = Options(**kwargs)
+    if options.get("temperature") is None:
+        options["temperature"] = 0.0
+    return options
+
+
 @generate.register(OllamaLLM)
+@dispatch_to_event_loop
 def generate_ollama(
     model: OllamaLLM, prompt, options: Optional[Collection[str]] = None, **kwargs
 ) -> str:
@@ -72,17 +130,7 @@ def generate_ollama(
             "Cannot use choice generation with an Ollama model"
             + "due to the limitations of the Ollama API."
         )
-    from ollama import Options
-
-    # Turn outlines kwargs into Ollama
-    if "stop_at" in kwargs:
-        stop_at = kwargs.pop("stop_at")
-        if isinstance(stop_at, str):
-            stop_at = [stop_at]
-        kwargs["stop"] = stop_at
-    options = Options(**kwargs)
-    if options.get("temperature") is None:
-        options["temperature"] = 0.0
+    options = _ollama_options(**kwargs)
     stream = logger.level <= logging.DEBUG
     response = model.model_obj(
         messages=[{"role": "user", "content": prompt}],
@@ -101,3 +149,64 @@ def generate_ollama(
         print("\n")
         return "".join(chunked_res)
     return response["message"]["content"]
+
+
+@singledispatch
+async def agenerate(model: Model, *args, **kwargs) -> str:
+    """Async counterpart to `generate`.
+    Models without a native async client fall back to running the
+    synchronous `generate` in a worker thread, so the event loop isn't blocked.
+    """
+    return await asyncio.to_thread(generate, model, *args, **kwargs)
+
+
+@agenerate.register(OpenaiLLM)
+async def agenerate_openai(
+    model: OpenaiLLM,
+    prompt,
+    max_tokens: Optional[int] = None,
+    stop_at: Optional[List[str]] = None,
+    **kwargs,
+) -> str:
+    response = await model.get_async_client().chat.completions.create(
+        model=model.model_obj.engine.model_name,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens,
+        stop=stop_at,
+        **model.load_model_kwargs,
+    )
+    return response.choices[0].message.content
+
+
+@agenerate.register(AnthropicLLM)
+async def agenerate_anthropic(
+    model: AnthropicLLM,
+    prompt,
+    max_tokens: Optional[int] = None,
+    stop_at: Optional[List[str]] = None,
+    **kwargs,
+) -> str:
+    response = await model.get_async_client().messages.create(
+        model=model.model_obj.engine.model_name,
+        messages=[{"role": "user", "content": prompt}],
+        max_tokens=max_tokens or 5000,
+        **model.load_model_kwargs,
+    )
+    return response.content[0].text
+
+
+@agenerate.register(OllamaLLM)
+async def agenerate_ollama(
+    model: OllamaLLM, prompt, options: Optional[Collection[str]] = None, **kwargs
+) -> str:
+    if options:
+        raise NotImplementedError(
+            "Cannot use choice generation with an Ollama model"
+            + "due to the limitations of the Ollama API."
+        )
+    response = await model.get_async_client().chat(
+        model=model.model_name_or_path,
+        messages=[{"role": "user", "content": prompt}],
+        options=_ollama_options(**kwargs),
+    )
+    return response["message"]["content"]
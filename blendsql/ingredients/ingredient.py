@@ -3,26 +3,34 @@ from abc import abstractmethod
 import pandas as pd
 from sqlglot import exp
 import json
-from skrub import Joiner
 from typing import Any, Union, Dict, Tuple, Callable, Set, Optional, Type
 from collections.abc import Collection, Iterable
 import uuid
+import hashlib
+import threading
 from colorama import Fore
 from typeguard import check_type
 from functools import partialmethod
 
 from .._exceptions import IngredientException
 from .._logger import logger
+from .._trace import set_span_attributes
+from .._fuzzy_index import FuzzyIndex, get_fuzzy_index
 from .. import utils
 from .._constants import (
     IngredientKwarg,
     IngredientType,
+    JOIN_NUM_CANDIDATES,
+    JOIN_BLOCK_SIZE,
+    JOIN_FUZZY_MATCH_THRESHOLD,
 )
 from ..db import Database
-from ..db.utils import select_all_from_table_query
 from ..models import Model
 from .utils import unpack_options
 
+# Sentinel for values missing from the Model cache, since `None` is a valid mapped value
+_MISSING = object()
+
 
 def unpack_default_kwargs(**kwargs):
     return (
@@ -50,6 +58,10 @@ class Ingredient:
     ingredient_type: str = attrib(init=False)
     allowed_output_types: Tuple[Type] = attrib(init=False)
     num_values_passed: int = 0
+    # Independent calls to the same ingredient may run on different threads
+    _num_values_passed_lock: threading.Lock = attrib(
+        init=False, factory=threading.Lock, repr=False, eq=False
+    )
 
     def __repr__(self):
         return f"{self.ingredient_type} {self.name}"
@@ -65,6 +77,10 @@ class Ingredient:
     def __call__(self, *args, **kwargs) -> Any:
         ...
 
+    def _add_num_values_passed(self, num_values_passed: int) -> None:
+        with self._num_values_passed_lock:
+            self.num_values_passed += num_values_passed
+
     def _run(self, *args, **kwargs):
         return check_type(self.run(*args, **kwargs), self.allowed_output_types)
 
@@ -91,6 +107,10 @@ class MapIngredient(Ingredient):
     model: Model = attrib(default=None)
     allow_null_option: bool = attrib(default=True)
     list_options_in_prompt: bool = attrib(default=True)
+    # Max number of batches we allow to be in-flight to a `RemoteModel` at once
+    max_concurrency: int = attrib(default=1)
+    # Fixed number of values per batch. If None, the ingredient decides
+    batch_size: Optional[int] = attrib(default=None)
 
     @classmethod
     def from_args(
@@ -98,17 +118,47 @@ class MapIngredient(Ingredient):
         model: Model = None,
         allow_null_option: bool = True,
         list_options_in_prompt: bool = True,
+        max_concurrency: int = 1,
+        batch_size: Optional[int] = None,
     ):
         return partialclass(
             cls,
             model=model,
             allow_null_option=allow_null_option,
             list_options_in_prompt=list_options_in_prompt,
+            max_concurrency=max_concurrency,
+            batch_size=batch_size,
         )
 
     def unpack_default_kwargs(self, **kwargs):
         return unpack_default_kwargs(**kwargs)
 
+    def _create_value_key(
+        self,
+        model: Model,
+        value: Any,
+        question: Optional[str],
+        options: Optional[list],
+        **kwargs,
+    ) -> str:
+        """Generates a hash to use in the Model's cache, for the output of a single value.
+        Unlike `Model._create_key`, this doesn't depend on the other values sent in the same batch.
+
+        Returns:
+            md5 hash used as key in diskcache
+        """
+        hasher = hashlib.md5()
+        combined = "{}||{}||{}||{}||{}||{}".format(
+            f"{model.model_name_or_path}||{type(model)}",
+            self.name,
+            question,
+            sorted(map(str, options)) if options is not None else None,
+            sorted(kwargs.items()),
+            repr(value),
+        ).encode()
+        hasher.update(combined)
+        return f"{self.ingredient_type}||{hasher.hexdigest()}"
+
     def __call__(
         self,
         question: Optional[str] = None,
@@ -118,7 +168,12 @@ class MapIngredient(Ingredient):
         *args,
         **kwargs,
     ) -> tuple:
-        """Returns tuple with format (arg, tablename, colname, new_table)"""
+        """Returns tuple with format (arg, tablename, colname, mapped_table).
+
+        `mapped_table` holds one row per distinct value we mapped, with the columns
+        `colname` and `arg`. It gets joined back onto `tablename` in the database,
+        so we never need to load the full table into memory here.
+        """
         # Unpack kwargs
         aliases_to_tablenames: Dict[str, str] = kwargs["aliases_to_tablenames"]
         get_temp_subquery_table: Callable = kwargs["get_temp_subquery_table"]
@@ -139,16 +194,13 @@ class MapIngredient(Ingredient):
 
         # Optionally materialize a CTE
         if tablename in self.db.lazy_tables:
-            original_table = self.db.lazy_tables.pop(tablename).collect()
-        else:
-            original_table = self.db.execute_to_df(
-                select_all_from_table_query(tablename)
-            )
+            self.db.lazy_tables.pop(tablename).collect()
 
         # Need to be sure the new column doesn't already exist here
         new_arg_column = question or str(uuid.uuid4())[:4]
+        existing_columns = set(self.db.iter_columns(tablename))
         while (
-            new_arg_column in set(self.db.iter_columns(tablename))
+            new_arg_column in existing_columns
             or new_arg_column in prev_subquery_map_columns
         ):
             new_arg_column = "_" + new_arg_column
@@ -156,12 +208,12 @@ class MapIngredient(Ingredient):
         # Get a list of values to map
         # First, check if we've already dumped some `MapIngredient` output to the main session table
         if temp_session_table_exists:
-            temp_session_table = self.db.execute_to_df(
-                select_all_from_table_query(temp_session_tablename)
-            )
+            temp_session_columns = self.db.execute_to_df(
+                f'SELECT * FROM "{temp_session_tablename}" LIMIT 0'
+            ).columns
             # We don't need to run this function on everything,
             #   if a previous subquery already got to certain values
-            if new_arg_column in temp_session_table.columns:
+            if new_arg_column in temp_session_columns:
                 values = self.db.execute_to_list(
                     f'SELECT DISTINCT "{colname}" FROM "{temp_session_tablename}" WHERE "{new_arg_column}" IS NULL',
                 )
@@ -178,8 +230,12 @@ class MapIngredient(Ingredient):
 
         # No need to run ingredient if we have no values to map onto
         if len(values) == 0:
-            original_table[new_arg_column] = None
-            return (new_arg_column, tablename, colname, original_table)
+            return (
+                new_arg_column,
+                tablename,
+                colname,
+                pd.DataFrame({colname: [], new_arg_column: []}),
+            )
 
         unpacked_options = None
         if options is not None:
@@ -193,20 +249,72 @@ class MapIngredient(Ingredient):
             )
         else:
             kwargs[IngredientKwarg.REGEX] = regex
-        kwargs[IngredientKwarg.VALUES] = values
-        kwargs[IngredientKwarg.QUESTION] = question
-        mapped_values: Collection[Any] = self._run(
-            *args,
-            **kwargs,
-            options=unpacked_options,
-            list_options_in_prompt=self.list_options_in_prompt,
-            allow_null_option=self.allow_null_option,
+
+        # Check which values we've already mapped with this exact question,
+        #   so that we only pass unseen values to the Model
+        model: Optional[Model] = kwargs.get(IngredientKwarg.MODEL, None)
+        use_value_cache = model is not None and model.caching
+        value_to_key: Dict[Any, str] = {}
+        value_to_mapped_value: Dict[Any, Any] = {}
+        if use_value_cache:
+            table_title = (kwargs.get("table_to_title") or {}).get(tablename, None)
+            for value in values:
+                key = self._create_value_key(
+                    model=model,
+                    value=value,
+                    question=question,
+                    options=unpacked_options,
+                    regex=kwargs.get(IngredientKwarg.REGEX, None),
+                    output_type=kwargs.get("output_type", None),
+                    example_outputs=kwargs.get("example_outputs", None),
+                    # Everything else which ends up in the prompt
+                    table_title=table_title,
+                    colname=colname,
+                    allow_null_option=self.allow_null_option,
+                    list_options_in_prompt=self.list_options_in_prompt,
+                )
+                mapped_value = model.cache.get(key, default=_MISSING)
+                if mapped_value is _MISSING:
+                    value_to_key[value] = key
+                else:
+                    value_to_mapped_value[value] = mapped_value
+            logger.debug(
+                Fore.MAGENTA
+                + f"Using value cache for {len(value_to_mapped_value)} of {len(values)} values..."
+                + Fore.RESET
+            )
+        unseen_values = [
+            value for value in values if value not in value_to_mapped_value
+        ]
+        set_span_attributes(
+            num_values=len(values), num_cached_values=len(value_to_mapped_value)
         )
-        self.num_values_passed += len(mapped_values)
+        if len(unseen_values) > 0:
+            kwargs[IngredientKwarg.VALUES] = unseen_values
+            kwargs[IngredientKwarg.QUESTION] = question
+            mapped_values: Collection[Any] = self._run(
+                *args,
+                **kwargs,
+                options=unpacked_options,
+                list_options_in_prompt=self.list_options_in_prompt,
+                allow_null_option=self.allow_null_option,
+                max_concurrency=self.max_concurrency,
+                batch_size=self.batch_size,
+            )
+            self._add_num_values_passed(len(mapped_values))
+            # Don't store anything if we have a mismatch between values and answers
+            if use_value_cache and len(mapped_values) == len(unseen_values):
+                for value, mapped_value in zip(unseen_values, mapped_values):
+                    model.cache[value_to_key[value]] = mapped_value
+            value_to_mapped_value |= dict(zip(unseen_values, mapped_values))
         df_as_dict: Dict[str, list] = {colname: [], new_arg_column: []}
-        for value, mapped_value in zip(values, mapped_values):
+        for value in values:
+            # Values the Model didn't give us an answer for are left out, and end up NULL
+            if value not in value_to_mapped_value:
+                continue
             df_as_dict[colname].append(value)
-            df_as_dict[new_arg_column].append(mapped_value)
+            df_as_dict[new_arg_column].append(value_to_mapped_value[value])
+        mapped_values = df_as_dict[new_arg_column]
         subtable = pd.DataFrame(df_as_dict)
         # if kwargs.get("output_type") == "boolean":
         #     subtable[new_arg_column] = subtable[new_arg_column].astype(bool)
@@ -216,14 +324,8 @@ class MapIngredient(Ingredient):
             for x in mapped_values
         ):
             subtable[new_arg_column] = subtable[new_arg_column].astype("Int64")
-        # Add new_table to original table
-        new_table = original_table.merge(subtable, how="left", on=colname)
-        if new_table.shape[0] != original_table.shape[0]:
-            raise IngredientException(
-                f"subtable from run() needs same length as # rows from original\nOriginal has {original_table.shape[0]}, new_table has {new_table.shape[0]}"
-            )
-        # Now, new table has original columns + column with the name of the question we answered
-        return (new_arg_column, tablename, colname, new_table)
+        # Now, subtable maps each of our values to the answer for the question we asked
+        return (new_arg_column, tablename, colname, subtable)
 
     @abstractmethod
     def run(self, *args, **kwargs) -> Iterable[Any]:
@@ -238,14 +340,34 @@ class JoinIngredient(Ingredient):
         {"tomato": "red", "broccoli": "green", "lemon": "yellow"}
     """
 
+    # Align values with a `FuzzyIndex` before calling the Model.
+    #   Named for the `skrub.Joiner` this originally used
     use_skrub_joiner: bool = attrib(default=True)
+    # Number of right values considered as candidates for each left value
+    num_candidates: int = attrib(default=JOIN_NUM_CANDIDATES)
+    # Max number of left values in each block sent to the Model
+    block_size: int = attrib(default=JOIN_BLOCK_SIZE)
+    # Max number of blocks we allow to be in-flight to a `RemoteModel` at once
+    max_concurrency: int = attrib(default=1)
 
     ingredient_type: str = IngredientType.JOIN.value
     allowed_output_types: Tuple[Type] = (dict,)
 
     @classmethod
-    def from_args(cls, use_skrub_joiner: bool = True):
-        return partialclass(cls, use_skrub_joiner=use_skrub_joiner)
+    def from_args(
+        cls,
+        use_skrub_joiner: bool = True,
+        num_candidates: int = JOIN_NUM_CANDIDATES,
+        block_size: int = JOIN_BLOCK_SIZE,
+        max_concurrency: int = 1,
+    ):
+        return partialclass(
+            cls,
+            use_skrub_joiner=use_skrub_joiner,
+            num_candidates=num_candidates,
+            block_size=block_size,
+            max_concurrency=max_concurrency,
+        )
 
     def __call__(
         self,
@@ -265,15 +387,17 @@ class JoinIngredient(Ingredient):
         values = []
         original_lr_identifiers = []
         modified_lr_identifiers = []
+        is_temp_table = []
         mapping: Dict[str, str] = {}
         for on_arg in [left_on, right_on]:
             tablename, colname = utils.get_tablename_colname(on_arg)
             tablename = aliases_to_tablenames.get(tablename, tablename)
             original_lr_identifiers.append((tablename, colname))
-            tablename, _ = self.maybe_get_temp_table(
+            tablename, is_temp = self.maybe_get_temp_table(
                 temp_table_func=get_temp_subquery_table,
                 tablename=tablename,
             )
+            is_temp_table.append(is_temp)
             values.append(
                 self.db.execute_to_list(
                     f'SELECT DISTINCT "{colname}" FROM "{tablename}"', to_type=str
@@ -284,6 +408,18 @@ class JoinIngredient(Ingredient):
         # check swapping only once, at the beginning
         if sorted_values != values:
             swapped = True
+
+        def get_right_index() -> FuzzyIndex:
+            """Index over every value of the longer column, not just those left unmatched,
+            so the same index gets reused across queries on this column.
+            """
+            idx = 0 if swapped else 1
+            if is_temp_table[idx]:
+                # Only holds the rows of this query, so there's no point in caching it
+                return FuzzyIndex(sorted_values[1])
+            tablename, colname = modified_lr_identifiers[idx]
+            return get_fuzzy_index(self.db, tablename, colname, sorted_values[1])
+
         if question is None:
             # First, check which values we actually need to call Model on
             # We don't want to join when there's already an intuitive alignment
@@ -304,35 +440,26 @@ class JoinIngredient(Ingredient):
             # Remained _outer and inner lists preserved the sorting order in length:
             # len(_outer) = len(outer) - #matched <= len(inner original) - matched = len(inner)
             if self.use_skrub_joiner and all(len(x) > 1 for x in [inner, _outer]):
-                # Create the main_table DataFrame
-                main_table = pd.DataFrame(_outer, columns=["out"])
-                # Create the aux_table DataFrame
-                aux_table = pd.DataFrame(inner, columns=["in"])
-                joiner = Joiner(
-                    aux_table,
-                    main_key="out",
-                    aux_key="in",
-                    max_dist=0.9,
-                    add_match_info=False,
+                index: FuzzyIndex = get_right_index()
+                _fuzzy_mapping: Dict[str, str] = index.best_matches(
+                    _outer,
+                    threshold=JOIN_FUZZY_MATCH_THRESHOLD,
+                    exclude=set(index.values).difference(map(str, inner)),
                 )
-                res = joiner.fit_transform(main_table)
-                # Below is essentially set.difference on aux_table and those paired in res
-                inner = aux_table.loc[~aux_table["in"].isin(res["in"]), "in"].tolist()
                 # length(new inner) = length(inner) - #matched by fuzzy join
-                _outer = res["out"][res["in"].isnull()].to_list()
+                _fuzzy_matched = set(_fuzzy_mapping.values())
+                inner = [r for r in inner if str(r) not in _fuzzy_matched]
                 # length(new _outer) = length(_outer) - #matched by fuzzy join
-                _skrub_mapping = (
-                    res.dropna(subset=["in"]).set_index("out")["in"].to_dict()
-                )
+                _outer = [l for l in _outer if l not in _fuzzy_mapping]
                 logger.debug(
                     Fore.YELLOW
-                    + "Made the following alignment with `skrub.Joiner`:"
+                    + "Made the following alignment with `FuzzyIndex`:"
                     + Fore.RESET
                 )
                 logger.debug(
-                    Fore.YELLOW + json.dumps(_skrub_mapping, indent=4) + Fore.RESET
+                    Fore.YELLOW + json.dumps(_fuzzy_mapping, indent=4) + Fore.RESET
                 )
-                mapping = mapping | _skrub_mapping
+                mapping = mapping | _fuzzy_mapping
             # order by length is still preserved regardless of using fuzzy join, so after initial matching and possible fuzzy join matching
             # This is because the lengths of each list will decrease at the same rate, so whichever list was larger at the beginning,
             # will be larger here at the end.
@@ -342,6 +469,7 @@ class JoinIngredient(Ingredient):
         left_values, right_values = sorted_values
         kwargs["left_values"] = left_values
         kwargs["right_values"] = right_values
+        kwargs["get_right_index"] = get_right_index
 
         (left_tablename, left_colname), (
             right_tablename,
@@ -354,12 +482,18 @@ class JoinIngredient(Ingredient):
 
         if all(len(x) > 0 for x in [left_values, right_values]):
             # Some alignment still left to do
-            self.num_values_passed += len(kwargs["left_values"]) + len(
-                kwargs["right_values"]
+            self._add_num_values_passed(
+                len(kwargs["left_values"]) + len(kwargs["right_values"])
             )
 
             kwargs[IngredientKwarg.QUESTION] = question
-            _predicted_mapping: Dict[str, str] = self._run(*args, **kwargs)
+            _predicted_mapping: Dict[str, str] = self._run(
+                *args,
+                **kwargs,
+                num_candidates=self.num_candidates,
+                block_size=self.block_size,
+                max_concurrency=self.max_concurrency,
+            )
             mapping = mapping | _predicted_mapping
         # Using mapped left/right values, create intermediary mapping table
         temp_join_tablename = get_temp_session_table(str(uuid.uuid4())[:4])
@@ -372,6 +506,10 @@ class JoinIngredient(Ingredient):
             }
         )
         self.db.to_temp_table(df=joined_values_df, tablename=temp_join_tablename)
+        # The final query joins on both of these columns
+        self.db.index_temp_table(
+            temp_join_tablename, ["left", "right"], num_rows=len(joined_values_df)
+        )
         return (
             left_tablename,
             right_tablename,
@@ -431,7 +569,7 @@ class QAIngredient(Ingredient):
         else:
             kwargs[IngredientKwarg.OPTIONS] = None
 
-        self.num_values_passed += len(subtable) if subtable is not None else 0
+        self._add_num_values_passed(len(subtable) if subtable is not None else 0)
         kwargs[IngredientKwarg.CONTEXT] = subtable
         kwargs[IngredientKwarg.QUESTION] = question
         response: Union[str, int, float] = self._run(*args, **kwargs)
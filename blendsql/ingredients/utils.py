@@ -2,6 +2,7 @@ from typing import Union, List, Set, Dict
 
 from ..utils import get_tablename_colname
 from ..db import Database
+from ..models import Model
 
 
 def unpack_options(
@@ -24,3 +25,12 @@ def unpack_options(
         except ValueError:
             unpacked_options = options.split(";")
     return set(unpacked_options)
+
+
+def count_tokens(model: Model, text: str) -> int:
+    """Counts tokens with the Model's tokenizer, if it has one.
+    Otherwise, estimates ~4 characters per token.
+    """
+    if model.tokenizer is not None:
+        return len(model.tokenizer.encode(text))
+    return len(text) // 4 + 1
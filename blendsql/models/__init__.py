@@ -3,3 +3,4 @@ from .remote._ollama import OllamaLLM
 from .remote._openai import OpenaiLLM, AzureOpenaiLLM
 from .remote._anthropic import AnthropicLLM
 from ._model import Model, RemoteModel, LocalModel, ModelObj
+from ._cache import ModelCache, MemoryCache, DiskCache, SQLiteCache, RedisCache
@@ -0,0 +1,382 @@
+import importlib.util
+import pickle
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Optional, Tuple, Union
+
+_has_redis = importlib.util.find_spec("redis") is not None
+
+_MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+class ModelCache(ABC):
+    """Parent class for all caches used by a `Model`.
+
+    Subclasses implement `_get`, `_set`, `__contains__`, `__len__` and `clear`.
+    Hits and misses are tracked in `get()`, and subclasses are responsible
+    for incrementing `stats.evictions` when they drop an entry to stay within their size limit.
+
+    Args:
+        ttl: Optional number of seconds after which an entry expires.
+            Expired entries are counted as misses, not evictions.
+    """
+
+    def __init__(self, ttl: Optional[float] = None):
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._get(key, _MISSING)
+        with self._stats_lock:
+            if value is _MISSING:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+        return default if value is _MISSING else value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """Store `value` under `key`, optionally overriding the default `ttl`."""
+        self._set(key, value, ttl=ttl if ttl is not None else self.ttl)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.set(key, value)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def _record_evictions(self, num_evictions: int) -> None:
+        if num_evictions > 0:
+            with self._stats_lock:
+                self.stats.evictions += num_evictions
+
+    @abstractmethod
+    def _get(self, key: str, default: Any) -> Any:
+        ...
+
+    @abstractmethod
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        ...
+
+    @abstractmethod
+    def __contains__(self, key: str) -> bool:
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        """Remove all entries from the cache."""
+        ...
+
+
+class MemoryCache(ModelCache):
+    """An in-memory, least-recently-used cache.
+
+    Args:
+        max_size: Max number of entries to hold, before evicting the least recently used
+        ttl: Optional number of seconds after which an entry expires
+
+    Examples:
+        ```python
+        from blendsql.models import OpenaiLLM, MemoryCache
+
+        model = OpenaiLLM("gpt-4o-mini", cache=MemoryCache(max_size=10_000, ttl=3600))
+        ```
+    """
+
+    def __init__(self, max_size: int = 10_000, ttl: Optional[float] = None):
+        super().__init__(ttl=ttl)
+        self.max_size = max_size
+        # Maps from key to (value, expiration timestamp)
+        self._data: OrderedDict[str, Tuple[Any, Optional[float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str, default: Any) -> Any:
+        with self._lock:
+            if key not in self._data:
+                return default
+            value, expires_at = self._data[key]
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        with self._lock:
+            self._data[key] = (value, time.time() + ttl if ttl is not None else None)
+            self._data.move_to_end(key)
+            num_evictions = 0
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                num_evictions += 1
+        self._record_evictions(num_evictions)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._data:
+                return False
+            _, expires_at = self._data[key]
+            return expires_at is None or expires_at > time.time()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class DiskCache(ModelCache):
+    """A size-capped cache on disk, built on [diskcache](https://grantjenks.com/docs/diskcache/).
+    Safe to share between processes on the same host.
+
+    Args:
+        directory: Directory to store the cache in
+        size_limit: Max size of the cache on disk, in bytes
+        eviction_policy: One of the diskcache eviction policies
+            ('least-recently-stored', 'least-recently-used', 'least-frequently-used', 'none')
+        ttl: Optional number of seconds after which an entry expires
+
+    Examples:
+        ```python
+        from blendsql.models import OpenaiLLM, DiskCache
+
+        model = OpenaiLLM(
+            "gpt-4o-mini",
+            cache=DiskCache(
+                "/tmp/blendsql-cache",
+                size_limit=2**28,
+                eviction_policy="least-recently-used"
+            )
+        )
+        ```
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path],
+        size_limit: int = 2**30,
+        eviction_policy: str = "least-recently-stored",
+        ttl: Optional[float] = None,
+    ):
+        from diskcache import Cache
+
+        super().__init__(ttl=ttl)
+        self.directory = Path(directory)
+        self._cache = Cache(
+            str(self.directory),
+            size_limit=size_limit,
+            eviction_policy=eviction_policy,
+        )
+
+    def _get(self, key: str, default: Any) -> Any:
+        return self._cache.get(key, default=default)
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        # diskcache culls silently on `set()`, so we infer evictions from the change in size
+        num_entries = len(self._cache)
+        key_exists = key in self._cache
+        self._cache.set(key, value, expire=ttl)
+        self._record_evictions(
+            num_entries + (0 if key_exists else 1) - len(self._cache)
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._cache
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+class SQLiteCache(ModelCache):
+    """A least-recently-used cache stored in a single SQLite file.
+    Safe to share between processes on the same host.
+
+    Args:
+        path: Path to the SQLite file
+        max_size: Optional max number of entries to hold, before evicting the least recently used
+        ttl: Optional number of seconds after which an entry expires
+
+    Examples:
+        ```python
+        from blendsql.models import OpenaiLLM, SQLiteCache
+
+        model = OpenaiLLM("gpt-4o-mini", cache=SQLiteCache("./cache.db", max_size=100_000))
+        ```
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_size: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        super().__init__(ttl=ttl)
+        self.path = Path(path)
+        self.max_size = max_size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._con = sqlite3.connect(
+            str(self.path), check_same_thread=False, isolation_level=None
+        )
+        self._con.execute("PRAGMA journal_mode=WAL")
+        self._con.execute(
+            """CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                expires_at REAL,
+                accessed_at REAL
+            )"""
+        )
+        self._con.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+        )
+
+    def _get(self, key: str, default: Any) -> Any:
+        with self._lock:
+            row = self._con.execute(
+                "SELECT value, expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return default
+            value, expires_at = row
+            if expires_at is not None and expires_at <= time.time():
+                self._con.execute("DELETE FROM cache WHERE key = ?", (key,))
+                return default
+            self._con.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key)
+            )
+        return pickle.loads(value)
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        now = time.time()
+        num_evictions = 0
+        with self._lock:
+            self._con.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (
+                    key,
+                    pickle.dumps(value),
+                    now + ttl if ttl is not None else None,
+                    now,
+                ),
+            )
+            if self.max_size is not None:
+                num_evictions = self._con.execute(
+                    """DELETE FROM cache WHERE key IN (
+                        SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )""",
+                    (self.max_size,),
+                ).rowcount
+        self._record_evictions(num_evictions)
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            row = self._con.execute(
+                "SELECT expires_at FROM cache WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None and (row[0] is None or row[0] > time.time())
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._con.execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._con.execute("DELETE FROM cache")
+
+
+class RedisCache(ModelCache):
+    """A cache on a Redis server (or anything else speaking the Redis protocol),
+    for sharing hits across processes and hosts.
+
+    Size limits and eviction are handled by the server's `maxmemory` and `maxmemory-policy` settings,
+    so `stats.evictions` is not tracked here.
+
+    Args:
+        url: URL of the Redis server
+        namespace: Prefix for all keys written by this cache
+        ttl: Optional number of seconds after which an entry expires
+        client: Optional pre-configured client, used instead of `url`.
+            Needs to implement `get`, `set`, `exists`, `delete` and `scan_iter` like `redis.Redis`
+
+    Examples:
+        ```python
+        from blendsql.models import OpenaiLLM, RedisCache
+
+        model = OpenaiLLM("gpt-4o-mini", cache=RedisCache("redis://localhost:6379/0", ttl=86400))
+        ```
+    """
+
+    def __init__(
+        self,
+        url: str = "redis://localhost:6379/0",
+        namespace: str = "blendsql",
+        ttl: Optional[float] = None,
+        client: Optional[Any] = None,
+    ):
+        super().__init__(ttl=ttl)
+        if client is None:
+            if not _has_redis:
+                raise ImportError(
+                    "Please install redis with `pip install redis`!"
+                ) from None
+            import redis
+
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.namespace = namespace
+
+    def _key(self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    def _get(self, key: str, default: Any) -> Any:
+        value = self.client.get(self._key(key))
+        if value is None:
+            return default
+        return pickle.loads(value)
+
+    def _set(self, key: str, value: Any, ttl: Optional[float]) -> None:
+        self.client.set(
+            self._key(key),
+            pickle.dumps(value),
+            px=int(ttl * 1000) if ttl is not None else None,
+        )
+
+    def __contains__(self, key: str) -> bool:
+        return bool(self.client.exists(self._key(key)))
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.namespace}:*"))
+
+    def clear(self) -> None:
+        keys = list(self.client.scan_iter(match=f"{self.namespace}:*"))
+        if len(keys) > 0:
+            self.client.delete(*keys)
@@ -6,20 +6,33 @@ from dotenv import load_dotenv
 from colorama import Fore
 import time
 import threading
-from diskcache import Cache
+import asyncio
+import inspect
+import weakref
 import platformdirs
 import hashlib
 from abc import abstractmethod
+from contextvars import ContextVar
 from functools import cached_property
 
 from .._logger import logger
 from .._program import Program, program_to_str
+from .. import _constants as CONST
 from .._constants import IngredientKwarg
 from ..db.utils import truncate_df_content
+from .._trace import traced, set_span_attributes
+from ._cache import ModelCache, DiskCache, _MISSING
 
 CONTEXT_TRUNCATION_LIMIT = 100
 ModelObj = TypeVar("ModelObj")
 
+# The event loop of the current `ablend()` call (or `Model.apredict()`), if any.
+#   Requests made from its worker threads are sent back to this loop,
+#   to be awaited with the native async client of their Model (see `agenerate`).
+_event_loop: ContextVar[Optional[asyncio.AbstractEventLoop]] = ContextVar(
+    "blendsql_event_loop", default=None
+)
+
 
 class TokenTimer(threading.Thread):
     """Class to handle refreshing tokens."""
@@ -48,18 +61,35 @@ class Model:
     load_model_kwargs: dict = attrib(default=None)
     env: str = attrib(default=".")
     caching: bool = attrib(default=True)
+    # If not specified, we use a `DiskCache` in the user cache directory
+    cache: Optional[ModelCache] = attrib(default=None)
+    # Max number of value + answer tokens in a single `LLMMap` batch.
+    #   If None, we use fixed batches of `MAP_BATCH_SIZE` values.
+    map_batch_token_budget: Optional[int] = attrib(default=CONST.MAP_BATCH_TOKEN_BUDGET)
+    # Max number of tokens in the context table passed to `LLMQA`.
+    #   Larger contexts are narrowed down to the rows most relevant to the question.
+    #   If None, the whole context is always passed.
+    qa_context_token_budget: Optional[int] = attrib(
+        default=CONST.QA_CONTEXT_TOKEN_BUDGET
+    )
 
     model_obj: Generic[ModelObj] = attrib(init=False)
     prompts: List[dict] = attrib(init=False)
     prompt_tokens: int = attrib(init=False)
     completion_tokens: int = attrib(init=False)
     num_calls: int = attrib(init=False)
-    cache: Cache = attrib(init=False)
     run_setup_on_load: bool = attrib(default=True)
+    # Guards the usage counters/prompt log, since ingredients may call
+    #   `predict()` from many threads at once (e.g. concurrent LLMMap batches)
+    _lock: threading.Lock = attrib(init=False)
+    # Native async clients, one per event loop, since they hold connections bound to the loop
+    _async_clients: weakref.WeakKeyDictionary = attrib(init=False)
 
     def __attrs_post_init__(self):
-        if self.caching:
-            self.cache = Cache(
+        self._lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+        if self.caching and self.cache is None:
+            self.cache = DiskCache(
                 Path(platformdirs.user_cache_dir("blendsql"))
                 / f"{self.model_name_or_path}.diskcache"
             )
@@ -92,6 +122,7 @@ class Model:
         if self.run_setup_on_load:
             self._setup()
 
+    @traced("model.predict")
     def predict(self, program: Type[Program], **kwargs) -> str:
         """Takes a `Program` and some kwargs, and evaluates it with context of
         current Model.
@@ -107,27 +138,98 @@ class Model:
             >>> model.predict(program, **kwargs)
             "This is model generated output"
         """
+        set_span_attributes(model=self.model_name_or_path, program=program.__name__)
+        key: Optional[str] = None
         if self.caching:
             # First, check our cache
-            key: str = self._create_key(program, **kwargs)
-            if key in self.cache:
-                logger.debug(Fore.MAGENTA + "Using model cache..." + Fore.RESET)
-                response: str = self.cache.get(key)  # type: ignore
-                self.prompts.insert(-1, self.format_prompt(response, **kwargs))
-                return response
-        # Modify fields used for tracking Model usage
+            key = self._create_key(program, **kwargs)
+            response = self.cache.get(key, default=_MISSING)
+            if response is not _MISSING:
+                return self._load_from_cache(response, **kwargs)
         response: Union[str, List[str]]
         prompt: str
         response, prompt = program(model=self, **kwargs)
-        self.prompts.insert(-1, self.format_prompt(response, **kwargs))
-        self.num_calls += 1
+        return self._record_response(response, prompt, key=key, **kwargs)
+
+    @traced("model.predict")
+    async def apredict(self, program: Type[Program], **kwargs) -> str:
+        """Async counterpart to `predict()`, sharing its cache.
+
+        If the `Program` defines an `async def __call__`, it is awaited directly.
+        Otherwise, the `Program` is run in a worker thread, and any requests it makes
+        via `generate` are awaited on this event loop with the Model's native async client.
+
+        Examples:
+            >>> await model.apredict(program, **kwargs)
+            "This is model generated output"
+        """
+        set_span_attributes(model=self.model_name_or_path, program=program.__name__)
+        key: Optional[str] = None
+        if self.caching:
+            key = self._create_key(program, **kwargs)
+            response = self.cache.get(key, default=_MISSING)
+            if response is not _MISSING:
+                return self._load_from_cache(response, **kwargs)
+        response: Union[str, List[str]]
+        prompt: str
+        if inspect.iscoroutinefunction(program.__call__):
+            response, prompt = await program(model=self, **kwargs)
+        else:
+            token = _event_loop.set(asyncio.get_running_loop())
+            try:
+                response, prompt = await asyncio.to_thread(
+                    program, model=self, **kwargs
+                )
+            finally:
+                _event_loop.reset(token)
+        return self._record_response(response, prompt, key=key, **kwargs)
+
+    def get_async_client(self) -> Any:
+        """Returns the native async client used by `agenerate`,
+        creating it the first time it's used on the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = self._load_async_client()
+        return client
+
+    def _load_async_client(self) -> Any:
+        """Logic for instantiating the native async client of this Model goes here,
+        e.g. `openai.AsyncOpenAI`. Only needed by Models with an `agenerate` implementation.
+        """
+        raise NotImplementedError(f"{self.__class__} has no native async client")
+
+    def _load_from_cache(self, response: str, **kwargs) -> str:
+        logger.debug(Fore.MAGENTA + "Using model cache..." + Fore.RESET)
+        set_span_attributes(cache_hit=True)
+        with self._lock:
+            self.prompts.insert(-1, self.format_prompt(response, **kwargs))
+        return response
+
+    def _record_response(
+        self,
+        response: Union[str, List[str]],
+        prompt: str,
+        key: Optional[str] = None,
+        **kwargs,
+    ) -> Union[str, List[str]]:
+        """Modify fields used for tracking Model usage, and write `response` to the cache."""
+        set_span_attributes(cache_hit=False)
         if self.tokenizer is not None:
-            self.prompt_tokens += len(self.tokenizer.encode(prompt))
-            self.completion_tokens += sum(
+            num_prompt_tokens = len(self.tokenizer.encode(prompt))
+            num_completion_tokens = sum(
                 [len(self.tokenizer.encode(r)) for r in " ".join(response)]
             )
-        if self.caching:
-            self.cache[key] = response  # type: ignore
+        with self._lock:
+            self.prompts.insert(-1, self.format_prompt(response, **kwargs))
+            self.num_calls += 1
+            if self.tokenizer is not None:
+                self.prompt_tokens += num_prompt_tokens
+                self.completion_tokens += num_completion_tokens
+        if key is not None:
+            self.cache[key] = response
         return response
 
     def _create_key(self, program: Type[Program], **kwargs) -> str:
@@ -0,0 +1,336 @@
+from typing import Any, List, Optional, Tuple
+
+# Number of candidate tokens we consider at each step of regex-constrained decoding
+CONSTRAINED_TOP_K = 50
+# If none of the top `CONSTRAINED_TOP_K` tokens are valid, we search this many instead
+CONSTRAINED_FALLBACK_TOP_K = 1000
+
+
+def _expand_past_key_values(past_key_values: Any, batch_size: int) -> Any:
+    """Repeats the KV cache of a single prefix, so it can be shared by a batch of continuations.
+    Handles both the legacy tuple format and `transformers.Cache` objects.
+    """
+    is_cache_obj = hasattr(past_key_values, "to_legacy_cache")
+    legacy = past_key_values.to_legacy_cache() if is_cache_obj else past_key_values
+    expanded = tuple(
+        tuple(t.expand(batch_size, *t.shape[1:]).contiguous() for t in layer)
+        for layer in legacy
+    )
+    if is_cache_obj:
+        return type(past_key_values).from_legacy_cache(expanded)
+    return expanded
+
+
+def encode_prefix(
+    hf_model,
+    prefix_ids: List[int],
+    past_key_values: Optional[Any] = None,
+    past_length: int = 0,
+) -> Tuple[Any, Any]:
+    """Runs the shared prefix through the model once.
+
+    Args:
+        past_key_values: Optional KV cache for the first `past_length` tokens of `prefix_ids`,
+            in which case only the remaining tokens are encoded
+
+    Returns:
+        Tuple containing the prefix KV cache, and the logits at its final position
+    """
+    import torch
+
+    new_ids = prefix_ids[past_length:]
+    with torch.inference_mode():
+        out = hf_model(
+            input_ids=torch.tensor([new_ids], device=hf_model.device),
+            attention_mask=torch.ones(
+                (1, len(prefix_ids)), dtype=torch.long, device=hf_model.device
+            ),
+            position_ids=torch.arange(
+                past_length, len(prefix_ids), device=hf_model.device
+            ).unsqueeze(0),
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+    return (out.past_key_values, out.logits[0, -1])
+
+
+def _forward_continuations(
+    hf_model,
+    prefix_past_key_values: Any,
+    prefix_len: int,
+    continuations: List[List[int]],
+    pad_token_id: int,
+):
+    """Runs a right-padded batch of continuations on top of the shared prefix.
+
+    Returns:
+        Tuple containing logits of shape (batch, max_len, vocab), the new KV cache, and the attention mask
+    """
+    import torch
+
+    batch_size = len(continuations)
+    max_len = max(len(c) for c in continuations)
+    input_ids = torch.full(
+        (batch_size, max_len), pad_token_id, dtype=torch.long, device=hf_model.device
+    )
+    continuation_mask = torch.zeros(
+        (batch_size, max_len), dtype=torch.long, device=hf_model.device
+    )
+    for i, c in enumerate(continuations):
+        input_ids[i, : len(c)] = torch.tensor(c, device=hf_model.device)
+        continuation_mask[i, : len(c)] = 1
+    attention_mask = torch.cat(
+        [
+            torch.ones(
+                (batch_size, prefix_len), dtype=torch.long, device=hf_model.device
+            ),
+            continuation_mask,
+        ],
+        dim=1,
+    )
+    position_ids = (
+        torch.arange(prefix_len, prefix_len + max_len, device=hf_model.device)
+        .unsqueeze(0)
+        .expand(batch_size, -1)
+    )
+    with torch.inference_mode():
+        out = hf_model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=_expand_past_key_values(prefix_past_key_values, batch_size),
+            use_cache=True,
+        )
+    return (out.logits, out.past_key_values, attention_mask)
+
+
+def choose_options(
+    hf_model,
+    tokenizer,
+    prefix_ids: List[int],
+    continuations: List[str],
+    options: List[str],
+    max_batch_size: int = 32,
+    prefix_cache: Optional[Tuple[Any, Any]] = None,
+) -> List[str]:
+    """For each continuation, picks the option with the highest log-likelihood
+    when appended to `prefix + continuation`.
+
+    Every (continuation, option) pair is scored in padded forward batches on top of
+    a single encoding of the prefix, instead of decoding each continuation in turn.
+    """
+    import torch
+
+    if prefix_cache is None:
+        prefix_cache = encode_prefix(hf_model, prefix_ids)
+    past_key_values, prefix_last_logits = prefix_cache
+    prefix_log_probs = torch.log_softmax(prefix_last_logits.float(), dim=-1)
+    pad_token_id = (
+        tokenizer.pad_token_id
+        if tokenizer.pad_token_id is not None
+        else tokenizer.eos_token_id
+    )
+    sequences: List[List[int]] = []
+    score_from: List[int] = []
+    for continuation in continuations:
+        option_ids = [
+            tokenizer.encode(continuation + option, add_special_tokens=False)
+            for option in options
+        ]
+        # Tokenizers may merge the end of the continuation with the start of an option,
+        #   so we score all options from the first token where any of them differ
+        shared = min(
+            [len(tokenizer.encode(continuation, add_special_tokens=False))]
+            + [len(ids) - 1 for ids in option_ids]
+        )
+        while shared > 0 and any(
+            ids[:shared] != option_ids[0][:shared] for ids in option_ids
+        ):
+            shared -= 1
+        sequences.extend(option_ids)
+        score_from.extend([shared] * len(options))
+    scores: List[float] = []
+    for start in range(0, len(sequences), max_batch_size):
+        batch = sequences[start : start + max_batch_size]
+        logits, _, _ = _forward_continuations(
+            hf_model,
+            prefix_past_key_values=past_key_values,
+            prefix_len=len(prefix_ids),
+            continuations=batch,
+            pad_token_id=pad_token_id,
+        )
+        log_probs = torch.log_softmax(logits.float(), dim=-1)
+        for i, (ids, first) in enumerate(
+            zip(batch, score_from[start : start + max_batch_size])
+        ):
+            # Logits for the token at `pos` come from the position before it
+            scores.append(
+                sum(
+                    (
+                        prefix_log_probs[ids[pos]]
+                        if pos == 0
+                        else log_probs[i, pos - 1, ids[pos]]
+                    ).item()
+                    for pos in range(first, len(ids))
+                )
+            )
+    chosen: List[str] = []
+    for idx in range(len(continuations)):
+        option_scores = scores[idx * len(options) : (idx + 1) * len(options)]
+        chosen.append(options[option_scores.index(max(option_scores))])
+    return chosen
+
+
+def _decode_answer(tokenizer, token_ids: List[int]) -> str:
+    """Decodes generated tokens, dropping the single space which naturally follows '->'.
+    Any further whitespace is kept, so it can't be generated endlessly without progressing the answer.
+    """
+    text = tokenizer.decode(token_ids)
+    return text[1:] if text.startswith(" ") else text
+
+
+def _first_valid_token(
+    tokenizer, pattern, generated: List[int], candidates: List[int], stop: str
+) -> Optional[Tuple[int, str]]:
+    """Returns the first of `candidates` which keeps the answer a partial match of `pattern`,
+    along with the new answer text.
+    """
+    for token_id in candidates:
+        if token_id == tokenizer.eos_token_id:
+            continue
+        text = _decode_answer(tokenizer, generated + [token_id])
+        if stop not in text and pattern.fullmatch(text, partial=True):
+            return (token_id, text)
+    return None
+
+
+def generate_batch(
+    hf_model,
+    tokenizer,
+    prefix_ids: List[int],
+    continuations: List[str],
+    max_new_tokens: int,
+    regex: Optional[str] = None,
+    stop: str = "\n",
+    prefix_cache: Optional[Tuple[Any, Any]] = None,
+) -> List[str]:
+    """Greedily decodes an answer for each continuation, all in the same forward batch.
+
+    If `regex` is given, at each step we take the most likely of the top `CONSTRAINED_TOP_K`
+    tokens which keeps the answer a partial match of `regex` (searching the top
+    `CONSTRAINED_FALLBACK_TOP_K` only if none of them do), and stop once the answer is
+    a full match and the model prefers to end it (or can't extend it).
+    Otherwise, we stop at `stop` or the EOS token.
+    """
+    import torch
+    import regex as _regex
+
+    if prefix_cache is None:
+        prefix_cache = encode_prefix(hf_model, prefix_ids)
+    past_key_values, _ = prefix_cache
+    pad_token_id = (
+        tokenizer.pad_token_id
+        if tokenizer.pad_token_id is not None
+        else tokenizer.eos_token_id
+    )
+    pattern = _regex.compile(regex) if regex is not None else None
+    continuation_ids = [
+        tokenizer.encode(c, add_special_tokens=False) for c in continuations
+    ]
+    logits, past_key_values, attention_mask = _forward_continuations(
+        hf_model,
+        prefix_past_key_values=past_key_values,
+        prefix_len=len(prefix_ids),
+        continuations=continuation_ids,
+        pad_token_id=pad_token_id,
+    )
+    batch_size = len(continuations)
+    # Next position for each sequence, ignoring padding
+    positions = torch.tensor(
+        [len(prefix_ids) + len(c) for c in continuation_ids], device=hf_model.device
+    )
+    next_logits = torch.stack(
+        [logits[i, len(c) - 1] for i, c in enumerate(continuation_ids)]
+    )
+    generated: List[List[int]] = [[] for _ in range(batch_size)]
+    answers: List[str] = [""] * batch_size
+    done = [False] * batch_size
+    for _ in range(max_new_tokens):
+        next_tokens: List[int] = []
+        for i in range(batch_size):
+            if done[i]:
+                next_tokens.append(pad_token_id)
+                continue
+            candidates = torch.topk(
+                next_logits[i], k=CONSTRAINED_TOP_K if pattern else 1
+            ).indices.tolist()
+            chosen = None
+            for token_id in candidates:
+                if token_id == tokenizer.eos_token_id:
+                    if pattern is None or pattern.fullmatch(answers[i]):
+                        break
+                    continue
+                text = _decode_answer(tokenizer, generated[i] + [token_id])
+                if pattern is None:
+                    if stop in text:
+                        answers[i] = text[: text.index(stop)]
+                        break
+                    chosen = (token_id, text)
+                    break
+                if stop in text:
+                    # The model wants to end the answer here
+                    if pattern.fullmatch(answers[i]):
+                        break
+                    continue
+                if pattern.fullmatch(text, partial=True):
+                    chosen = (token_id, text)
+                    break
+            else:
+                if pattern is not None and not pattern.fullmatch(answers[i]):
+                    # None of the top tokens keep the answer valid, so search further down
+                    chosen = _first_valid_token(
+                        tokenizer,
+                        pattern=pattern,
+                        generated=generated[i],
+                        candidates=torch.topk(
+                            next_logits[i],
+                            k=min(CONSTRAINED_FALLBACK_TOP_K, next_logits.shape[-1]),
+                        )
+                        .indices[CONSTRAINED_TOP_K:]
+                        .tolist(),
+                        stop=stop,
+                    )
+            if chosen is None:
+                done[i] = True
+                next_tokens.append(pad_token_id)
+            else:
+                generated[i].append(chosen[0])
+                answers[i] = chosen[1]
+                next_tokens.append(chosen[0])
+        if all(done):
+            break
+        attention_mask = torch.cat(
+            [
+                attention_mask,
+                torch.tensor(
+                    [[0 if d else 1] for d in done],
+                    dtype=torch.long,
+                    device=hf_model.device,
+                ),
+            ],
+            dim=1,
+        )
+        with torch.inference_mode():
+            out = hf_model(
+                input_ids=torch.tensor(
+                    [[t] for t in next_tokens], device=hf_model.device
+                ),
+                attention_mask=attention_mask,
+                position_ids=positions.unsqueeze(1),
+                past_key_values=past_key_values,
+                use_cache=True,
+            )
+        past_key_values = out.past_key_values
+        next_logits = out.logits[:, -1]
+        positions = positions + 1
+    return [answer.strip() for answer in answers]
@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Deque, Optional, Sequence, Tuple
+
+from .._cache import CacheStats
+
+# Shared prefixes shorter than this aren't worth the memory of caching
+MIN_PREFIX_TOKENS = 16
+# Number of recently encoded prompts we compare new prompts against, to discover shared prefixes
+PROMPT_HISTORY_SIZE = 8
+
+
+def _common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+def slice_past_key_values(past_key_values: Any, length: int) -> tuple:
+    """Returns a copy of the KV cache for the first `length` positions, in the legacy tuple format.
+    Copying means the slice doesn't keep the (possibly much larger) original tensors alive.
+    """
+    if hasattr(past_key_values, "to_legacy_cache"):
+        past_key_values = past_key_values.to_legacy_cache()
+    return tuple(
+        tuple(t[..., :length, :].clone() for t in layer) for layer in past_key_values
+    )
+
+
+def _num_bytes(past_key_values: tuple) -> int:
+    return sum(
+        t.element_size() * t.nelement() for layer in past_key_values for t in layer
+    )
+
+
+class PrefixKVCache:
+    """LRU cache of the past-key-values for prompt prefixes which are shared across calls to a local model,
+    such as the static instructions and few-shot examples at the start of ingredient prompts.
+
+    Shared prefixes are discovered by comparing each prompt we encode to the last few prompts:
+    if they share at least `MIN_PREFIX_TOKENS`, the KV cache for the shared tokens is stored.
+    Later prompts starting with these tokens only need to encode what comes after.
+
+    Args:
+        max_bytes: Memory budget for all stored tensors. The least recently used prefixes are evicted to stay within it.
+            If 0, nothing is cached.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self.stats = CacheStats()
+        self._entries: "OrderedDict[Tuple[int, ...], Tuple[tuple, int]]" = OrderedDict()
+        self._recent_prompts: Deque[Tuple[int, ...]] = deque(maxlen=PROMPT_HISTORY_SIZE)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(
+        self, token_ids: Sequence[int], max_length: Optional[int] = None
+    ) -> Optional[Tuple[int, tuple]]:
+        """Finds the longest cached prefix of `token_ids`.
+
+        Args:
+            token_ids: The prompt we're about to encode
+            max_length: Max number of tokens to take from the cache. Passing `len(token_ids) - 1`
+                guarantees at least one token is left to compute logits from.
+
+        Returns:
+            Tuple containing the number of cached tokens, and their KV cache.
+            None if no cached prefix is at least `MIN_PREFIX_TOKENS` long.
+        """
+        if max_length is None:
+            max_length = len(token_ids)
+        token_ids = tuple(token_ids[:max_length])
+        best_key, best_length = None, 0
+        with self._lock:
+            for key in self._entries:
+                length = _common_prefix_length(key, token_ids)
+                if length > best_length:
+                    best_key, best_length = key, length
+            if best_key is None or best_length < MIN_PREFIX_TOKENS:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            self._entries.move_to_end(best_key)
+            past_key_values, _ = self._entries[best_key]
+        if best_length < len(best_key):
+            # Views are fine here, since the model never modifies the KV cache it's given in place
+            past_key_values = tuple(
+                tuple(t[..., :best_length, :] for t in layer)
+                for layer in past_key_values
+            )
+        return (best_length, past_key_values)
+
+    def observe(self, token_ids: Sequence[int], past_key_values: Any) -> None:
+        """Records a prompt which was just encoded, along with its KV cache.
+        If it shares a long enough prefix with a recent prompt, we cache the KV cache of that prefix.
+        """
+        if self.max_bytes <= 0:
+            return
+        token_ids = tuple(token_ids)
+        with self._lock:
+            shared_length = max(
+                (_common_prefix_length(p, token_ids) for p in self._recent_prompts),
+                default=0,
+            )
+            self._recent_prompts.append(token_ids)
+            key = token_ids[:shared_length]
+            if shared_length < MIN_PREFIX_TOKENS or key in self._entries:
+                return
+        self.insert(key, slice_past_key_values(past_key_values, shared_length))
+
+    def insert(self, token_ids: Sequence[int], past_key_values: tuple) -> None:
+        num_bytes = _num_bytes(past_key_values)
+        if num_bytes > self.max_bytes:
+            return
+        key = tuple(token_ids)
+        with self._lock:
+            if key in self._entries:
+                return
+            while self._entries and self.num_bytes + num_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+                self.stats.evictions += 1
+            self._entries[key] = (past_key_values, num_bytes)
+            self.num_bytes += num_bytes
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._recent_prompts.clear()
+            self.num_bytes = 0
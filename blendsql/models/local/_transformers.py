@@ -1,11 +1,19 @@
+import importlib.metadata
 import importlib.util
-from typing import Optional
+from typing import List, Optional
 from colorama import Fore
 
 from ..._logger import logger
 from .._model import LocalModel, ModelObj
+from ._batch_decoding import encode_prefix, choose_options, generate_batch
+from ._prefix_cache import PrefixKVCache, _common_prefix_length
 
 DEFAULT_KWARGS = {"do_sample": True, "temperature": 0.0, "top_p": 1.0}
+DEFAULT_PREFIX_CACHE_MAX_BYTES = 1024**3
+# `_attach_prefix_cache` relies on private attributes of guidance's `TransformersEngine`.
+#   These are the versions we've checked it against, other versions are left unpatched.
+PREFIX_CACHE_GUIDANCE_VERSIONS = {"0.1.13", "0.1.14", "0.1.15", "0.1.16"}
+PREFIX_CACHE_ENGINE_ATTRS = ("get_logits", "_cached_token_ids", "_past_key_values")
 
 _has_transformers = importlib.util.find_spec("transformers") is not None
 _has_torch = importlib.util.find_spec("torch") is not None
@@ -17,11 +25,20 @@ class TransformersLLM(LocalModel):
     Args:
         model_name_or_path: Name of the model on HuggingFace, or the path to a local model
         caching: Bool determining whether we access the model's cache
+        batch_map: If True, `LLMMap` answers all values in a batch at once, in padded forward passes
+            sharing a single encoding of the prompt. Each value is answered independently,
+            rather than conditioned on the answers to previous values.
+        max_batch_size: Max number of sequences in a single forward pass, when `batch_map=True`
+        prefix_cache_max_bytes: Memory budget for the KV cache of prompt prefixes shared across
+            ingredient calls (e.g. the instructions and few-shot examples of `LLMMap`), so they're
+            only encoded once. Set to 0 to disable.
 
     Examples:
         ```python
         from blendsql.models import TransformersLLM
         model = TransformersLLM("Qwen/Qwen1.5-0.5B")
+        # Faster `LLMMap` calls, especially on CPU
+        model = TransformersLLM("Qwen/Qwen1.5-0.5B", batch_map=True)
         ```
     """
 
@@ -30,8 +47,14 @@ class TransformersLLM(LocalModel):
         model_name_or_path: str,
         config: Optional[dict] = None,
         caching: bool = True,
+        batch_map: bool = False,
+        max_batch_size: int = 32,
+        prefix_cache_max_bytes: int = DEFAULT_PREFIX_CACHE_MAX_BYTES,
         **kwargs,
     ):
+        self.batch_map = batch_map
+        self.max_batch_size = max_batch_size
+        self.prefix_cache = PrefixKVCache(max_bytes=prefix_cache_max_bytes)
         if not _has_transformers and _has_torch:
             raise ImportError(
                 "Please install transformers with `pip install transformers`!"
@@ -77,8 +100,143 @@ class TransformersLLM(LocalModel):
                 + "chat_template not found in tokenizer config.\nBlendSQL currently only works with chat models"
                 + Fore.RESET
             )
+        if self.prefix_cache.max_bytes > 0:
+            self._attach_prefix_cache(lm.engine)
         return lm
 
+    def _attach_prefix_cache(self, engine) -> bool:
+        """Lets the guidance engine start from our cached prefixes.
+
+        The engine only keeps the KV cache of the last sequence it saw, so switching between
+        ingredients (or between questions) would otherwise re-encode the entire prompt.
+
+        Returns:
+            True if the engine was patched. False if this version of guidance isn't supported,
+            in which case the engine is left as-is (`batch_complete` still uses the cache).
+        """
+        guidance_version = importlib.metadata.version("guidance")
+        if guidance_version not in PREFIX_CACHE_GUIDANCE_VERSIONS or not all(
+            hasattr(engine, attr) for attr in PREFIX_CACHE_ENGINE_ATTRS
+        ):
+            logger.debug(
+                Fore.YELLOW
+                + f"Prefix cache isn't supported with guidance=={guidance_version}, so guidance programs won't use it"
+                + Fore.RESET
+            )
+            return False
+        get_logits = engine.get_logits
+
+        def get_logits_with_prefix_cache(token_ids, forced_bytes, current_temp):
+            cached_token_ids = engine._cached_token_ids
+            num_cached = _common_prefix_length(cached_token_ids, token_ids)
+            if len(token_ids) - num_cached <= 1 or (
+                0 < num_cached == len(cached_token_ids)
+            ):
+                # We're continuing the current sequence, not encoding a new prompt
+                return get_logits(token_ids, forced_bytes, current_temp)
+            hit = self.prefix_cache.lookup(token_ids, max_length=len(token_ids) - 1)
+            if hit is not None and hit[0] > num_cached:
+                length, past_key_values = hit
+                engine._past_key_values = past_key_values
+                engine._cached_token_ids = list(token_ids[:length])
+            logits = get_logits(token_ids, forced_bytes, current_temp)
+            self.prefix_cache.observe(token_ids, engine._past_key_values)
+            return logits
+
+        engine.get_logits = get_logits_with_prefix_cache
+        return True
+
+    def _encode_prefix(self, hf_model, prefix_ids: List[int]):
+        hit = self.prefix_cache.lookup(prefix_ids, max_length=len(prefix_ids) - 1)
+        if hit is None:
+            prefix_cache = encode_prefix(hf_model, prefix_ids)
+        else:
+            length, past_key_values = hit
+            prefix_cache = encode_prefix(
+                hf_model,
+                prefix_ids,
+                past_key_values=past_key_values,
+                past_length=length,
+            )
+        self.prefix_cache.observe(prefix_ids, prefix_cache[0])
+        return prefix_cache
+
+    def _format_prompt(self, system_prompt: str, user_prompt: str) -> List[int]:
+        """Formats the prompt the same way `guidance` would for a chat model, and tokenizes it."""
+        if self.tokenizer.chat_template is None:
+            return self.tokenizer.encode(f"{system_prompt}\n\n{user_prompt}")
+        try:
+            prompt = self.tokenizer.apply_chat_template(
+                [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt},
+                ],
+                tokenize=False,
+                add_generation_prompt=True,
+            )
+        except Exception:
+            # Some chat templates don't support a system role
+            prompt = self.tokenizer.apply_chat_template(
+                [{"role": "user", "content": f"{system_prompt}\n\n{user_prompt}"}],
+                tokenize=False,
+                add_generation_prompt=True,
+            )
+        return self.tokenizer.encode(prompt, add_special_tokens=False)
+
+    def batch_complete(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        continuations: List[str],
+        options: Optional[List[str]] = None,
+        regex: Optional[str] = None,
+        max_tokens: Optional[int] = None,
+    ) -> List[str]:
+        """Completes each of `continuations`, given the same system and user prompt.
+        The prompt is only encoded once (or not at all, if it's in `prefix_cache`),
+        and all continuations share its KV cache.
+
+        Args:
+            system_prompt: Content of the system message
+            user_prompt: Content of the user message
+            continuations: Start of the assistant message for each completion
+            options: If given, each completion is the most likely of these strings
+            regex: If given (and `options` is not), each completion matches this pattern
+            max_tokens: Max number of tokens to generate for each completion
+
+        Returns:
+            List of completions, in the order of `continuations`
+        """
+        hf_model = self.model_obj.engine.model_obj
+        prefix_ids = self._format_prompt(system_prompt, user_prompt)
+        prefix_cache = self._encode_prefix(hf_model, prefix_ids)
+        if options:
+            # Options are scored with a leading space, as they'd naturally follow '->'
+            chosen = choose_options(
+                hf_model,
+                self.tokenizer,
+                prefix_ids=prefix_ids,
+                continuations=continuations,
+                options=[f" {option}" for option in options],
+                max_batch_size=self.max_batch_size,
+                prefix_cache=prefix_cache,
+            )
+            return [option[1:] for option in chosen]
+        completions = []
+        for start in range(0, len(continuations), self.max_batch_size):
+            completions.extend(
+                generate_batch(
+                    hf_model,
+                    self.tokenizer,
+                    prefix_ids=prefix_ids,
+                    continuations=continuations[start : start + self.max_batch_size],
+                    max_new_tokens=max_tokens or 32,
+                    regex=regex,
+                    prefix_cache=prefix_cache,
+                )
+            )
+        return completions
+
 
 class TransformersVisionModel(TransformersLLM):
     """Wrapper for the image-to-text Transformers pipeline."""
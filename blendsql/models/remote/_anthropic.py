@@ -68,3 +68,8 @@ class AnthropicLLM(RemoteModel):
         return Anthropic(
             self.model_name_or_path, echo=False, api_key=os.getenv("ANTHROPIC_API_KEY")
         )
+
+    def _load_async_client(self):
+        from anthropic import AsyncAnthropic
+
+        return AsyncAnthropic(api_key=self.model_obj.engine.anthropic.api_key)
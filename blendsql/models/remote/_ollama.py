@@ -37,6 +37,7 @@ class OllamaLLM(RemoteModel):
                 "Please install ollama with `pip install ollama`!"
             ) from None
 
+        self.host = host
         self.client = None
         if host is not None:
             from ollama import Client
@@ -59,3 +60,8 @@ class OllamaLLM(RemoteModel):
             ollama.chat if self.client is None else self.client.chat,
             model=self.model_name_or_path,
         )
+
+    def _load_async_client(self):
+        from ollama import AsyncClient
+
+        return AsyncClient(host=self.host)
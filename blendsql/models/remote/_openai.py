@@ -175,5 +175,11 @@ class OpenaiLLM(RemoteModel):
             self.model_name_or_path, echo=False, api_key=os.getenv("OPENAI_API_KEY")
         )
 
+    def _load_async_client(self):
+        from openai import AsyncOpenAI
+
+        client = self.model_obj.engine.client
+        return AsyncOpenAI(api_key=client.api_key, base_url=client.base_url)
+
     def _setup(self, **kwargs) -> None:
         openai_setup()
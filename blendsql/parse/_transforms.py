@@ -4,7 +4,7 @@ https://github.com/tobymao/sqlglot
 
 """
 
-from typing import Union
+from typing import Callable, Dict, List, Optional, Union
 from sqlglot import exp
 from sqlglot.optimizer.scope import find_in_scope
 
@@ -190,22 +190,25 @@ def set_structs_to_true(node) -> Union[exp.Expression, None]:
 
 
 def replace_join_with_ingredient_multiple_ingredient(
-    node: exp.Where, ingredient_name: str, ingredient_alias: str, temp_uuid: str
-) -> Union[exp.Expression, None]:
+    node: exp.Expression, ingredient_name: str, ingredient_alias: str
+) -> exp.Expression:
     """
-
-    Used with node.transform()
-
     sqlglot re-orders `WHERE` conditions to appear in `JOIN`:
 
     SELECT * FROM documents JOIN "w" ON {{B()}} WHERE w.film = {{A()}}
     SELECT * FROM documents JOIN "w" ON w.film = {{A()}}  AND  {{B()}}  WHERE TRUE
+
+    So we replace the `JOIN` containing `ingredient_name` with just its alias,
+    and move the other ingredients in the `JOIN` to the `WHERE` clause:
+
+    SELECT * FROM documents {{B()}} WHERE {{A()}}
+
+    Modifies `node` in place.
     """
-    if isinstance(node, exp.Join):
-        anon_child_nodes = node.find_all(exp.Anonymous)
-        to_return = []
+    for join_node in list(node.find_all(exp.Join)):
+        other_ingredient_nodes = []
         join_alias: str = ""
-        for anon_child_node in anon_child_nodes:
+        for anon_child_node in join_node.find_all(exp.Anonymous):
             if anon_child_node.name == ingredient_name:
                 join_alias = ingredient_alias
                 continue
@@ -215,18 +218,15 @@ def replace_join_with_ingredient_multiple_ingredient(
             for _ in range(2):
                 _parent = _parent.parent
                 assert isinstance(_parent, exp.Expression)
-            to_return.append(_parent.sql(dialect=FTS5SQLite))
-        if len(to_return) == 0:
-            return node
+            other_ingredient_nodes.append(_parent)
+        if len(other_ingredient_nodes) == 0:
+            continue
         if join_alias == "":
             raise ValueError
-        # temp_uuid is used to ensure a partial query that is parse-able by sqlglot
-        # This gets removed after
-        return _parse_one(
-            f' SELECT "{temp_uuid}", '
-            + join_alias
-            + " WHERE "
-            + " AND ".join(to_return)
+        select_node = join_node.parent
+        join_node.replace(_parse_one(join_alias))
+        select_node.where(
+            exp.and_(*[n.copy() for n in other_ingredient_nodes]), copy=False
         )
     return node
 
@@ -266,3 +266,130 @@ def maybe_set_subqueries_to_true(node):
     if len([i for i in node.find_all(SUBQUERY_EXP + (exp.Paren,))]) == 1:
         return node
     return node.transform(set_subqueries_to_true).transform(prune_empty_where)
+
+
+def substitute_ingredient_outputs(
+    node: exp.Expression,
+    ingredient_outputs: Dict[str, Union[exp.Expression, List[exp.Expression]]],
+) -> exp.Expression:
+    """Replaces each ingredient alias in the tree with the expression its output maps to.
+    Ingredient aliases like `{{A()}}` are parsed as `STRUCT(STRUCT(A()))`.
+
+    A list of expressions (e.g. the `JOIN` clauses from a JoinIngredient) gets spliced
+    into the parent's list of args, in place of the alias.
+
+    Modifies `node` in place.
+
+    Args:
+        node: Root of the query we're substituting into
+        ingredient_outputs: Mapping from ingredient aliasname (e.g. 'A') to its output
+    """
+    for anon_node in list(node.find_all(exp.Anonymous)):
+        if anon_node.name not in ingredient_outputs:
+            continue
+        alias_node = anon_node.parent.parent if anon_node.parent else None
+        if not (
+            isinstance(anon_node.parent, exp.Struct)
+            and isinstance(alias_node, exp.Struct)
+        ):
+            continue
+        output = ingredient_outputs[anon_node.name]
+        if not isinstance(output, list):
+            if alias_node is node:
+                return output.copy()
+            alias_node.replace(output.copy())
+            continue
+        siblings = alias_node.parent.args.get(alias_node.arg_key)
+        idx = next(i for i, sibling in enumerate(siblings) if sibling is alias_node)
+        alias_node.parent.set(
+            alias_node.arg_key,
+            siblings[:idx] + [o.copy() for o in output] + siblings[idx + 1 :],
+        )
+    return node
+
+
+def repoint_tables(
+    node: exp.Expression, tablename_to_new_tablename: Dict[str, str]
+) -> exp.Expression:
+    """Points all references to the given tables (or table aliases) to their new tablename,
+    e.g. a temp session table. Matching is case-insensitive, like SQLite's identifiers.
+
+    Modifies `node` in place.
+    """
+    tablename_to_new_tablename = {
+        k.lower(): v for k, v in tablename_to_new_tablename.items()
+    }
+    for table_node in list(node.find_all(exp.Table)):
+        new_tablename = tablename_to_new_tablename.get(table_node.name.lower())
+        if new_tablename is not None:
+            table_node.set("this", exp.to_identifier(new_tablename, quoted=True))
+        alias_node = table_node.args.get("alias")
+        if alias_node is None:
+            continue
+        new_alias = tablename_to_new_tablename.get(alias_node.name.lower())
+        if new_alias is not None:
+            alias_node.set("this", exp.to_identifier(new_alias, quoted=True))
+    for column_node in list(node.find_all(exp.Column)):
+        new_tablename = tablename_to_new_tablename.get(column_node.table.lower())
+        if new_tablename is not None:
+            column_node.set("table", exp.to_identifier(new_tablename, quoted=True))
+    return node
+
+
+def rewrite_match_predicates(
+    node: exp.Expression,
+    get_predicate: Callable[
+        [exp.Table, exp.Column, exp.Expression], Optional[exp.Expression]
+    ],
+) -> bool:
+    """Replaces each `column MATCH query` predicate with `get_predicate(table, column, query)`,
+    where `table` is the table in the FROM/JOIN clauses of the enclosing SELECT which `column` belongs to.
+    Predicates where `get_predicate()` returns None, or where we can't tell which table
+    the column belongs to, are left as they are.
+
+    Modifies `node` in place.
+
+    Examples:
+        ```python
+        node = _parse_one("SELECT * FROM documents d WHERE d.content MATCH 'sydney'")
+        rewrite_match_predicates(
+            node,
+            lambda table, column, query: _parse_one(f"{column.table}.rowid IN (SELECT rowid FROM fts WHERE fts MATCH {query.sql()})"),
+        )
+        node.sql(dialect=FTS5SQLite)
+        ```
+        ```text
+        SELECT * FROM documents AS d WHERE d.rowid IN (SELECT rowid FROM fts WHERE fts MATCH 'sydney')
+        ```
+
+    Returns:
+        True if any predicate was replaced
+    """
+    rewritten = False
+    # Collect them upfront, so we don't revisit any MATCH predicates `get_predicate()` creates
+    for match_node in list(node.find_all(exp.Glob)):
+        column_node = match_node.this
+        if not isinstance(column_node, exp.Column):
+            continue
+        select_node = match_node.find_ancestor(exp.Select)
+        if select_node is None or select_node.args.get("from") is None:
+            continue
+        table_nodes = [
+            n
+            for n in [select_node.args["from"].this]
+            + [join.this for join in select_node.args.get("joins") or []]
+            if isinstance(n, exp.Table)
+        ]
+        if column_node.table:
+            table_nodes = [
+                n
+                for n in table_nodes
+                if n.alias_or_name.lower() == column_node.table.lower()
+            ]
+        if len(table_nodes) != 1:
+            continue
+        predicate = get_predicate(table_nodes[0], column_node, match_node.expression)
+        if predicate is not None:
+            match_node.replace(predicate)
+            rewritten = True
+    return rewritten
@@ -4,7 +4,7 @@ from attr import attrs, attrib
 from typing import List, Iterable, Type, Set
 
 from ..ingredients import Ingredient
-from ..grammars._peg_grammar import grammar as peg_grammar
+from ..grammars._scanner import scan_ingredients
 
 
 @attrs
@@ -60,7 +60,7 @@ class Examples:
         """
         stack = [query]
         while len(stack) > 0:
-            for res, _start, _end in peg_grammar.scanString(stack.pop()):
+            for res, _start, _end in scan_ingredients(stack.pop()):
                 if res.get("function").upper() not in ingredient_names:
                     return False
                 for arg in res.get("args"):
@@ -1,7 +1,11 @@
 import uuid
+import time
+import asyncio
+import fnmatch
+import pytest
 from dataclasses import dataclass
 
-from blendsql.models import Model
+from blendsql.models import Model, MemoryCache, DiskCache, SQLiteCache, RedisCache
 from blendsql._program import Program
 
 TEST_QUESTION = "The quick brown fox jumps over the lazy dog"
@@ -50,6 +54,17 @@ class DifferentDummyProgram(Program):
         return (DummyModelOutput({"uuid": str(uuid.uuid4())}), None)
 
 
+class AsyncDummyProgram(Program):
+    def __new__(
+        self,
+        **kwargs,
+    ):
+        return self.__call__(self, **kwargs)
+
+    async def __call__(self, question: str, **kwargs):
+        return (DummyModelOutput({"uuid": str(uuid.uuid4())}), None)
+
+
 class DummyProgramWithGlobal(Program):
     def __new__(
         self,
@@ -62,6 +77,33 @@ class DummyProgramWithGlobal(Program):
         return (DummyModelOutput({"uuid": str(uuid.uuid4())}), None)
 
 
+class LocalRedisClient:
+    """Stand-in for `redis.Redis`, implementing the subset of commands used by `RedisCache`."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        value, expires_at = self.data.get(key, (None, None))
+        if expires_at is not None and expires_at <= time.time():
+            self.data.pop(key)
+            return None
+        return value
+
+    def set(self, key, value, px=None):
+        self.data[key] = (value, time.time() + px / 1000 if px is not None else None)
+
+    def exists(self, key):
+        return int(self.get(key) is not None)
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    def scan_iter(self, match="*"):
+        return [key for key in list(self.data) if fnmatch.fnmatch(key, match)]
+
+
 def test_simple_cache():
     a = DummyModel(MODEL_A).predict(program=DummyProgram, question=TEST_QUESTION)
 
@@ -140,3 +182,89 @@ def test_with_set_vars():
     )
 
     assert a == b
+
+
+def test_apredict_uses_same_cache():
+    a = DummyModel(MODEL_A).predict(program=DummyProgram, question=TEST_QUESTION)
+
+    model_b = DummyModel(MODEL_A)
+    b = asyncio.run(model_b.apredict(program=DummyProgram, question=TEST_QUESTION))
+
+    assert a == b
+    assert model_b.num_calls == 0
+
+
+def test_apredict_async_program():
+    model = DummyModel(MODEL_A, caching=False)
+
+    async def run_many():
+        return await asyncio.gather(
+            *[
+                model.apredict(program=AsyncDummyProgram, question=TEST_QUESTION)
+                for _ in range(3)
+            ]
+        )
+
+    results = asyncio.run(run_many())
+    assert len(set(r._variables["uuid"] for r in results)) == 3
+    assert model.num_calls == 3
+
+
+@pytest.fixture(params=["memory", "disk", "sqlite", "redis"])
+def make_cache(request, tmp_path):
+    def _make_cache(**kwargs):
+        if request.param == "memory":
+            return MemoryCache(**kwargs)
+        elif request.param == "disk":
+            return DiskCache(tmp_path / "diskcache", **kwargs)
+        elif request.param == "sqlite":
+            return SQLiteCache(tmp_path / "cache.db", **kwargs)
+        return RedisCache(client=LocalRedisClient(), **kwargs)
+
+    return _make_cache
+
+
+def test_cache_backends(make_cache):
+    cache = make_cache()
+    a = DummyModel(MODEL_A, cache=cache).predict(
+        program=DummyProgram, question=TEST_QUESTION
+    )
+
+    model_b = DummyModel(MODEL_A, cache=cache)
+    b = model_b.predict(program=DummyProgram, question=TEST_QUESTION)
+
+    assert a == b
+    assert model_b.num_calls == 0
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_cache_ttl(make_cache):
+    cache = make_cache(ttl=0.05)
+    cache["a"] = 1
+    assert cache.get("a") == 1
+    time.sleep(0.1)
+    assert "a" not in cache
+    assert cache.get("a") is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+@pytest.mark.parametrize(
+    "cache_factory",
+    [
+        lambda _: MemoryCache(max_size=2),
+        lambda tmp_path: SQLiteCache(tmp_path / "cache.db", max_size=2),
+    ],
+)
+def test_cache_lru_eviction(cache_factory, tmp_path):
+    cache = cache_factory(tmp_path)
+    cache["a"] = 1
+    cache["b"] = 2
+    # Accessing 'a' makes 'b' the least recently used
+    assert cache.get("a") == 1
+    cache["c"] = 3
+    assert "a" in cache and "c" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
@@ -0,0 +1,215 @@
+import pytest
+
+from blendsql.models import TransformersLLM
+from blendsql.models.local import _transformers
+from blendsql.models.local._prefix_cache import (
+    PrefixKVCache,
+    MIN_PREFIX_TOKENS,
+    _common_prefix_length,
+)
+
+NUM_LAYERS = 2
+
+SHARED = list(range(100, 100 + MIN_PREFIX_TOKENS + 4))
+
+
+class DummyTensor:
+    """Stands in for a `torch.Tensor` of shape (..., seq_len, head_dim),
+    holding the token id at each position so we can check what was sliced.
+    """
+
+    def __init__(self, token_ids):
+        self.token_ids = list(token_ids)
+
+    def __getitem__(self, key):
+        _, positions, _ = key
+        return DummyTensor(self.token_ids[positions])
+
+    def clone(self):
+        return DummyTensor(self.token_ids)
+
+    def element_size(self):
+        return 1
+
+    def nelement(self):
+        return len(self.token_ids)
+
+
+def dummy_past_key_values(token_ids) -> tuple:
+    return tuple(
+        (DummyTensor(token_ids), DummyTensor(token_ids)) for _ in range(NUM_LAYERS)
+    )
+
+
+def cached_token_ids(past_key_values) -> list:
+    token_ids = past_key_values[0][0].token_ids
+    assert all(t.token_ids == token_ids for layer in past_key_values for t in layer)
+    return token_ids
+
+
+def num_bytes(token_ids) -> int:
+    return 2 * NUM_LAYERS * len(token_ids)
+
+
+def observe(cache: PrefixKVCache, token_ids):
+    cache.observe(token_ids, dummy_past_key_values(token_ids))
+
+
+class DummyEngine:
+    """Mimics the cache handling of guidance's `TransformersEngine.get_logits`."""
+
+    def __init__(self):
+        self._cached_token_ids = []
+        self._past_key_values = None
+        self.num_encoded = []
+
+    def get_logits(self, token_ids, forced_bytes, current_temp):
+        if self._past_key_values is not None:
+            assert cached_token_ids(self._past_key_values) == self._cached_token_ids
+        num_cached = _common_prefix_length(self._cached_token_ids, token_ids)
+        num_cached = min(num_cached, len(token_ids) - 1)
+        self.num_encoded.append(len(token_ids) - num_cached)
+        self._cached_token_ids = list(token_ids)
+        self._past_key_values = dummy_past_key_values(token_ids)
+        return f"logits for {token_ids}"
+
+
+@pytest.fixture
+def model() -> TransformersLLM:
+    # Don't load anything, we only need the prefix cache
+    model = TransformersLLM.__new__(TransformersLLM)
+    model.prefix_cache = PrefixKVCache(max_bytes=1024)
+    return model
+
+
+def test_common_prefix_length():
+    assert _common_prefix_length([1, 2, 3], [1, 2, 3]) == 3
+    assert _common_prefix_length([1, 2, 3], [1, 2]) == 2
+    assert _common_prefix_length([1, 2, 3], [1, 4, 3]) == 1
+    assert _common_prefix_length([], [1]) == 0
+
+
+def test_observe_caches_shared_prefix():
+    cache = PrefixKVCache(max_bytes=1024)
+    observe(cache, SHARED + [1, 2, 3])
+    # Nothing to compare the first prompt to
+    assert len(cache) == 0
+    observe(cache, SHARED + [4, 5])
+    assert len(cache) == 1
+    assert cache.num_bytes == num_bytes(SHARED)
+    # Seeing the same prefix again doesn't add a new entry
+    observe(cache, SHARED + [6])
+    assert len(cache) == 1
+
+    hit = cache.lookup(SHARED + [7, 8])
+    assert hit is not None
+    length, past_key_values = hit
+    assert length == len(SHARED)
+    assert cached_token_ids(past_key_values) == SHARED
+    assert (cache.stats.hits, cache.stats.misses) == (1, 0)
+
+
+def test_short_prefix_not_cached():
+    cache = PrefixKVCache(max_bytes=1024)
+    short = SHARED[: MIN_PREFIX_TOKENS - 1]
+    observe(cache, short + [1, 2])
+    observe(cache, short + [3, 4])
+    assert len(cache) == 0
+    assert cache.lookup(short + [1, 2]) is None
+    assert (cache.stats.hits, cache.stats.misses) == (0, 1)
+
+
+def test_lookup_longest_prefix():
+    cache = PrefixKVCache(max_bytes=1024)
+    longer = SHARED + [1, 2, 3]
+    cache.insert(SHARED, dummy_past_key_values(SHARED))
+    cache.insert(longer, dummy_past_key_values(longer))
+    length, past_key_values = cache.lookup(longer + [4])
+    assert length == len(longer)
+    assert cached_token_ids(past_key_values) == longer
+    # Only part of an entry may match
+    length, past_key_values = cache.lookup(SHARED + [1, 5])
+    assert length == len(SHARED) + 1
+    assert cached_token_ids(past_key_values) == SHARED + [1]
+
+
+def test_lookup_max_length():
+    cache = PrefixKVCache(max_bytes=1024)
+    cache.insert(SHARED, dummy_past_key_values(SHARED))
+    # The whole prompt is cached, but we need to leave a token to compute logits from
+    length, past_key_values = cache.lookup(SHARED, max_length=len(SHARED) - 1)
+    assert length == len(SHARED) - 1
+    assert cached_token_ids(past_key_values) == SHARED[:-1]
+    assert cache.lookup(SHARED, max_length=MIN_PREFIX_TOKENS - 1) is None
+
+
+def test_evicts_least_recently_used():
+    a, b, c = ([i] + SHARED for i in range(3))
+    cache = PrefixKVCache(max_bytes=2 * num_bytes(a))
+    cache.insert(a, dummy_past_key_values(a))
+    cache.insert(b, dummy_past_key_values(b))
+    # Using `a` makes `b` the least recently used entry
+    assert cache.lookup(a) is not None
+    cache.insert(c, dummy_past_key_values(c))
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
+    assert cache.num_bytes == 2 * num_bytes(a)
+    assert cache.lookup(b) is None
+    assert cache.lookup(a)[0] == len(a)
+    assert cache.lookup(c)[0] == len(c)
+
+
+def test_skips_entries_over_budget():
+    cache = PrefixKVCache(max_bytes=num_bytes(SHARED) - 1)
+    cache.insert(SHARED, dummy_past_key_values(SHARED))
+    assert len(cache) == 0
+    assert cache.num_bytes == 0
+
+
+def test_disabled_cache():
+    cache = PrefixKVCache(max_bytes=0)
+    observe(cache, SHARED + [1])
+    observe(cache, SHARED + [2])
+    assert len(cache) == 0
+    assert cache.lookup(SHARED + [3]) is None
+
+
+def test_clear():
+    cache = PrefixKVCache(max_bytes=1024)
+    cache.insert(SHARED, dummy_past_key_values(SHARED))
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.num_bytes == 0
+    assert cache.lookup(SHARED) is None
+
+
+def test_attach_prefix_cache_reuses_shared_prefix(model):
+    engine = DummyEngine()
+    assert model._attach_prefix_cache(engine)
+    other = list(range(500, 530))
+    prompts = [SHARED + [1, 2, 3], SHARED + [4, 5, 6], other, SHARED + [7, 8, 9]]
+    outputs = [engine.get_logits(prompt, b"", 0.0) for prompt in prompts]
+    # The second prompt is compared against the first to discover the shared prefix,
+    #   so after switching to an unrelated prompt, the last one starts from its cached KV
+    assert model.prefix_cache.stats.hits == 1
+    assert engine.num_encoded == [len(SHARED) + 3, 3, len(other), 3]
+    # Continuing the current sequence goes straight to the engine
+    engine.get_logits(prompts[-1] + [1], b"", 0.0)
+    assert engine.num_encoded[-1] == 1
+    assert model.prefix_cache.stats.hits == 1
+    # The output is the same as that of a cold engine
+    assert outputs == [DummyEngine().get_logits(prompt, b"", 0.0) for prompt in prompts]
+
+
+def test_attach_prefix_cache_unsupported_engine(model, monkeypatch):
+    engine = DummyEngine()
+    get_logits = engine.get_logits
+    del engine._past_key_values
+    assert not model._attach_prefix_cache(engine)
+    assert engine.get_logits == get_logits
+
+    engine = DummyEngine()
+    get_logits = engine.get_logits
+    monkeypatch.setattr(_transformers, "PREFIX_CACHE_GUIDANCE_VERSIONS", set())
+    assert not model._attach_prefix_cache(engine)
+    assert engine.get_logits == get_logits
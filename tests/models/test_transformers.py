@@ -1,3 +1,4 @@
+import re
 import pytest
 
 from blendsql import blend, LLMQA, LLMMap, LLMJoin
@@ -132,3 +133,107 @@ def test_unconstrained_llmqa(db, model, ingredients):
         ingredients=ingredients,
     )
     assert isinstance(res, Smoothie)
+
+
+@pytest.fixture(scope="session")
+def batch_model() -> TransformersLLM:
+    return TransformersLLM(TEST_TRANSFORMERS_LLM, caching=False, batch_map=True)
+
+
+@pytest.mark.long
+@pytest.mark.parametrize(
+    "ingredient_args",
+    [
+        "",
+        ", options='t;f'",
+        ", regex='[0-9]+'",
+    ],
+)
+def test_batch_llmmap_matches_per_value(db, batch_model, ingredient_args):
+    query = f"""
+    SELECT rival, {{{{
+        LLMMap(
+            'Number of players on the team?',
+            'w::rival'{ingredient_args}
+        )
+    }}}} AS answer FROM w ORDER BY rival
+    """
+    batched = blend(
+        query=query,
+        db=db,
+        default_model=batch_model,
+        ingredients={LLMMap},
+    )
+    per_value = blend(
+        query=query,
+        db=db,
+        default_model=batch_model,
+        ingredients={LLMMap.from_args(batch_size=1)},
+    )
+    assert batched.df.equals(per_value.df)
+
+
+@pytest.mark.long
+@pytest.mark.parametrize(
+    "options,regex",
+    [
+        (["t", "f", "-"], None),
+        (["nsw waratahs", "bathurst", "sydney clubs"], None),
+        (None, r"[0-9]+"),
+        (None, r"(yes|no)"),
+    ],
+)
+def test_batch_complete_constrained(batch_model, options, regex):
+    continuations = [f"\n{value} ->" for value in ["11-0", "33-0", "12-3", "40-2"]]
+    kwargs = dict(
+        system_prompt="Given a set of values from a database, answer the question row-by-row, in order.",
+        user_prompt="Q: Did the home team win?\nA:\n",
+        options=options,
+        regex=regex,
+        max_tokens=5,
+    )
+    batched = batch_model.batch_complete(continuations=continuations, **kwargs)
+    assert len(batched) == len(continuations)
+    # Each continuation is answered independently of the others in its batch
+    assert batched == [
+        batch_model.batch_complete(continuations=[continuation], **kwargs)[0]
+        for continuation in continuations
+    ]
+    if options is not None:
+        assert all(answer in options for answer in batched)
+    else:
+        assert all(re.fullmatch(regex, answer) for answer in batched)
+
+
+@pytest.mark.long
+def test_prefix_cache_matches_cold_model(db, model):
+    cold_model = TransformersLLM(
+        TEST_TRANSFORMERS_LLM, caching=False, prefix_cache_max_bytes=0
+    )
+    model.prefix_cache.clear()
+    hits = model.prefix_cache.stats.hits
+    # The first two questions let the cache discover their shared prefix,
+    #   which the third question then starts from
+    for question in [
+        "Direction of district?",
+        "Is this a city?",
+        "Number of words?",
+    ]:
+        query = f"""
+        SELECT rival, {{{{LLMMap('{question}', 'w::rival')}}}} AS answer
+          FROM w ORDER BY rival
+        """
+        res = blend(
+            query=query,
+            db=db,
+            default_model=model,
+            ingredients={LLMMap},
+        )
+        cold_res = blend(
+            query=query,
+            db=db,
+            default_model=cold_model,
+            ingredients={LLMMap},
+        )
+        assert res.df.equals(cold_res.df)
+    assert model.prefix_cache.stats.hits > hits
@@ -0,0 +1,408 @@
+import sqlite3
+import threading
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from unittest import mock
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from blendsql import blend, blend_iter
+from blendsql.db import SQLite, DuckDB, PostgreSQL
+from blendsql.db.utils import has_pyarrow
+from blendsql.blend import expand_star_without_duplicates
+from blendsql.ingredients import MapIngredient
+from tests.utils import starts_with
+
+
+class slow_starts_with(MapIngredient):
+    """`starts_with`, but slow enough that concurrent queries overlap."""
+
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def run(self, question: str, values: List[str], **kwargs) -> List[bool]:
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(0.1)
+        with cls.lock:
+            cls.in_flight -= 1
+        return [bool(value.startswith(question)) for value in values]
+
+
+@pytest.fixture
+def sqlite_db(tmp_path) -> SQLite:
+    db_path = tmp_path / "test.db"
+    con = sqlite3.connect(db_path)
+    con.execute("CREATE TABLE w (name TEXT, age INTEGER)")
+    con.executemany(
+        "INSERT INTO w VALUES (?, ?)", [("Danny", 23), ("Emma", 26), ("Tony", 19)]
+    )
+    con.execute("CREATE TABLE v (name TEXT, city TEXT)")
+    con.executemany(
+        "INSERT INTO v VALUES (?, ?)", [("Danny", "Paris"), ("Emma", "Rome")]
+    )
+    con.commit()
+    con.close()
+    return SQLite(db_path)
+
+
+@pytest.fixture
+def duckdb_db() -> DuckDB:
+    return DuckDB.from_pandas(
+        pd.DataFrame({"name": ["Danny", "Emma", "Tony"], "age": [23, 26, 19]}),
+        tablename="w",
+    )
+
+
+def test_sqlite_to_temp_table_matches_to_sql(sqlite_db):
+    df = pd.DataFrame(
+        {
+            "i": [1, None, 3],
+            "f": [1.5, np.nan, 0.0],
+            "s": ["a", None, "c'd"],
+            "d": pd.to_datetime(["2020-01-01 00:00:00", None, "2021-02-03 04:05:06"]),
+            "b": [True, False, True],
+            "n": pd.array([1, None, 2], dtype="Int64"),
+        }
+    )
+    sqlite_db.to_temp_table(df=df, tablename="bulk")
+    df.to_sql(name="reference", con=sqlite_db.con, index=False)
+    assert sqlite_db.execute_to_list(
+        'SELECT COUNT(*) FROM (SELECT * FROM "bulk" EXCEPT SELECT * FROM "reference")'
+    ) == [0]
+    # Writing to the same tablename again should replace the table
+    sqlite_db.to_temp_table(df=df.iloc[:1], tablename="bulk")
+    assert sqlite_db.execute_to_list('SELECT COUNT(*) FROM "bulk"') == [1]
+
+
+def test_postgres_insert_df_copy():
+    # No server needed, since we only talk to the DBAPI cursor
+    db = PostgreSQL.__new__(PostgreSQL)
+    db.con = mock.MagicMock()
+    cursor = db.con.connection.cursor.return_value
+    copied = {}
+
+    def copy_expert(sql, file):
+        copied["sql"] = sql
+        copied["csv"] = file.read()
+
+    cursor.copy_expert.side_effect = copy_expert
+    df = pd.DataFrame(
+        {
+            "i": pd.array([1, None], dtype="Int64"),
+            "f": [1.5, np.nan],
+            "s": ['a, "b"', None],
+        }
+    )
+    db._insert_df(df, 'my "big" table')
+    assert (
+        copied["sql"]
+        == r"""COPY "my ""big"" table" FROM STDIN WITH (FORMAT csv, NULL '\N')"""
+    )
+    # Missing values are written as the NULL marker, and strings are CSV-quoted
+    assert copied["csv"].splitlines() == ['1,1.5,"a, ""b"""', r"\N,\N,\N"]
+    cursor.close.assert_called_once()
+    # The cursor is closed even if the COPY fails
+    cursor.reset_mock()
+    cursor.copy_expert.side_effect = RuntimeError("COPY failed")
+    with pytest.raises(RuntimeError):
+        db._insert_df(df, "t")
+    cursor.close.assert_called_once()
+    # Nothing to copy without any columns
+    cursor.reset_mock()
+    db._insert_df(pd.DataFrame(index=range(2)), "t")
+    cursor.copy_expert.assert_not_called()
+
+
+def test_postgres_query_to_temp_table_savepoint():
+    db = PostgreSQL.__new__(PostgreSQL)
+    db._con_lock = threading.RLock()
+    db.con = mock.MagicMock()
+    savepoint = db.con.begin_nested.return_value
+    savepoint.__exit__.return_value = False
+
+    def execute(statement, *args):
+        if str(statement).startswith("CREATE TEMP TABLE"):
+            raise RuntimeError("CREATE TEMP TABLE failed")
+        return mock.MagicMock()
+
+    db.con.execute.side_effect = execute
+    with pytest.raises(RuntimeError):
+        db.query_to_temp_table("SELECT 1", tablename="t")
+    # The failed statement is rolled back to a savepoint, not the start of the transaction
+    savepoint.__enter__.assert_called_once()
+    assert savepoint.__exit__.call_args.args[0] is RuntimeError
+    db.con.rollback.assert_not_called()
+
+
+@pytest.mark.parametrize("db_fixture", ["sqlite_db", "duckdb_db"])
+def test_query_to_temp_table(db_fixture, request):
+    db = request.getfixturevalue(db_fixture)
+    db.query_to_temp_table(query="SELECT * FROM w WHERE age > 20", tablename="older")
+    assert db.has_temp_table("older")
+    assert sorted(db.execute_to_list('SELECT name FROM "older"')) == ["Danny", "Emma"]
+    db.query_to_temp_table(query="SELECT * FROM w WHERE age > 25", tablename="older")
+    assert db.execute_to_list('SELECT name FROM "older"') == ["Emma"]
+
+
+def test_expand_star_without_duplicates(sqlite_db):
+    query = expand_star_without_duplicates(
+        "SELECT * FROM w JOIN v AS x ON w.name = x.name WHERE w.age > 20", db=sqlite_db
+    )
+    sqlite_db.query_to_temp_table(query=query, tablename="joined")
+    df = sqlite_db.execute_to_df('SELECT * FROM "joined"')
+    assert df.columns.tolist() == ["name", "age", "city"]
+    assert sorted(df["city"].tolist()) == ["Paris", "Rome"]
+    # Only plain `SELECT *` queries over tables get rewritten
+    assert expand_star_without_duplicates("SELECT name FROM w", db=sqlite_db) is None
+    assert (
+        expand_star_without_duplicates("SELECT * FROM not_a_table", db=sqlite_db)
+        is None
+    )
+
+
+@pytest.mark.parametrize("db_fixture", ["sqlite_db", "duckdb_db"])
+def test_merge_into_temp_table(db_fixture, request):
+    db = request.getfixturevalue(db_fixture)
+    db.query_to_temp_table(
+        query="SELECT name, age FROM w UNION ALL SELECT NULL, 40", tablename="merged"
+    )
+    db.merge_into_temp_table(
+        df=pd.DataFrame({"name": ["Danny", None], "q": [1, 2]}),
+        tablename="merged",
+        on="name",
+    )
+    # A second merge only fills in values, and keeps those we already had
+    db.merge_into_temp_table(
+        df=pd.DataFrame({"name": ["Emma", "Danny"], "q": [3, None]}),
+        tablename="merged",
+        on="name",
+    )
+    df = db.execute_to_df('SELECT age, q FROM "merged" ORDER BY age')
+    assert df["age"].tolist() == [19, 23, 26, 40]
+    assert [None if pd.isna(x) else x for x in df["q"]] == [None, 1, 3, 2]
+    assert not db.has_temp_table("merged_merge")
+
+
+@pytest.mark.parametrize("db_fixture", ["sqlite_db", "duckdb_db"])
+def test_iter_df(db_fixture, request):
+    db = request.getfixturevalue(db_fixture)
+    chunks = list(db.iter_df("SELECT * FROM w ORDER BY age", chunksize=2))
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True),
+        db.execute_to_df("SELECT * FROM w ORDER BY age"),
+    )
+    # Empty results still give us the columns
+    (chunk,) = db.iter_df("SELECT * FROM w WHERE age > 100", chunksize=2)
+    assert chunk.empty and chunk.columns.tolist() == ["name", "age"]
+
+
+@pytest.mark.parametrize("db_fixture", ["sqlite_db", "duckdb_db"])
+def test_blend_iter(db_fixture, request):
+    db = request.getfixturevalue(db_fixture)
+    query = "SELECT name FROM w WHERE {{starts_with('T', 'w::name')}} OR age > 24 ORDER BY name"
+    smoothie = blend(query=query, db=db, ingredients={starts_with})
+    stream = blend_iter(query=query, db=db, ingredients={starts_with}, trace=True)
+    assert stream.meta is None
+    chunks = list(stream)
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True), pd.DataFrame(smoothie.df)
+    )
+    assert stream.meta.num_values_passed == smoothie.meta.num_values_passed
+    assert stream.meta.process_time_seconds > 0
+    assert "final_query" in stream.meta.trace.seconds_by_name()
+    # Closing a stream early still releases the database
+    with blend_iter(query=query, db=db, ingredients={starts_with}) as stream:
+        next(iter(stream))
+    assert blend(query="SELECT COUNT(*) FROM w", db=db).df.iloc[0, 0] == 3
+    # A partly consumed stream doesn't hold the database,
+    #   and can be resumed from another thread
+    stream = blend_iter(query=query, db=db, ingredients={starts_with}, chunksize=1)
+    chunks = [next(iter(stream))]
+    results = {}
+
+    def run_in_thread():
+        results["count"] = blend(query="SELECT COUNT(*) FROM w", db=db).df.iloc[0, 0]
+        chunks.extend(stream)
+
+    # Daemon, so a regression fails the test instead of hanging it
+    thread = threading.Thread(target=run_in_thread, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert results["count"] == 3
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True), pd.DataFrame(smoothie.df)
+    )
+
+
+@pytest.mark.skipif(not has_pyarrow(), reason="pyarrow is not available")
+def test_duckdb_arrow(duckdb_db):
+    import pyarrow as pa
+
+    table = duckdb_db.execute_to_arrow("SELECT * FROM w ORDER BY age")
+    assert isinstance(table, pa.Table)
+    assert table.column("name").to_pylist() == ["Tony", "Danny", "Emma"]
+    # Arrow tables are registered as temp tables without copying
+    duckdb_db.to_temp_table(df=table.slice(0, 2), tablename="arrow_w")
+    assert duckdb_db.has_temp_table("arrow_w")
+    assert duckdb_db.execute_to_list('SELECT name FROM "arrow_w"') == ["Tony", "Danny"]
+    duckdb_db._reset_connection()
+    assert not duckdb_db.has_temp_table("arrow_w")
+    smoothie = blend(
+        query="SELECT name FROM w WHERE {{starts_with('T', 'w::name')}}",
+        db=duckdb_db,
+        ingredients={starts_with},
+        to_arrow=True,
+    )
+    assert smoothie.df is None
+    assert smoothie.arrow.column("name").to_pylist() == ["Tony"]
+
+
+@pytest.mark.parametrize("db_fixture", ["sqlite_db", "duckdb_db"])
+def test_pooled_concurrent_blend(db_fixture, request):
+    db = request.getfixturevalue(db_fixture)
+    db.pooled = True
+    slow_starts_with.max_in_flight = 0
+    prefixes = ["D", "E", "T", "X"]
+
+    def run(prefix: str) -> list:
+        return (
+            blend(
+                query=f"SELECT name FROM w WHERE {{{{slow_starts_with('{prefix}', 'w::name')}}}}",
+                db=db,
+                ingredients={slow_starts_with},
+            )
+            .df["name"]
+            .tolist()
+        )
+
+    with ThreadPoolExecutor(max_workers=len(prefixes)) as executor:
+        results = list(executor.map(run, prefixes))
+    assert results == [["Danny"], ["Emma"], ["Tony"], []]
+    # Each query had its own session, so they didn't need to take turns
+    assert slow_starts_with.max_in_flight > 1
+    # Sessions clean up their temp tables
+    with db.session() as session_db:
+        session_db.to_temp_table(df=pd.DataFrame({"a": [1]}), tablename="scratch")
+        assert session_db.has_temp_table("scratch")
+        assert not db.has_temp_table("scratch")
+    with db.session() as session_db:
+        assert not session_db.has_temp_table("scratch")
+    # Nor do they share lazy tables, with each other or with the Database
+    with db.session() as session_db, db.session() as other_session_db:
+        assert session_db.lazy_tables is not other_session_db.lazy_tables
+        assert session_db.lazy_tables is not db.lazy_tables
+
+
+def test_schema_catalog(sqlite_db, tmp_path):
+    assert sqlite_db.tables() == ["v", "w"]
+    assert list(sqlite_db.iter_columns("w")) == ["name", "age"]
+    assert sqlite_db.sqlglot_schema['"w"'] == {'"name"': "TEXT", '"age"': "INTEGER"}
+    # Temp tables don't touch the catalog
+    columns = sqlite_db.catalog.columns
+    sqlite_db.query_to_temp_table("SELECT * FROM w", tablename="w_copy")
+    sqlite_db.merge_into_temp_table(
+        df=pd.DataFrame({"name": ["Danny"], "q": [1]}), tablename="w_copy", on="name"
+    )
+    assert sqlite_db.catalog.columns is columns
+    # But DDL on our own tables does
+    sqlite_db.con.execute(text('ALTER TABLE "w" ADD COLUMN "height" REAL'))
+    sqlite_db.con.commit()
+    assert list(sqlite_db.iter_columns("w")) == ["name", "age", "height"]
+    assert '"height"' in sqlite_db.sqlglot_schema['"w"']
+    # Changes from outside our engine need an explicit invalidation
+    con = sqlite3.connect(tmp_path / "test.db")
+    con.execute("CREATE TABLE u (x INTEGER)")
+    con.commit()
+    con.close()
+    assert "u" not in sqlite_db.tables()
+    sqlite_db.catalog.invalidate()
+    assert sqlite_db.tables() == ["u", "v", "w"]
+
+
+def test_duckdb_schema_catalog(duckdb_db):
+    duckdb_db.query_to_temp_table("SELECT * FROM w", tablename="w_copy")
+    assert duckdb_db.tables() == ["w"]
+    assert list(duckdb_db.iter_columns("w_copy")) == ["name", "age"]
+    assert duckdb_db.sqlglot_schema == {'"w"': {'"name"': "VARCHAR", '"age"': "BIGINT"}}
+    assert (
+        duckdb_db.schema_string()
+        == 'CREATE TABLE "w" (\n\t"name" VARCHAR, \n\t"age" BIGINT\n)'
+    )
+    serialized = duckdb_db.to_serialized(num_rows=2)
+    assert serialized.startswith(duckdb_db.schema_string())
+    assert "2 example rows:" in serialized
+    duckdb_db.execute_to_list("CREATE TABLE v AS SELECT 'Boston' AS city")
+    assert duckdb_db.tables() == ["v", "w"]
+
+
+def test_sqlite_index_temp_table(sqlite_db):
+    def temp_indexes(tablename: str) -> List[str]:
+        return sqlite_db.execute_to_list(
+            f"SELECT name FROM sqlite_temp_master WHERE type = 'index' AND tbl_name = '{tablename}'"
+        )
+
+    sqlite_db.temp_table_index_min_rows = 10
+    sqlite_db.to_temp_table(pd.DataFrame({"left": ["a"], "right": ["b"]}), "small")
+    sqlite_db.index_temp_table("small", ["left", "right"])
+    # Too small to be worth indexing
+    assert temp_indexes("small") == []
+    sqlite_db.query_to_temp_table(
+        "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 100) SELECT x AS name FROM n",
+        tablename="large",
+    )
+    sqlite_db.merge_into_temp_table(
+        df=pd.DataFrame({"name": [1, 2], "q": [True, False]}),
+        tablename="large",
+        on="name",
+    )
+    (index_name,) = temp_indexes("large")
+    plan = " ".join(
+        str(row)
+        for row in sqlite_db.con.execute(
+            text('EXPLAIN QUERY PLAN SELECT * FROM "large" WHERE name = 1')
+        ).fetchall()
+    )
+    assert index_name in plan
+    # Indexing the same column again is a no-op
+    sqlite_db.index_temp_table("large", ["name"])
+    assert temp_indexes("large") == [index_name]
+
+
+def test_sqlite_fts_match(sqlite_db):
+    def match(query: str) -> List[str]:
+        return sqlite_db.execute_to_list(
+            f"SELECT name FROM v WHERE city MATCH '{query}' ORDER BY name"
+        )
+
+    assert not sqlite_db.fts_path.exists()
+    assert match("paris") == ["Danny"]
+    # The index is kept next to the database
+    assert sqlite_db.fts_path.exists()
+    smoothie = blend(
+        query="""
+        SELECT name FROM w
+        WHERE name IN (SELECT v.name FROM v WHERE v.city MATCH 'rome OR paris')
+        AND {{starts_with('E', 'w::name')}}
+        """,
+        db=sqlite_db,
+        ingredients={starts_with},
+    )
+    assert smoothie.df["name"].tolist() == ["Emma"]
+    # New rows are picked up, by rebuilding the index
+    sqlite_db.con.execute(text("INSERT INTO v VALUES ('Ruth', 'Rome')"))
+    assert match("rome") == ["Emma", "Ruth"]
+    sqlite_db.con.commit()
+    # Another connection to the same database reuses the index we built
+    mtime = sqlite_db.fts_path.stat().st_mtime_ns
+    assert SQLite(sqlite_db.db_url.database).execute_to_list(
+        "SELECT name FROM v WHERE city MATCH 'rome' ORDER BY name"
+    ) == ["Emma", "Ruth"]
+    assert sqlite_db.fts_path.stat().st_mtime_ns == mtime
@@ -1,9 +1,11 @@
 import pytest
+import asyncio
 import pandas as pd
-from blendsql import blend
+from blendsql import blend, ablend
 from blendsql.db import Pandas
 from blendsql._exceptions import IngredientException, InvalidBlendSQL
-from tests.utils import select_first_option
+from blendsql._plan_cache import plan_cache
+from tests.utils import select_first_option, starts_with
 
 
 @pytest.fixture(scope="session")
@@ -68,3 +70,78 @@ def test_error_on_bad_options_subquery(db):
             db=db,
             ingredients={select_first_option},
         )
+
+
+def test_ablend_matches_blend(db):
+    blendsql = """
+    SELECT * FROM w WHERE {{starts_with('T', 'w::Name')}} = 1
+    """
+    smoothie = blend(query=blendsql, db=db, ingredients={starts_with})
+
+    async def run_many():
+        return await asyncio.gather(
+            *[
+                ablend(query=blendsql, db=db, ingredients={starts_with})
+                for _ in range(4)
+            ]
+        )
+
+    for async_smoothie in asyncio.run(run_many()):
+        pd.testing.assert_frame_equal(async_smoothie.df, smoothie.df)
+        assert async_smoothie.meta.num_values_passed == smoothie.meta.num_values_passed
+
+
+def test_plan_cache(db):
+    plan_cache.clear()
+    blendsql = """
+    SELECT * FROM w WHERE {{starts_with('T', 'w::Name')}} = 1
+    """
+    hits = plan_cache.stats.hits
+    smoothie = blend(query=blendsql, db=db, ingredients={starts_with})
+    assert (plan_cache.stats.hits, len(plan_cache)) == (hits, 1)
+    # Differences in whitespace don't matter
+    cached_smoothie = blend(
+        query=" ".join(blendsql.split()), db=db, ingredients={starts_with}
+    )
+    assert plan_cache.stats.hits == hits + 1
+    pd.testing.assert_frame_equal(cached_smoothie.df, smoothie.df)
+    # But the available ingredients do
+    _ = blend(query=blendsql, db=db, ingredients={starts_with, select_first_option})
+    assert (plan_cache.stats.hits, len(plan_cache)) == (hits + 1, 2)
+
+
+def test_plan_cache_skipped_without_ingredients():
+    db = Pandas(pd.DataFrame({"Name": ["Danny", "Emma"]}), tablename="w")
+    plan_cache.clear()
+    # Plain SQL never looks at the schema, or the plan cache
+    _ = blend(query="SELECT * FROM w", db=db, ingredients=set())
+    assert len(plan_cache) == 0
+    assert "sqlglot_schema" not in db.catalog._derived
+    # The schema fingerprint is computed once per version of the catalog
+    fingerprint = db.schema_fingerprint
+    _ = blend(
+        query="SELECT * FROM w WHERE {{starts_with('D', 'w::Name')}} = 1",
+        db=db,
+        ingredients={starts_with},
+    )
+    assert len(plan_cache) == 1
+    assert db.catalog._derived["schema_fingerprint"] == fingerprint
+    db.execute_to_list("ALTER TABLE w ADD COLUMN Age INTEGER")
+    assert db.schema_fingerprint != fingerprint
+
+
+def test_ingredient_outputs_substituted_in_ast(db):
+    """String literals which look like table references shouldn't be rewritten
+    when we point `w` to its session table.
+    """
+    smoothie = blend(
+        query="""
+        SELECT Name, 'w' AS source, ' w.Name ' AS label FROM w
+        WHERE {{starts_with('T', 'w::Name')}} = 1
+        """,
+        db=db,
+        ingredients={starts_with},
+    )
+    assert smoothie.df.to_dict(orient="records") == [
+        {"Name": "Tony", "source": "w", "label": " w.Name "}
+    ]
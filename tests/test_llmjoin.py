@@ -0,0 +1,185 @@
+import pytest
+from typing import List
+import pandas as pd
+import guidance
+
+from blendsql import blend, LLMJoin
+from blendsql.ingredients import JoinIngredient
+from blendsql.db import Pandas
+from blendsql.ingredients.builtin.join.main import (
+    get_join_candidates,
+    make_join_predictions,
+)
+from blendsql._fuzzy_index import get_fuzzy_index
+from tests.utils import DummyRemoteModel
+
+FIRST_NAMES = ["joshua", "bob", "ron", "colby", "maria", "li", "ahmed", "sofia"]
+LAST_NAMES = ["fields", "brown", "ryan", "mules", "garcia", "wei", "khan", "rossi"]
+NAMES = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+TITLES = [f"{name} (athlete)" for name in NAMES]
+
+
+class no_model_join(JoinIngredient):
+    """Only keeps the alignments made before `run()` is called."""
+
+    def run(self, left_values: List[str], right_values: List[str], **kwargs) -> dict:
+        return {}
+
+
+QUERY = """
+SELECT players.name, documents.title FROM documents
+JOIN {{
+    LLMJoin(
+        'Align name to document title',
+        left_on='players::name',
+        right_on='documents::title'
+    )
+}}
+"""
+
+
+@pytest.fixture(scope="session")
+def db() -> Pandas:
+    return Pandas(
+        {
+            "players": pd.DataFrame({"name": NAMES}),
+            "documents": pd.DataFrame({"title": TITLES[::-1]}),
+        }
+    )
+
+
+def test_join_candidates_contain_match():
+    candidates = get_join_candidates(NAMES, TITLES, num_candidates=5)
+    assert all(len(c) == 5 for c in candidates)
+    # The best candidate for each name should be its own title
+    assert [c[0] for c in candidates] == TITLES
+    # With few enough right values, everything is a candidate
+    assert get_join_candidates(NAMES[:2], TITLES[:3], num_candidates=5) == [
+        TITLES[:3],
+        TITLES[:3],
+    ]
+
+
+def test_fuzzy_index_reused(db):
+    index = get_fuzzy_index(db, "documents", "title", TITLES)
+    # Same values in a different order share an index
+    assert get_fuzzy_index(db, "documents", "title", TITLES[::-1]) is index
+    assert index.best_matches(["bob brown", "joshua fields", "zzz"], threshold=0.5) == {
+        "bob brown": "bob brown (athlete)",
+        "joshua fields": "joshua fields (athlete)",
+    }
+    # Excluded values are never matched
+    assert (
+        index.best_matches(
+            ["bob brown"], threshold=0.0, exclude={"bob brown (athlete)"}
+        )["bob brown"]
+        != "bob brown (athlete)"
+    )
+    model = DummyRemoteModel(caching=False)
+    for _ in range(2):
+        smoothie = blend(
+            # Without a question, we first try to align values without the Model
+            query=QUERY.replace("'Align name to document title',", ""),
+            db=db,
+            ingredients={LLMJoin},
+            default_model=model,
+        )
+        assert dict(zip(smoothie.df["name"], smoothie.df["title"])) == dict(
+            zip(NAMES, TITLES)
+        )
+        # The index of 'documents.title' is kept on the catalog
+        assert get_fuzzy_index(db, "documents", "title", TITLES) is index
+    # Everything got aligned by the index, without calling the Model
+    assert model.num_calls == 0
+    # If the values of the column changed, we build a new index
+    assert get_fuzzy_index(db, "documents", "title", TITLES[1:]) is not index
+
+
+def test_fuzzy_alignment_matches_skrub():
+    """Aligning with `FuzzyIndex` should give the same matches as the `skrub.Joiner`
+    (with `max_dist=0.9`) that `JoinIngredient` used to use.
+    """
+    skrub = pytest.importorskip("skrub")
+    left_values = NAMES[:10] + ["zzz qqq", "xylophone", "bob", "nhl draft"]
+    right_values = TITLES[:20] + ["nhl draft"]
+    db = Pandas(
+        {
+            "players": pd.DataFrame({"name": left_values}),
+            "documents": pd.DataFrame({"title": right_values}),
+        }
+    )
+    # Exact matches are made before fuzzy alignment
+    outer = [value for value in left_values if value not in right_values]
+    inner = [value for value in right_values if value not in left_values]
+    res = skrub.Joiner(
+        pd.DataFrame(inner, columns=["in"]),
+        main_key="out",
+        aux_key="in",
+        max_dist=0.9,
+        add_match_info=False,
+    ).fit_transform(pd.DataFrame(outer, columns=["out"]))
+    expected = res.dropna(subset=["in"]).set_index("out")["in"].to_dict()
+    expected["nhl draft"] = "nhl draft"
+    assert len(expected) < len(left_values)
+    smoothie = blend(
+        query=QUERY.replace("'Align name to document title',", "").replace(
+            "LLMJoin", "no_model_join"
+        ),
+        db=db,
+        ingredients={no_model_join},
+    )
+    # Anything not aligned before calling the Model is dropped by `no_model_join`
+    assert dict(zip(smoothie.df["name"], smoothie.df["title"])) == expected
+
+
+def test_join_blocks_prompts(db):
+    model = DummyRemoteModel(caching=False)
+    smoothie = blend(
+        query=QUERY,
+        db=db,
+        ingredients={
+            LLMJoin.from_args(use_skrub_joiner=False, num_candidates=5, block_size=10)
+        },
+        default_model=model,
+    )
+    assert dict(zip(smoothie.df["name"], smoothie.df["title"])) == dict(
+        zip(NAMES, TITLES)
+    )
+    assert model.num_calls == -(-len(NAMES) // 10)
+    # Each left value should be sent to the Model exactly once
+    assert all(len(prompt["answer"]) <= 10 for prompt in model.prompts)
+    assert sum(len(prompt["answer"]) for prompt in model.prompts) == len(NAMES)
+
+
+def test_concurrent_join_blocks(db):
+    model = DummyRemoteModel(latency=0.05, caching=False)
+    smoothie = blend(
+        query=QUERY,
+        db=db,
+        ingredients={
+            LLMJoin.from_args(
+                use_skrub_joiner=False,
+                num_candidates=5,
+                block_size=10,
+                max_concurrency=4,
+            )
+        },
+        default_model=model,
+    )
+    assert dict(zip(smoothie.df["name"], smoothie.df["title"])) == dict(
+        zip(NAMES, TITLES)
+    )
+    assert 1 < model.max_in_flight <= 4
+
+
+def test_join_predictions_without_candidates():
+    # Each value has a single option, so the answers are forced
+    lm = guidance.models.Mock(echo=False) + make_join_predictions(
+        left_values=["bob brown", "ron ryan"],
+        right_values=["ron ryan (athlete)"],
+        candidates={"bob brown": ["bob brown (athlete)"]},
+    )
+    assert lm["bob brown"] == "bob brown (athlete)"
+    # 'ron ryan' has no candidates, so it picks from all right values,
+    #   rather than from the candidates of the value before it
+    assert lm["ron ryan"] == "ron ryan (athlete)"
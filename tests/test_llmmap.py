@@ -0,0 +1,305 @@
+import json
+import asyncio
+import pytest
+import pandas as pd
+from typing import List
+
+from blendsql import blend, ablend, LLMMap
+from blendsql.db import Pandas
+from blendsql.models import MemoryCache
+from blendsql.ingredients import MapIngredient
+from blendsql._constants import MAP_BATCH_SIZE
+from tests.utils import DummyRemoteModel
+
+NUM_VALUES = MAP_BATCH_SIZE * 6 + 3
+
+
+@pytest.fixture(scope="session")
+def db() -> Pandas:
+    return Pandas(
+        pd.DataFrame(
+            {
+                "name": ["x" * (i + 1) for i in range(NUM_VALUES)],
+                "nickname": ["y" * (i % 7 + 1) for i in range(NUM_VALUES)],
+            }
+        ),
+        tablename="w",
+    )
+
+
+def test_concurrent_map_preserves_order(db):
+    model = DummyRemoteModel(latency=0.05, caching=False)
+    smoothie = blend(
+        query="""
+        SELECT name, {{LLMMap('How long is this?', 'w::name')}} AS length FROM w
+        """,
+        db=db,
+        ingredients={LLMMap.from_args(max_concurrency=4, batch_size=MAP_BATCH_SIZE)},
+        default_model=model,
+    )
+    assert smoothie.df["length"].tolist() == smoothie.df["name"].str.len().tolist()
+    assert 1 < model.max_in_flight <= 4
+    # Usage tracking should still count each batch exactly once
+    assert model.num_calls == -(-NUM_VALUES // MAP_BATCH_SIZE)
+    assert len(model.prompts) == model.num_calls
+
+
+def test_ablend_awaits_model_on_event_loop(db):
+    model = DummyRemoteModel(latency=0.05, caching=False)
+    query = """
+    SELECT name, {{LLMMap('How long is this?', 'w::name')}} AS length FROM w
+    """
+
+    async def run_many():
+        return await asyncio.gather(
+            *[
+                ablend(
+                    query=query,
+                    db=db,
+                    ingredients={LLMMap.from_args(batch_size=MAP_BATCH_SIZE)},
+                    default_model=model,
+                )
+                for _ in range(4)
+            ]
+        )
+
+    for smoothie in asyncio.run(run_many()):
+        assert smoothie.df["length"].tolist() == smoothie.df["name"].str.len().tolist()
+    # Every request was awaited with the native async client, which was only created once
+    assert (
+        model.num_async_calls == model.num_calls == 4 * -(-NUM_VALUES // MAP_BATCH_SIZE)
+    )
+    assert model.num_async_clients == 1
+    # Each LLMMap sends its batches one-by-one, so any overlap comes from
+    #   queries against the same `Database` running at once
+    assert 1 < model.max_in_flight <= 4
+
+
+def test_sequential_map_by_default(db):
+    model = DummyRemoteModel(caching=False)
+    smoothie = blend(
+        query="""
+        SELECT name, {{LLMMap('How long is this?', 'w::name')}} AS length FROM w
+        """,
+        db=db,
+        ingredients={LLMMap},
+        default_model=model,
+    )
+    assert smoothie.df["length"].tolist() == smoothie.df["name"].str.len().tolist()
+    assert model.max_in_flight == 1
+
+
+def test_independent_map_calls_run_in_parallel(db):
+    model = DummyRemoteModel(latency=0.05, caching=False)
+    smoothie = blend(
+        query="""
+        SELECT name, nickname,
+        {{LLMMap('How long is this?', 'w::name')}} AS name_length,
+        {{LLMMap('How many characters?', 'w::nickname')}} AS nickname_length
+        FROM w
+        """,
+        db=db,
+        ingredients={LLMMap},
+        default_model=model,
+        max_concurrency=2,
+    )
+    assert smoothie.df["name_length"].tolist() == smoothie.df["name"].str.len().tolist()
+    assert (
+        smoothie.df["nickname_length"].tolist()
+        == smoothie.df["nickname"].str.len().tolist()
+    )
+    # Each LLMMap sends its batches one-by-one, so any overlap comes from the two ingredients
+    assert model.max_in_flight == 2
+
+
+def test_dependent_map_calls_run_in_order(db):
+    """Both calls create a column named 'How long is this?',
+    so the second needs to wait on the first to pick a new name.
+    """
+    query = """
+    SELECT * FROM w
+    WHERE {{LLMMap('How long is this?', 'w::name')}} > 90
+    OR {{LLMMap('How long is this?', 'w::nickname')}} > 6
+    """
+    sequential_model = DummyRemoteModel(caching=False)
+    sequential_smoothie = blend(
+        query=query,
+        db=db,
+        ingredients={LLMMap},
+        default_model=sequential_model,
+    )
+    model = DummyRemoteModel(latency=0.05, caching=False)
+    smoothie = blend(
+        query=query,
+        db=db,
+        ingredients={LLMMap},
+        default_model=model,
+        max_concurrency=2,
+    )
+    pd.testing.assert_frame_equal(smoothie.df, sequential_smoothie.df)
+    assert model.max_in_flight == 1
+
+
+def test_value_cache_only_maps_unseen_values(db):
+    model = DummyRemoteModel(caching=True, cache=MemoryCache())
+    query = """
+    SELECT name, {{LLMMap('How long is this?', 'w::name')}} AS length FROM w
+    WHERE LENGTH(name) <= :max_length
+    """
+    smoothie = blend(
+        query=query.replace(":max_length", "20"),
+        db=db,
+        ingredients={LLMMap.from_args(batch_size=MAP_BATCH_SIZE)},
+        default_model=model,
+    )
+    assert smoothie.df["length"].tolist() == smoothie.df["name"].str.len().tolist()
+    assert model.num_calls == -(-20 // MAP_BATCH_SIZE)
+    # Only the values we haven't seen before should get sent to the Model
+    model.num_calls = 0
+    smoothie = blend(
+        query=query.replace(":max_length", str(NUM_VALUES)),
+        db=db,
+        ingredients={LLMMap.from_args(batch_size=MAP_BATCH_SIZE)},
+        default_model=model,
+    )
+    assert smoothie.df["length"].tolist() == smoothie.df["name"].str.len().tolist()
+    assert smoothie.meta.num_values_passed == NUM_VALUES - 20
+    assert model.num_calls == -(-(NUM_VALUES - 20) // MAP_BATCH_SIZE)
+    # A different question shouldn't reuse the values above
+    model.num_calls = 0
+    _ = blend(
+        query=query.replace(":max_length", "20").replace(
+            "How long is this?", "How long is it?"
+        ),
+        db=db,
+        ingredients={LLMMap.from_args(batch_size=MAP_BATCH_SIZE)},
+        default_model=model,
+    )
+    assert model.num_calls == -(-20 // MAP_BATCH_SIZE)
+    # Nor should anything else which changes the prompt
+    for table_to_title, ingredient in [
+        ({"w": "Some names"}, LLMMap.from_args(batch_size=MAP_BATCH_SIZE)),
+        (
+            None,
+            LLMMap.from_args(batch_size=MAP_BATCH_SIZE, list_options_in_prompt=False),
+        ),
+    ]:
+        model.num_calls = 0
+        _ = blend(
+            query=query.replace(":max_length", "20"),
+            db=db,
+            ingredients={ingredient},
+            default_model=model,
+            table_to_title=table_to_title,
+        )
+        assert model.num_calls == -(-20 // MAP_BATCH_SIZE)
+
+
+class length_missing_last(MapIngredient):
+    """Like `get_length`, but if `missing_last` is set, never answers for the last value."""
+
+    missing_last = False
+
+    def run(self, values: List[str], **kwargs) -> List[int]:
+        if type(self).missing_last:
+            values = values[:-1]
+        return [len(value) for value in values]
+
+
+def test_value_cache_with_missing_answers(db, monkeypatch):
+    model = DummyRemoteModel(caching=True, cache=MemoryCache())
+    query = (
+        "SELECT name, {{length_missing_last('How long?', 'w::name')}} AS length FROM w"
+    )
+    # Cache answers for every other value, including the last one
+    _ = blend(
+        query=query + f" WHERE LENGTH(name) % 2 = {NUM_VALUES % 2}",
+        db=db,
+        ingredients={length_missing_last},
+        default_model=model,
+    )
+    monkeypatch.setattr(length_missing_last, "missing_last", True)
+    smoothie = blend(
+        query=query,
+        db=db,
+        ingredients={length_missing_last},
+        default_model=model,
+    )
+    df = smoothie.df.dropna()
+    assert len(df) == NUM_VALUES - 1
+    # Each value keeps its own answer, even with one missing in between
+    assert df["length"].tolist() == df["name"].str.len().tolist()
+
+
+def test_trace(db):
+    model = DummyRemoteModel(caching=False)
+    query = """
+    SELECT name, {{LLMMap('How long is this?', 'w::name')}} AS length FROM w
+    """
+    assert (
+        blend(query=query, db=db, ingredients={LLMMap}, default_model=model).meta.trace
+        is None
+    )
+    model = DummyRemoteModel(caching=False)
+    smoothie = blend(
+        query=query,
+        db=db,
+        ingredients={LLMMap.from_args(max_concurrency=4)},
+        default_model=model,
+        trace=True,
+    )
+    trace = smoothie.meta.trace
+    spans = list(trace.iter_spans())
+    (ingredient_span,) = [s for s in spans if s.name == "ingredient"]
+    assert ingredient_span.attributes["ingredient"] == "LLMMAP"
+    assert ingredient_span.attributes["num_batches"] == model.num_calls
+    # Model calls from the concurrent batches are still nested under their ingredient
+    assert [s.name for s in ingredient_span.children].count(
+        "model.predict"
+    ) == model.num_calls
+    assert {"parse", "merge", "final_query", "db.execute_to_df"}.issubset(
+        trace.seconds_by_name()
+    )
+    chrome_trace = trace.to_chrome_trace()
+    assert len(chrome_trace["traceEvents"]) == len(spans)
+    assert all(e["dur"] >= 0 for e in chrome_trace["traceEvents"])
+    assert json.loads(trace.to_json())["name"] == "blend"
+
+
+def test_map_batches_sized_by_token_budget(db):
+    query = """
+    SELECT nickname, {{LLMMap('How long is this?', 'w::nickname')}} AS length FROM w
+    """
+    model = DummyRemoteModel(caching=False)
+    smoothie = blend(query=query, db=db, ingredients={LLMMap}, default_model=model)
+    assert smoothie.df["length"].tolist() == smoothie.df["nickname"].str.len().tolist()
+    # Only 7 distinct short values, so they should all fit in a single batch
+    assert model.num_calls == 1
+    # A smaller budget means more, smaller batches
+    model = DummyRemoteModel(caching=False, map_batch_token_budget=40)
+    smoothie = blend(query=query, db=db, ingredients={LLMMap}, default_model=model)
+    assert smoothie.df["length"].tolist() == smoothie.df["nickname"].str.len().tolist()
+    assert model.num_calls == 4
+
+
+def test_map_resplits_mismatched_batches():
+    # The DummyRemoteModel can't find values spanning multiple lines in its prompt,
+    #   so it returns one answer too few for any batch containing one
+    values = ["a", "bb", "c\nc", "dddd", "eeeee"]
+    model = DummyRemoteModel(caching=False)
+    smoothie = blend(
+        query="""
+        SELECT name, {{LLMMap('How long is this?', 'w::name')}} AS length FROM w
+        """,
+        db=Pandas(pd.DataFrame({"name": values}), tablename="w"),
+        ingredients={LLMMap},
+        default_model=model,
+    )
+    lengths = dict(zip(smoothie.df["name"], smoothie.df["length"]))
+    assert [str(lengths[value]) for value in ["a", "bb", "dddd", "eeeee"]] == [
+        "1",
+        "2",
+        "4",
+        "5",
+    ]
+    assert model.num_calls > 1
@@ -0,0 +1,76 @@
+import pytest
+import pandas as pd
+
+from blendsql import blend, LLMQA
+from blendsql.db import Pandas
+from blendsql.ingredients.builtin.qa.main import select_context_rows
+from tests.utils import DummyRemoteModel
+
+NUM_ROWS = 2000
+
+
+@pytest.fixture(scope="session")
+def db() -> Pandas:
+    return Pandas(
+        pd.DataFrame(
+            {
+                "title": [f"Document {i}" for i in range(NUM_ROWS)],
+                "content": [
+                    "Sydney is 120 miles east of Goulburn."
+                    if i == 1234
+                    else f"This is some filler text about topic number {i}."
+                    for i in range(NUM_ROWS)
+                ],
+            }
+        ),
+        tablename="documents",
+    )
+
+
+def test_select_context_rows():
+    model = DummyRemoteModel(caching=False)
+    context = pd.DataFrame(
+        {
+            "city": ["Paris", "Sydney", "Rome", "Goulburn"],
+            "country": ["France", "Australia", "Italy", "Australia"],
+        }
+    )
+    # Everything fits, so nothing changes
+    assert select_context_rows(
+        context, "Which city is in Australia?", model=model, token_budget=100
+    ).equals(context)
+    selected = select_context_rows(
+        context, "Which city is in Australia?", model=model, token_budget=16
+    )
+    # The most relevant rows, in their original order
+    assert selected["city"].tolist() == ["Sydney", "Goulburn"]
+    # We always keep at least one row
+    assert (
+        len(select_context_rows(context, "Australia", model=model, token_budget=1)) == 1
+    )
+
+
+def test_qa_context_fits_token_budget(db):
+    query = """
+    SELECT {{
+        LLMQA(
+            'Which city is located 120 miles west of Sydney?',
+            (SELECT title, content FROM documents)
+        )
+    }}
+    """
+    model = DummyRemoteModel(caching=False, qa_context_token_budget=None)
+    _ = blend(query=query, db=db, ingredients={LLMQA}, default_model=model)
+    assert len(model.prompts[-1]["context"]) == NUM_ROWS
+    model = DummyRemoteModel(caching=False, qa_context_token_budget=200)
+    smoothie = blend(
+        query=query, db=db, ingredients={LLMQA}, default_model=model, trace=True
+    )
+    context = model.prompts[-1]["context"]
+    assert 1 < len(context) < NUM_ROWS
+    assert "Document 1234" in [row["title"] for row in context]
+    (ingredient_span,) = [
+        s for s in smoothie.meta.trace.iter_spans() if s.name == "ingredient"
+    ]
+    assert ingredient_span.attributes["num_context_rows"] == NUM_ROWS
+    assert ingredient_span.attributes["num_selected_context_rows"] == len(context)
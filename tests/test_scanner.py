@@ -0,0 +1,26 @@
+import pytest
+
+from blendsql.grammars._peg_grammar import grammar
+from blendsql.grammars._scanner import scan_ingredients
+
+
+@pytest.mark.parametrize(
+    "query",
+    [
+        "SELECT * FROM w",
+        "{{A()}}",
+        "SELECT * FROM w WHERE {{ LLMMap ( 'Is a city?' , 'w::name' ) }} = TRUE",
+        "{{LLMMap('q', 'w::x', options='a;b', k=10, f=1.5, g=-2.5)}}",
+        "{{LLMQA('q', (SELECT COUNT(*) FROM t WHERE x = 'a(b' -- c)\n ), options=(SELECT 1))}}",
+        "{{LLMQA('q' 'x')}} {{f(, 'x')}} {{f('a''b')}}",
+        """{{f('it\\'s \\n x', "dq")}}""",
+        "{{ {{f('a')}} }} {{f(-1)}} {{f(1.)}} {{f(k1=1)}} {{f(a=1, 'x')}} {{f(x)}}",
+        "{{f('a''b'\n(4.5\\'\\')''))}}",
+        "{{f( ( SELECT  a ,b FROM  \"t t\" ) )}} AND {{g(k = 'v' , j=2)}}",
+        "SELECT {{A()}}, {{B()}} FROM w JOIN {{C()}} WHERE {{D()}} = 1",
+    ],
+)
+def test_scan_ingredients_matches_peg_grammar(query):
+    assert list(scan_ingredients(query)) == [
+        (res.as_dict(), start, end) for res, start, end in grammar.scanString(query)
+    ]
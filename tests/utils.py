@@ -1,6 +1,16 @@
+import re
+import asyncio
+import time
+import threading
 import pandas as pd
 from typing import Iterable, List, Union
 from blendsql.ingredients import MapIngredient, QAIngredient, JoinIngredient
+from blendsql.ingredients.generate import (
+    generate,
+    agenerate,
+    dispatch_to_event_loop,
+)
+from blendsql.models import RemoteModel
 from blendsql.db.utils import single_quote_escape
 
 
@@ -74,3 +84,79 @@ def assert_equality(smoothie, sql_df: pd.DataFrame, args: List[str] = None):
     pd.testing.assert_frame_equal(
         blendsql_df, sql_df, check_like=True, check_dtype=False
     )
+
+
+class DummyRemoteModel(RemoteModel):
+    """A `RemoteModel` that answers `MapProgram` prompts with the length of each value,
+    and `JoinProgram` prompts by aligning each left value to the right value starting with it.
+    Tracks how many requests are in-flight at once, so we can test concurrent dispatch.
+    Within `ablend()`, requests are made with `agenerate`, which counts them in `num_async_calls`.
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        super().__init__(
+            model_name_or_path="dummy-remote",
+            requires_config=False,
+            tokenizer=None,
+            **kwargs,
+        )
+        self.latency = latency
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.num_async_calls = 0
+        self.num_async_clients = 0
+        self._in_flight_lock = threading.Lock()
+
+    def _load_model(self):
+        return None
+
+    def _load_async_client(self):
+        self.num_async_clients += 1
+        return object()
+
+    def _setup(self, **kwargs):
+        return None
+
+    def start_request(self) -> None:
+        with self._in_flight_lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def end_request(self) -> None:
+        with self._in_flight_lock:
+            self.in_flight -= 1
+
+
+def dummy_remote_answer(prompt: str) -> str:
+    if "Left Values:" in prompt:
+        # Values for the current join come after the last 'Left Values:' header
+        left, right = prompt.rsplit("Left Values:", 1)[-1].split("Right Values:")
+        left_values = left.strip().splitlines()
+        right_values = right.split("Output:")[0].strip().splitlines()
+        return "\n".join(
+            f"{l};{next((r for r in right_values if r.startswith(l)), '-')}"
+            for l in left_values
+        )
+    # Values for the current question come after the last 'Values:' header
+    values = re.findall(r"^`(.*)`$", prompt.rsplit("Values:", 1)[-1], flags=re.M)
+    return ";".join(str(len(value)) for value in values)
+
+
+@generate.register(DummyRemoteModel)
+@dispatch_to_event_loop
+def generate_dummy_remote(model: DummyRemoteModel, prompt: str, **kwargs) -> str:
+    model.start_request()
+    time.sleep(model.latency)
+    model.end_request()
+    return dummy_remote_answer(prompt)
+
+
+@agenerate.register(DummyRemoteModel)
+async def agenerate_dummy_remote(model: DummyRemoteModel, prompt: str, **kwargs) -> str:
+    model.get_async_client()
+    model.start_request()
+    await asyncio.sleep(model.latency)
+    model.end_request()
+    with model._in_flight_lock:
+        model.num_async_calls += 1
+    return dummy_remote_answer(prompt)